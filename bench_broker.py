@@ -0,0 +1,134 @@
+"""
+Measures cross-worker delivery latency of the Unix socket broker.
+
+Starts several worker processes on one broker socket, the same way uvicorn
+workers share BROKER_URL. The first worker pings the others in turn, one
+message in flight at a time, and records the round trip of each ping/pong.
+A burst of back-to-back pings then gives a rough throughput figure.
+Only message_broker is imported, so no database is touched.
+
+Usage:
+    python bench_broker.py --workers 4 --messages 5000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from message_broker import UnixSocketBroker
+
+
+async def run_worker(index: int, workers: int, path: str, messages: int, burst: int, results):
+    broker = UnixSocketBroker(path)
+    ready = set()
+    pongs = {}
+    done = asyncio.Event()
+    all_ready = asyncio.Event()
+
+    async def handler(message: dict):
+        kind = message["kind"]
+        if index == 0:
+            if kind == "ready":
+                ready.add(message["worker"])
+                if len(ready) == workers - 1:
+                    all_ready.set()
+            elif kind == "pong":
+                waiter = pongs.pop(message["seq"], None)
+                if waiter:
+                    waiter.set_result(time.perf_counter())
+        else:
+            if kind == "bench_hello":
+                broker.publish({"kind": "ready", "worker": index})
+            elif kind == "ping" and message["to"] == index:
+                broker.publish({"kind": "pong", "seq": message["seq"]})
+            elif kind == "done":
+                done.set()
+
+    async def on_connected():
+        # Whoever joins last triggers the handshake, so nobody misses it
+        if index == 0:
+            broker.publish({"kind": "bench_hello"})
+        else:
+            broker.publish({"kind": "ready", "worker": index})
+
+    await broker.start(handler, on_connected)
+
+    if index != 0:
+        await done.wait()
+        await broker.stop()
+        return
+
+    await asyncio.wait_for(all_ready.wait(), timeout=30)
+    loop = asyncio.get_running_loop()
+
+    async def ping(seq: int) -> float:
+        waiter = loop.create_future()
+        pongs[seq] = waiter
+        sent = time.perf_counter()
+        broker.publish({"kind": "ping", "seq": seq, "to": 1 + seq % (workers - 1)})
+        return await waiter - sent
+
+    for seq in range(min(200, messages)): # Warm-up
+        await ping(seq)
+    samples = [await ping(seq) for seq in range(messages, 2 * messages)]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(ping(seq) for seq in range(2 * messages, 2 * messages + burst)))
+    burst_seconds = time.perf_counter() - started
+
+    results.put({
+        "hub": broker.is_hub,
+        "samples": samples,
+        "burst_per_second": burst / burst_seconds,
+    })
+    broker.publish({"kind": "done"})
+    await asyncio.sleep(0.1)
+    await broker.stop()
+
+
+def worker_main(index, workers, path, messages, burst, results):
+    asyncio.run(run_worker(index, workers, path, messages, burst, results))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--burst", type=int, default=5000)
+    args = parser.parse_args()
+    if args.workers < 2:
+        parser.error("--workers must be at least 2")
+
+    path = os.path.join(tempfile.mkdtemp(), "bench-broker.sock")
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker_main, args=(i, args.workers, path, args.messages, args.burst, results))
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    result = results.get(timeout=300)
+    for process in processes:
+        process.join(timeout=10)
+
+    samples_us = [s * 1e6 for s in result["samples"]]
+    print(f"Workers: {args.workers} (pinger is {'the hub' if result['hub'] else 'a client'})")
+    print(f"Round trips: {len(samples_us)}")
+    print(f"  p50  {percentile(samples_us, 50):8.1f} us")
+    print(f"  p95  {percentile(samples_us, 95):8.1f} us")
+    print(f"  p99  {percentile(samples_us, 99):8.1f} us")
+    print(f"  max  {max(samples_us):8.1f} us")
+    print(f"  mean {statistics.mean(samples_us):8.1f} us")
+    print(f"Burst throughput: {result['burst_per_second']:.0f} round trips/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Benchmarks the API endpoint by endpoint, plus websocket fan-out.
+
+Meant to run against a server filled by generate_data.py: it logs in as
+generated users (userN@example.com), hits each endpoint on its own for a
+fixed time and records throughput and p50/p95/p99 latency. It then connects
+a user and their friends over the chat socket and measures presence fan-out
+(time until every friend sees "online") and chat delivery latency. Results
+are written as JSON; pass --compare with an earlier file to see the change.
+
+    DATABASE_URL=sqlite:///./bench.db python generate_data.py --users 5000 --events 2000 ...
+    DATABASE_URL=sqlite:///./bench.db uvicorn main:app --port 8000
+    python benchmark.py --url http://127.0.0.1:8000 --output results.json
+    python benchmark.py --output after.json --compare results.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import time
+from datetime import datetime
+
+import httpx
+import websockets
+
+from loadtest import run_level
+
+ENDPOINTS = {
+    "events": "/events",
+    "events_page": "/events?limit=20",
+    "events_nearby": "/events/nearby?lat=30.3558&lng=76.3645&radius_km=2",
+    "event_carpools": "/events/{event_id}/carpool",
+    "friends": "/friends",
+    "friends_overview": "/friends/overview",
+    "friend_requests_received": "/friends/requests/received",
+    "carpool_requests_sent": "/carpool/requests/sent",
+    "users_me": "/users/me",
+    "chat_history": "/chat/history/{friend_id}",
+}
+
+
+def percentiles(samples) -> dict:
+    ordered = sorted(samples) or [0.0]
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+    return {"count": len(samples), "mean_ms": statistics.mean(ordered) * 1000, "p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99)}
+
+
+async def login(client: httpx.AsyncClient, email: str, password: str) -> dict:
+    response = await client.post("/users/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    me = (await client.get("/users/me", headers=headers)).json()
+    return {"id": me["id"], "email": email, "headers": headers, "token": response.json()["access_token"]}
+
+
+async def login_many(client: httpx.AsyncClient, emails, password: str, parallel: int = 4):
+    """Logs in a batch of users a few at a time (login is deliberately slow)."""
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def one(email):
+        async with semaphore:
+            return await login(client, email, password)
+    return await asyncio.gather(*(one(email) for email in emails))
+
+
+async def bench_endpoints(args, users, event_id: int, friend_id: int) -> dict:
+    headers = [user["headers"] for user in users]
+    results = {}
+    names = args.endpoints.split(",") if args.endpoints else list(ENDPOINTS)
+    print(f"{'endpoint':<26} {'req/s':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for name in names:
+        path = ENDPOINTS[name].format(event_id=event_id, friend_id=friend_id)
+        result = await run_level(args.url, headers, [path], args.concurrency, args.duration)
+        result["path"] = path
+        results[name] = result
+        print(f"{name:<26} {result['rps']:>9.1f} {result['p50_ms']:>6.1f}ms {result['p95_ms']:>6.1f}ms {result['p99_ms']:>6.1f}ms {result['errors']:>7}")
+    return results
+
+
+def ws_url(base: str, user: dict) -> str:
+    return f"{base.replace('http', 'ws', 1)}/ws/chat/{user['id']}?token={user['token']}"
+
+
+async def bench_websocket(args, hub: dict, friends) -> dict:
+    """Presence fan-out and chat delivery latency between `hub` and their connected friends."""
+    loop = asyncio.get_running_loop()
+    online_waiters = {}
+    chat_latencies = []
+    chat_done = asyncio.Event()
+    expected_chats = len(friends) * args.ws_messages
+
+    async def read_friend(socket, friend_id):
+        async for raw in socket:
+            message = json.loads(raw)
+            if message.get("type") == "status" and message["status"] == "online" and message["user_id"] == hub["id"]:
+                waiter = online_waiters.get(friend_id)
+                if waiter and not waiter.done():
+                    waiter.set_result(time.perf_counter())
+
+    async def read_hub(socket):
+        async for raw in socket:
+            message = json.loads(raw)
+            if message.get("receiver_id") == hub["id"] and message.get("content", "").startswith("bench:"):
+                chat_latencies.append(time.perf_counter() - float(message["content"][6:]))
+                if len(chat_latencies) >= expected_chats:
+                    chat_done.set()
+
+    friend_sockets = [await websockets.connect(ws_url(args.url, friend)) for friend in friends]
+    readers = [asyncio.create_task(read_friend(socket, friend["id"])) for socket, friend in zip(friend_sockets, friends)]
+
+    # Presence fan-out: the hub reconnects and every friend must see it come online
+    fanout = []
+    for _ in range(args.ws_rounds):
+        online_waiters.clear()
+        online_waiters.update({friend["id"]: loop.create_future() for friend in friends})
+        started = time.perf_counter()
+        hub_socket = await websockets.connect(ws_url(args.url, hub))
+        arrivals = await asyncio.wait_for(asyncio.gather(*online_waiters.values()), timeout=30)
+        fanout.append(max(arrivals) - started)
+        await hub_socket.close()
+        await asyncio.sleep(0.05)
+
+    # Chat delivery: every friend sends to the hub at once
+    hub_socket = await websockets.connect(ws_url(args.url, hub))
+    hub_reader = asyncio.create_task(read_hub(hub_socket))
+
+    async def send_all(socket):
+        for _ in range(args.ws_messages):
+            await socket.send(json.dumps({"receiver_id": hub["id"], "content": f"bench:{time.perf_counter()}"}))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send_all(socket) for socket in friend_sockets))
+    try:
+        await asyncio.wait_for(chat_done.wait(), timeout=60)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+
+    for task in readers + [hub_reader]:
+        task.cancel()
+    for socket in friend_sockets + [hub_socket]:
+        await socket.close()
+
+    return {
+        "friends_connected": len(friends),
+        "presence_fanout": percentiles(fanout),
+        "chat_delivery": {
+            **percentiles(chat_latencies),
+            "sent": expected_chats,
+            "lost": expected_chats - len(chat_latencies),
+            "messages_per_second": len(chat_latencies) / elapsed,
+        },
+    }
+
+
+def compare(current: dict, baseline: dict):
+    print(f"\nCompared with {baseline.get('label') or baseline.get('started_at')}:")
+    print(f"{'endpoint':<26} {'req/s':>16} {'p95':>20}")
+    for name, result in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        rps_change = (result["rps"] / before["rps"] - 1) * 100 if before["rps"] else 0.0
+        print(f"{name:<26} {result['rps']:>8.1f} ({rps_change:+5.1f}%) {before['p95_ms']:>7.1f} -> {result['p95_ms']:>6.1f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--password", default="password", help="password of the generated users")
+    parser.add_argument("--first-user", type=int, default=1, help="id of the first generated user to log in as")
+    parser.add_argument("--users", type=int, default=8, help="users the HTTP workers are spread over")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint")
+    parser.add_argument("--endpoints", help=f"comma-separated subset of: {', '.join(ENDPOINTS)}")
+    parser.add_argument("--ws-friends", type=int, default=50, help="friends connected for the websocket phase (0 to skip it)")
+    parser.add_argument("--ws-rounds", type=int, default=20, help="presence fan-out rounds")
+    parser.add_argument("--ws-messages", type=int, default=20, help="chat messages sent by each friend")
+    parser.add_argument("--label", help="name stored with the results, e.g. a commit")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    started_at = datetime.now().isoformat(timespec="seconds")
+    async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+        # The first generated user with friends is the websocket hub
+        emails = [f"user{user_id}@example.com" for user_id in range(args.first_user, args.first_user + args.users)]
+        users = await login_many(client, emails, args.password)
+        hub = users[0]
+        friend_list = (await client.get("/friends", headers=hub["headers"])).json()
+        events = (await client.get("/events?limit=50", headers=hub["headers"])).json()
+        event_id = events[0]["id"] if events else 1
+        friend_id = friend_list[0]["id"] if friend_list else hub["id"]
+
+        endpoints = await bench_endpoints(args, users, event_id, friend_id)
+
+        websocket = None
+        if args.ws_friends and friend_list:
+            friends = await login_many(client, [friend["email"] for friend in friend_list[:args.ws_friends]], args.password)
+            websocket = await bench_websocket(args, hub, friends)
+            fanout, chat = websocket["presence_fanout"], websocket["chat_delivery"]
+            print(f"\nwebsocket with {len(friends)} friends online:")
+            print(f"  presence fan-out  p50 {fanout['p50_ms']:.1f}ms  p95 {fanout['p95_ms']:.1f}ms  p99 {fanout['p99_ms']:.1f}ms")
+            print(f"  chat delivery     p50 {chat['p50_ms']:.1f}ms  p95 {chat['p95_ms']:.1f}ms  p99 {chat['p99_ms']:.1f}ms  "
+                  f"{chat['messages_per_second']:.0f} msg/s, {chat['lost']} lost")
+
+    results = {
+        "label": args.label,
+        "started_at": started_at,
+        "url": args.url,
+        "host": platform.node(),
+        "config": {"concurrency": args.concurrency, "duration": args.duration, "users": args.users,
+                   "ws_friends": args.ws_friends, "ws_rounds": args.ws_rounds, "ws_messages": args.ws_messages},
+        "endpoints": endpoints,
+        "websocket": websocket,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
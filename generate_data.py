@@ -0,0 +1,280 @@
+"""
+Fills the database with synthetic data for load testing.
+
+Resets the schema with reset_db.py (unless --keep), then bulk inserts users,
+events with tags, weighted interests, event joins, friendships, carpools and
+chat messages in batches. Output is reproducible for a given --seed. Every
+generated account is userN@example.com / username userN with the same
+password (--password), which is what benchmark.py logs in with.
+
+Usage:
+    python generate_data.py --users 50000 --events 20000 --interests 1000000 \\
+        --friendships 500000 --messages 5000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select, text
+
+from main import (
+    CarpoolGroup, CarpoolRequest, ChatMessage, Event, EventTag, FriendRequest, Tag,
+    User, UserEvent, UserInterest, conversation_key, engine, geohash_encode, get_password_hash,
+    interest_norm, pack_interests,
+)
+from reset_db import reset_db
+
+BASE_TAGS = [
+    "productive", "tech", "fest", "chill", "music", "art", "wild", "dance", "late-night",
+    "workshop", "movie", "food", "sports", "coding", "quiz", "gaming", "photography", "theatre",
+]
+VENUES = [
+    "Main Auditorium", "The Student Cafe", "Gymnasium Hall", "Computer Lab 3", "Tan Auditorium",
+    "COS", "Fete Area", "Lawn", "Cafeteria", "Campus Grounds", "Games Room",
+]
+CAMPUS_LAT, CAMPUS_LNG = 30.3558, 76.3645
+WORDS = ["night", "jam", "meetup", "session", "showcase", "league", "social", "talk", "lab", "open", "finals", "walk"]
+
+
+def insert_rows(connection, model, rows, batch_size: int) -> int:
+    """Inserts an iterable of row dicts with executemany, one batch at a time."""
+    batch = []
+    total = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            connection.execute(insert(model), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        connection.execute(insert(model), batch)
+        total += len(batch)
+    return total
+
+
+def next_id(connection, model) -> int:
+    return (connection.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def sync_sequences(connection, models):
+    """Moves Postgres serial sequences past the explicitly inserted ids."""
+    if connection.dialect.name != "postgresql":
+        return
+    for model in models:
+        table = model.__tablename__
+        connection.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+        ))
+
+
+def interest_counts(rng: random.Random, total: int, users: int, cap: int):
+    """Yields a per-user interest count averaging total / users, at most `cap`."""
+    mean = total / users if users else 0
+    for _ in range(users):
+        yield min(cap, rng.randint(0, round(2 * mean)))
+
+
+def unique_pairs(rng: random.Random, user_ids, count: int):
+    """Yields up to `count` distinct unordered pairs of different users."""
+    seen = set()
+    limit = len(user_ids) * (len(user_ids) - 1) // 2
+    while len(seen) < min(count, limit):
+        a, b = rng.choice(user_ids), rng.choice(user_ids)
+        pair = (min(a, b), max(a, b))
+        if a != b and pair not in seen:
+            seen.add(pair)
+            yield pair
+
+
+def unique_joins(rng: random.Random, user_ids, event_ids, count: int):
+    """Yields up to `count` distinct (user, event) pairs."""
+    seen = set()
+    limit = len(user_ids) * len(event_ids)
+    while len(seen) < min(count, limit):
+        pair = (rng.choice(user_ids), rng.choice(event_ids))
+        if pair not in seen:
+            seen.add(pair)
+            yield pair
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    tag_names = BASE_TAGS + [f"topic-{i}" for i in range(max(0, args.tags - len(BASE_TAGS)))]
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    password_hash = get_password_hash(args.password) # One hash for everyone; argon2 per row would take hours
+    step = time.perf_counter()
+
+    def report(label: str, count: int):
+        nonlocal step
+        elapsed = time.perf_counter() - step
+        print(f"  {label:<18} {count:>10,} rows in {elapsed:6.1f}s")
+        step = time.perf_counter()
+
+    with engine.begin() as connection:
+        # --- Tags ---
+        existing_tags = dict(connection.execute(select(Tag.name, Tag.id)).all())
+        tag_id = next_id(connection, Tag)
+        new_tags = []
+        for name in tag_names:
+            if name not in existing_tags:
+                existing_tags[name] = tag_id
+                new_tags.append({"id": tag_id, "name": name})
+                tag_id += 1
+        report("tags", insert_rows(connection, Tag, new_tags, args.batch_size))
+
+        # --- Users ---
+        first_user = next_id(connection, User)
+        user_ids = range(first_user, first_user + args.users)
+        user_interests = {}
+        for user_id, count in zip(user_ids, interest_counts(rng, args.interests, args.users, len(tag_names))):
+            user_interests[user_id] = {name: round(rng.uniform(1.0, 10.0), 2) for name in rng.sample(tag_names, count)}
+
+        def users():
+            for user_id in user_ids:
+                # Users carry their interests packed by tag id as well (see pack_interests)
+                weights = {existing_tags[name]: score for name, score in user_interests[user_id].items()}
+                yield {
+                    "id": user_id,
+                    "email": f"user{user_id}@example.com",
+                    "username": f"user{user_id}",
+                    "first_name": f"First{user_id}",
+                    "last_name": f"Last{user_id}",
+                    "hashed_password": password_hash,
+                    "interests": ",".join(list(user_interests[user_id])[:5]),
+                    "interest_vector": pack_interests(weights),
+                    "interest_norm": interest_norm(weights),
+                }
+        report("users", insert_rows(connection, User, users(), args.batch_size))
+
+        report("user_interests", insert_rows(connection, UserInterest, (
+            {"user_id": user_id, "interest": interest, "score": score}
+            for user_id, interests in user_interests.items()
+            for interest, score in interests.items()
+        ), args.batch_size))
+        user_interests = None
+
+        # --- Events ---
+        first_event = next_id(connection, Event)
+        event_ids = range(first_event, first_event + args.events)
+        event_tags = {}
+        events = []
+        for event_id in event_ids:
+            tags = rng.sample(tag_names, rng.randint(1, 4))
+            event_tags[event_id] = tags
+            start_at = now + timedelta(hours=rng.randint(-24 * 30, 24 * 90))
+            lat = CAMPUS_LAT + rng.uniform(-0.05, 0.05)
+            lng = CAMPUS_LNG + rng.uniform(-0.05, 0.05)
+            events.append({
+                "id": event_id,
+                "title": f"{rng.choice(tags).title()} {rng.choice(WORDS)} #{event_id}",
+                "description": f"Synthetic event {event_id} about {', '.join(tags)}.",
+                "start_time": start_at, # Core inserts take column names, not the ORM attribute names
+                "end_time": start_at + timedelta(hours=rng.randint(1, 4)),
+                "venue": rng.choice(VENUES),
+                "lat": lat,
+                "lng": lng,
+                "geohash": geohash_encode(lat, lng),
+                "tags": ",".join(tags),
+                "owner_id": rng.choice(user_ids) if args.users and rng.random() < 0.2 else None,
+            })
+        report("events", insert_rows(connection, Event, events, args.batch_size))
+        events = None
+        report("event_tags", insert_rows(connection, EventTag, (
+            {"event_id": event_id, "tag_id": existing_tags[name], "position": position}
+            for event_id, tags in event_tags.items()
+            for position, name in enumerate(tags)
+        ), args.batch_size))
+        event_tags = None
+
+        # --- Joins ---
+        report("user_events", insert_rows(connection, UserEvent, (
+            {"user_id": user_id, "event_id": event_id}
+            for user_id, event_id in unique_joins(rng, user_ids, event_ids, args.joins)
+        ), args.batch_size))
+
+        # --- Friendships ---
+        friend_pairs = list(unique_pairs(rng, user_ids, args.friendships + args.pending_requests))
+        accepted = friend_pairs[:args.friendships]
+        created_at = now - timedelta(days=30)
+        report("friend_requests", insert_rows(connection, FriendRequest, (
+            {
+                "requester_id": a if i % 2 else b,
+                "receiver_id": b if i % 2 else a,
+                "status": "accepted" if i < len(accepted) else "pending",
+                "created_at": created_at,
+            }
+            for i, (a, b) in enumerate(friend_pairs)
+        ), args.batch_size))
+        friend_pairs = None
+
+        # --- Carpools ---
+        first_group = next_id(connection, CarpoolGroup)
+        group_ids = range(first_group, first_group + (args.carpools if args.users and args.events else 0))
+        report("carpool_groups", insert_rows(connection, CarpoolGroup, (
+            {
+                "id": group_id,
+                "event_id": rng.choice(event_ids),
+                "owner_id": rng.choice(user_ids),
+                "location": rng.choice(VENUES),
+                "time": f"{rng.randint(6, 22):02d}:{rng.choice(['00', '30'])}",
+                "capacity": rng.randint(2, 6),
+            }
+            for group_id in group_ids
+        ), args.batch_size))
+        report("carpool_requests", insert_rows(connection, CarpoolRequest, (
+            {"group_id": group_id, "requester_id": rng.choice(user_ids), "status": rng.choice(["pending", "accepted", "rejected"])}
+            for group_id in group_ids
+            for _ in range(rng.randint(0, 2 * args.carpool_requests))
+        ), args.batch_size))
+
+        # --- Chat ---
+        # Messages go between friends, spread over the last 30 days in id order
+        first_message = next_id(connection, ChatMessage)
+        seconds_per_message = 30 * 24 * 3600 / max(args.messages, 1)
+
+        def messages():
+            for i in range(args.messages if accepted else 0):
+                a, b = accepted[rng.randrange(len(accepted))]
+                sender, receiver = (a, b) if rng.random() < 0.5 else (b, a)
+                yield {
+                    "id": first_message + i,
+                    "sender_id": sender,
+                    "receiver_id": receiver,
+                    "conversation_key": conversation_key(sender, receiver),
+                    "content": f"message {i} from {sender}",
+                    "timestamp": created_at + timedelta(seconds=i * seconds_per_message),
+                }
+        report("chat_messages", insert_rows(connection, ChatMessage, messages(), args.batch_size))
+
+        sync_sequences(connection, [Tag, User, UserInterest, Event, FriendRequest, CarpoolGroup, CarpoolRequest, ChatMessage])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--tags", type=int, default=200, help="size of the tag/interest vocabulary")
+    parser.add_argument("--interests", type=int, default=1000000, help="weighted user interest rows")
+    parser.add_argument("--joins", type=int, default=200000, help="event joins (user_events rows)")
+    parser.add_argument("--friendships", type=int, default=500000, help="accepted friend requests")
+    parser.add_argument("--pending-requests", type=int, default=25000, help="pending friend requests")
+    parser.add_argument("--carpools", type=int, default=10000)
+    parser.add_argument("--carpool-requests", type=int, default=2, help="average requests per carpool group")
+    parser.add_argument("--messages", type=int, default=5000000, help="chat messages")
+    parser.add_argument("--password", default="password", help="password shared by every generated user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--keep", action="store_true", help="add to the existing data instead of resetting it")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if not args.keep:
+        reset_db()
+    print("Generating synthetic data...")
+    generate(args)
+    print(f"Done in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+HTTP load test for the API.
+
+Signs up a throwaway user, then keeps N concurrent clients requesting the
+given paths (round robin) for a fixed time at each concurrency level, and
+prints throughput and latency percentiles per level. Run it against two
+builds of the server to compare them, e.g.:
+
+    uvicorn main:app --port 8000
+    python loadtest.py --url http://127.0.0.1:8000 --concurrency 1,16,64,256 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import secrets
+import statistics
+import time
+
+import httpx
+
+DEFAULT_PATHS = ["/events", "/friends/overview", "/users/me", "/carpool/requests/sent"]
+
+
+async def login(client: httpx.AsyncClient) -> dict:
+    """Creates a throwaway account and returns its auth headers."""
+    name = f"loadtest_{secrets.token_hex(4)}"
+    password = secrets.token_urlsafe(12)
+    response = await client.post("/users/signup", json={"email": f"{name}@example.com", "username": name, "password": password})
+    response.raise_for_status()
+    response = await client.post("/users/login", data={"username": name, "password": password})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_level(url: str, headers, paths, concurrency: int, duration: float) -> dict:
+    """Runs one concurrency level; `headers` may be a list to spread workers over several users."""
+    headers_list = headers if isinstance(headers, list) else [headers]
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker(offset: int):
+            nonlocal errors
+            worker_headers = headers_list[offset % len(headers_list)]
+            i = offset
+            while time.perf_counter() < deadline:
+                path = paths[i % len(paths)]
+                i += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path, headers=worker_headers)
+                    if response.status_code >= 400:
+                        errors += 1
+                        continue
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    ordered = sorted(latencies) or [0.0]
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": pick(50),
+        "p95_ms": pick(95),
+        "p99_ms": pick(99),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", default="1,16,64,256", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+    parser.add_argument("--path", action="append", dest="paths", help=f"path to request (repeatable, default {DEFAULT_PATHS})")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        headers = await login(client)
+
+    paths = args.paths or DEFAULT_PATHS
+    results = []
+    print(f"{'conc':>5} {'req/s':>9} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for level in (int(value) for value in args.concurrency.split(",")):
+        result = await run_level(args.url, headers, paths, level, args.duration)
+        results.append(result)
+        print(
+            f"{result['concurrency']:>5} {result['rps']:>9.1f} {result['mean_ms']:>7.1f}ms "
+            f"{result['p50_ms']:>6.1f}ms {result['p95_ms']:>6.1f}ms {result['p99_ms']:>6.1f}ms {result['errors']:>7}"
+        )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"url": args.url, "paths": paths, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
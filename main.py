@@ -1,19 +1,39 @@
-from fastapi import FastAPI, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, HTTPException, Depends, status, WebSocket, WebSocketDisconnect, Query, Request, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, ForeignKey, or_, and_
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, LargeBinary, ForeignKey, Index, case, or_, and_, tuple_, inspect, text, select, union, insert, update, func
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from pydantic import BaseModel, EmailStr, field_validator
-from typing import List, Optional, Dict
+from sqlalchemy import event as sa_event
+from sqlalchemy.exc import DBAPIError, IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker, Session, validates, relationship, joinedload, selectinload, contains_eager, lazyload, load_only, deferred
+from pydantic import BaseModel, EmailStr
+from typing import List, Optional, Dict, Set, Tuple, NamedTuple
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 import os
 import secrets
+import time
+import asyncio
+import json
+import threading
+import re
+import bisect
+import heapq
+from contextvars import ContextVar
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
+import numpy as np
+import httpx
+import orjson
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+from google.auth import jwt as google_jwt
+from message_broker import BROKER_HANDOVER_SECONDS, Broker, make_broker
 
 load_dotenv()
 
@@ -38,6 +58,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"], # Lets the frontend read the feed cursor and ETag
 )
 
 @app.get("/")
@@ -50,13 +71,221 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL")
 if not SQLALCHEMY_DATABASE_URL:
     SQLALCHEMY_DATABASE_URL = "sqlite:///./event_aggregator.db"
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# --- Connection Pool ---
+# Applied to each engine (sync and async), so the process can hold up to
+# twice DB_POOL_SIZE + DB_MAX_OVERFLOW connections.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800")) # Under typical managed-Postgres idle cutoffs
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+class PoolMetrics:
+    """Live counters for one engine's connection pool."""
+    def __init__(self):
+        self.lock = threading.Lock() # The sync pool is shared by worker threads
+        self.checkouts = 0
+        self.connections_created = 0
+        self.connect_errors = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_waits = deque(maxlen=1000)
+
+    def record_wait(self, seconds: float):
+        with self.lock:
+            self.waits += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            self.recent_waits.append(seconds)
+
+    def snapshot(self, pool) -> dict:
+        with self.lock:
+            recent = sorted(self.recent_waits)
+        pick = lambda pct: round(recent[min(len(recent) - 1, int(len(recent) * pct / 100))] * 1000, 3) if recent else 0.0
+        return {
+            "pool_size": pool.size(),
+            "max_overflow": DB_MAX_OVERFLOW,
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0), # Negative until pool_size connections exist
+            "checkouts": self.checkouts,
+            "connections_created": self.connections_created,
+            "connect_errors": self.connect_errors,
+            "timeouts": self.timeouts,
+            "wait_avg_ms": round(self.total_wait / self.waits * 1000, 3) if self.waits else 0.0,
+            "wait_max_ms": round(self.max_wait * 1000, 3),
+            "wait_p95_ms": pick(95), # Over the last 1000 checkouts
+            "wait_p99_ms": pick(99),
+        }
+
+def metered_pool(base):
+    """Subclass of a QueuePool class that times every connection checkout."""
+    class MeteredPool(base):
+        metrics = PoolMetrics()
+
+        def _do_get(self):
+            # Covers queueing for a free connection and opening an overflow one
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            except PoolTimeoutError:
+                self.metrics.timeouts += 1
+                raise
+            except Exception:
+                self.metrics.connect_errors += 1
+                raise
+            finally:
+                self.metrics.record_wait(time.perf_counter() - started)
+    return MeteredPool
+
+def pool_options(pool_base) -> dict:
+    url = make_url(SQLALCHEMY_DATABASE_URL)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {} # In-memory SQLite needs its single shared connection
+    return {
+        "poolclass": metered_pool(pool_base),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def instrument_engine(sync_engine):
+    metrics = getattr(sync_engine.pool, "metrics", None)
+    if metrics is None:
+        return
+
+    @sa_event.listens_for(sync_engine, "connect")
+    def count_connect(dbapi_connection, connection_record):
+        metrics.connections_created += 1
+
+    @sa_event.listens_for(sync_engine, "checkout")
+    def count_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.checkouts += 1
+
+def pool_stats(sync_engine) -> dict:
+    metrics = getattr(sync_engine.pool, "metrics", None)
+    if metrics is None:
+        return {"pool": type(sync_engine.pool).__name__}
+    return metrics.snapshot(sync_engine.pool)
+
+# The sync engine serves migrations, seeding, scripts and background threads;
+# request handlers use the async engine so queries don't block the event loop.
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **pool_options(QueuePool))
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def async_database_url(url: str):
+    """Maps the configured database URL onto its asyncio driver."""
+    url = make_url(url)
+    if url.get_backend_name() == "postgresql":
+        query = dict(url.query)
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode") # asyncpg's name for it
+        return url.set(drivername="postgresql+asyncpg", query=query)
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite")
+    return url
+
+async_engine = create_async_engine(async_database_url(SQLALCHEMY_DATABASE_URL), **pool_options(AsyncAdaptedQueuePool))
+instrument_engine(async_engine.sync_engine)
+# Objects stay loaded after commit; expired attributes can't lazy-load in async code
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+# --- Request Metrics ---
+# Prometheus metrics, served at /metrics. With several workers, point
+# PROMETHEUS_MULTIPROC_DIR at an empty shared directory so /metrics
+# aggregates every process.
+N_PLUS_ONE_QUERY_THRESHOLD = int(os.getenv("N_PLUS_ONE_QUERY_THRESHOLD", "20"))
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"])
+REQUEST_COUNT = Counter("http_requests_total", "HTTP requests served", ["method", "route", "status"])
+REQUEST_DB_QUERIES = Histogram("http_request_db_queries", "Database statements per HTTP request", ["method", "route"], buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Database time per HTTP request", ["method", "route"])
+REQUEST_N_PLUS_ONE = Counter("http_requests_n_plus_one_total", "HTTP requests over N_PLUS_ONE_QUERY_THRESHOLD statements", ["method", "route"])
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Database statement latency")
+WS_MESSAGE_SECONDS = Histogram("websocket_message_duration_seconds", "Time to handle one incoming websocket chat message")
+
+class QueryStats:
+    """Statements run on behalf of one request."""
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+# Set per request by the metrics middleware; None outside requests (background threads, startup)
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+def instrument_queries(sync_engine):
+    @sa_event.listens_for(sync_engine, "before_cursor_execute")
+    def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @sa_event.listens_for(sync_engine, "after_cursor_execute")
+    def record_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_SECONDS.observe(elapsed)
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+
+    @sa_event.listens_for(sync_engine, "handle_error")
+    def drop_query_timer(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+instrument_queries(engine)
+instrument_queries(async_engine.sync_engine)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    stats = QueryStats()
+    reset_token = current_query_stats.set(stats)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        current_query_stats.reset(reset_token)
+        # Label by route template so /events/1 and /events/2 share a series
+        route = request.scope.get("route")
+        route = route.path if route is not None else "unmatched"
+        method = request.method
+        REQUEST_LATENCY.labels(method, route).observe(elapsed)
+        REQUEST_COUNT.labels(method, route, str(status_code)).inc()
+        REQUEST_DB_QUERIES.labels(method, route).observe(stats.count)
+        REQUEST_DB_SECONDS.labels(method, route).observe(stats.seconds)
+        if stats.count > N_PLUS_ONE_QUERY_THRESHOLD:
+            REQUEST_N_PLUS_ONE.labels(method, route).inc()
+            print(f"Possible N+1: {method} {route} ran {stats.count} queries")
+
 # --- Security & JWT Setup ---
 # Using argon2 for password hashing (better compatibility with Python 3.13+)
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+# Changing the cost parameters upgrades stored hashes on each user's next login.
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536")) # KiB per hash
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "4"))
+pwd_context = CryptContext(
+    schemes=["argon2"],
+    deprecated="auto",
+    argon2__rounds=ARGON2_TIME_COST,
+    argon2__memory_cost=ARGON2_MEMORY_COST,
+    argon2__parallelism=ARGON2_PARALLELISM,
+)
+
+# Hashing runs on its own small thread pool (argon2-cffi releases the GIL).
+# Past HASH_POOL_MAX_PENDING queued jobs, requests get 503 instead of piling up.
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_POOL_MAX_PENDING = int(os.getenv("HASH_POOL_MAX_PENDING", "32"))
 
 # This key should be stored securely, e.g., in an environment variable.
 # It's used to sign the JWTs.
@@ -68,14 +297,57 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="users/login")
 oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="users/login", auto_error=False)
 
 # --- Security Helper Functions ---
-def verify_password(plain_password, hashed_password):
-    """Compares a plain password with a hashed one."""
-    return pwd_context.verify(plain_password, hashed_password)
-
 def get_password_hash(password):
     """Generates a hash for a plain password."""
     return pwd_context.hash(password)
 
+class HashingPool:
+    """Bounded executor that keeps argon2 work off the event loop."""
+    def __init__(self, workers: int, max_pending: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="argon2")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0 # Running plus queued; only touched on the event loop
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self.total_seconds += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_ms": round(self.total_seconds / self.completed * 1000, 3) if self.completed else 0.0,
+        }
+
+hashing_pool = HashingPool(HASH_POOL_WORKERS, HASH_POOL_MAX_PENDING)
+
+async def hash_password(password: str) -> str:
+    return await hashing_pool.run(get_password_hash, password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Returns (verified, new_hash); new_hash is set when the stored hash uses outdated parameters."""
+    return await hashing_pool.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict):
     """Creates a JWT access token."""
     to_encode = data.copy()
@@ -84,6 +356,108 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# --- Date Helpers ---
+def parse_event_datetime(value):
+    """Parses an ISO 8601 string into a naive datetime (campus wall-clock time)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(tzinfo=None)
+
+# --- Geospatial Helpers ---
+# Events carry a geohash so map queries can use a plain B-tree index on both
+# SQLite and Postgres: every geohash cell is a contiguous range of strings.
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9 # ~5m cells
+GEOHASH_MAX_CELLS = 16 # Upper bound on index ranges per bounding-box query
+EARTH_RADIUS_KM = 6371.0
+
+def geohash_encode(lat: float, lng: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits, bit_count, even = 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        rng, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+def geohash_cell_end(cell: str) -> Optional[str]:
+    """
+    Exclusive upper bound of the geohashes inside `cell`: the next cell of the
+    same precision, or None past the last one. Geohashes are only digits and
+    lowercase letters, which sort the same in byte order and in the usual
+    locale collations, so this bound holds on a plain String column. (A
+    sentinel like "{" does not: en_US ignores punctuation.)
+    """
+    cell = cell.rstrip(GEOHASH_BASE32[-1])
+    if not cell:
+        return None
+    return cell[:-1] + GEOHASH_BASE32[GEOHASH_BASE32.index(cell[-1]) + 1]
+
+def geohash_cell_condition(column, cell: str):
+    """Filter on `column` for the geohashes inside `cell`, as one index range."""
+    end = geohash_cell_end(cell)
+    return column >= cell if end is None else and_(column >= cell, column < end)
+
+def geohash_cell_size(precision: int):
+    """Returns the (lat, lng) size in degrees of a cell at this precision."""
+    lng_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+def geohash_cells_for_bounds(south: float, west: float, north: float, east: float) -> List[str]:
+    """Returns the finest set of at most GEOHASH_MAX_CELLS cells covering the box."""
+    if west > east:
+        # Antimeridian crossing: cover both halves
+        return (geohash_cells_for_bounds(south, west, north, 180.0)
+                + geohash_cells_for_bounds(south, -180.0, north, east))
+
+    best = [""] # Precision 0 matches everything
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        lat_size, lng_size = geohash_cell_size(precision)
+        lat_cells = range(int((south + 90) // lat_size), int((min(north, 89.999999) + 90) // lat_size) + 1)
+        lng_cells = range(int((west + 180) // lng_size), int((min(east, 179.999999) + 180) // lng_size) + 1)
+        if len(lat_cells) * len(lng_cells) > GEOHASH_MAX_CELLS:
+            break
+        best = sorted({
+            geohash_encode(-90 + (i + 0.5) * lat_size, -180 + (j + 0.5) * lng_size, precision)
+            for i in lat_cells for j in lng_cells
+        })
+    return best
+
+def bounds_around(lat: float, lng: float, radius_km: float):
+    """Returns the (south, west, north, east) box enclosing a circle."""
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    lng_delta = 180.0 if cos_lat < 1e-9 else min(180.0, math.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)))
+    south, north = max(-90.0, lat - lat_delta), min(90.0, lat + lat_delta)
+    if lng_delta >= 180.0:
+        return south, -180.0, north, 180.0
+    west = (lng - lng_delta + 540) % 360 - 180
+    east = (lng + lng_delta + 540) % 360 - 180
+    return south, west, north, east
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
 # --- SQLAlchemy Models (Database Tables) ---
 
 # Association table for User-Event (Many-to-Many)
@@ -99,6 +473,8 @@ class UserInterest(Base):
     user_id = Column(Integer, index=True)
     interest = Column(String, index=True)
     score = Column(Float, default=1.0) # Default weight
+    # One row per (user, interest); the target of upsert_user_interests()
+    __table_args__ = (Index("uq_user_interests_user_interest", "user_id", "interest", unique=True),)
 
 # Represents the 'users' table in the database.
 class User(Base):
@@ -112,6 +488,10 @@ class User(Base):
     # interests column is kept for backward compatibility/initial selection, 
     # but UserInterest table is the source of truth for weights.
     interests = Column(String, default="") 
+    # The UserInterest weights packed by tag id (see pack_interests) and their
+    # Euclidean norm, rewritten on every interest change so scoring reads one row
+    interest_vector = deferred(Column(LargeBinary, nullable=True))
+    interest_norm = deferred(Column(Float, nullable=True))
 
 # Represents the 'events' table in the database.
 class Event(Base):
@@ -119,14 +499,51 @@ class Event(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     description = Column(String)
-    start_at = Column(String) # Storing as string for simplicity, can be DateTime
-    end_at = Column(String)
-    venue = Column(String)
+    # Stored in the indexed start_time/end_time columns; the legacy string
+    # start_at/end_at columns are backfilled into them by run_migrations().
+    start_at = Column("start_time", DateTime, index=True)
+    end_at = Column("end_time", DateTime, index=True)
+    venue = Column(String, index=True)
     lat = Column(Float)
     lng = Column(Float)
-    tags = Column(String) # Storing as a comma-separated string
+    geohash = Column(String(GEOHASH_PRECISION), index=True) # Kept in sync with lat/lng
+    # tags column is kept for backward compatibility,
+    # but the event_tags table is the source of truth (see set_event_tags).
+    tags = Column(String)
     owner_id = Column(Integer, ForeignKey("users.id"), nullable=True) # Added owner_id
+    # Lets a worker tell whether its catalog snapshot is stale without reloading it
+    updated_at = Column(DateTime, index=True, default=datetime.now, onupdate=datetime.now)
+    tag_links = relationship("EventTag", order_by="EventTag.position", cascade="all, delete-orphan", lazy="selectin")
+
+    @property
+    def tag_names(self) -> List[str]:
+        return [link.tag.name for link in self.tag_links]
+
+    @validates("start_at", "end_at")
+    def validate_datetime(self, key, value):
+        # Accept ISO strings (seed data, legacy rows) as well as datetimes
+        return parse_event_datetime(value)
+
+    @validates("lat", "lng")
+    def validate_coordinates(self, key, value):
+        lat = value if key == "lat" else self.lat
+        lng = value if key == "lng" else self.lng
+        self.geohash = geohash_encode(lat, lng) if lat is not None and lng is not None else None
+        return value
+
+# Tag vocabulary shared by events and user interests
+class Tag(Base):
+    __tablename__ = "tags"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True, nullable=False)
 
+# Association table for Event-Tag (Many-to-Many)
+class EventTag(Base):
+    __tablename__ = "event_tags"
+    event_id = Column(Integer, ForeignKey("events.id"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id"), primary_key=True, index=True)
+    position = Column(Integer, default=0) # Keeps the admin's tag order
+    tag = relationship("Tag", lazy="joined")
 
 # Carpool Group Model
 class CarpoolGroup(Base):
@@ -137,6 +554,15 @@ class CarpoolGroup(Base):
     location = Column(String)
     time = Column(String)
     capacity = Column(Integer)
+    # Read-only relationships for eager loading (the columns have no FK constraints)
+    owner = relationship("User", primaryjoin="foreign(CarpoolGroup.owner_id) == User.id", viewonly=True)
+    event = relationship("Event", primaryjoin="foreign(CarpoolGroup.event_id) == Event.id", viewonly=True)
+    accepted_requests = relationship(
+        "CarpoolRequest",
+        primaryjoin="and_(foreign(CarpoolRequest.group_id) == CarpoolGroup.id, CarpoolRequest.status == 'accepted')",
+        order_by="CarpoolRequest.id",
+        viewonly=True,
+    )
     
 # Carpool Request Model
 class CarpoolRequest(Base):
@@ -145,6 +571,8 @@ class CarpoolRequest(Base):
     group_id = Column(Integer, index=True)
     requester_id = Column(Integer, index=True)
     status = Column(String, default="pending") # pending, accepted, rejected
+    requester = relationship("User", primaryjoin="foreign(CarpoolRequest.requester_id) == User.id", viewonly=True)
+    group = relationship("CarpoolGroup", primaryjoin="foreign(CarpoolRequest.group_id) == CarpoolGroup.id", viewonly=True)
 
 # Friend Request Model
 class FriendRequest(Base):
@@ -154,27 +582,231 @@ class FriendRequest(Base):
     receiver_id = Column(Integer, ForeignKey("users.id"), index=True)
     status = Column(String, default="pending") # pending, accepted, rejected
     created_at = Column(DateTime, default=datetime.now)
+    requester = relationship("User", foreign_keys=[requester_id], viewonly=True)
+    receiver = relationship("User", foreign_keys=[receiver_id], viewonly=True)
 
 # Chat Message Model
+def conversation_key(user_a: int, user_b: int) -> str:
+    """Direction-independent key for the conversation between two users."""
+    return f"{min(user_a, user_b)}:{max(user_a, user_b)}"
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    # History pages are one range scan over (conversation_key, timestamp, id). Ids come
+    # from per-worker reserved blocks, so only the timestamp gives the message order.
+    __table_args__ = (Index("ix_chat_messages_conversation_time", "conversation_key", "timestamp", "id"),)
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey("users.id"), index=True)
     receiver_id = Column(Integer, ForeignKey("users.id"), index=True)
+    conversation_key = Column(String)
     content = Column(String)
     timestamp = Column(DateTime, default=datetime.now)
 
+class IdReservation(Base):
+    """High-water marks for ids handed out in blocks on databases without sequences."""
+    __tablename__ = "id_reservations"
+    name = Column(String, primary_key=True)
+    next_id = Column(Integer, nullable=False)
+
 # Create the database tables if they don't exist
 Base.metadata.create_all(bind=engine)
 
+# --- Packed Interest Vectors ---
+# A user's interest weights keyed by tag id, stored as n little-endian uint32
+# tag ids (ascending) followed by the n float64 weights.
+def pack_interests(weights: Dict[int, float]) -> bytes:
+    tag_ids = np.array(sorted(weights), dtype="<u4")
+    values = np.array([weights[tag_id] for tag_id in tag_ids.tolist()], dtype="<f8")
+    return tag_ids.tobytes() + values.tobytes()
+
+def unpack_interests(packed: Optional[bytes]):
+    """Returns (tag ids, weights) arrays; both are empty for users without interests."""
+    count = len(packed) // 12 if packed else 0
+    if not count:
+        return np.zeros(0, dtype="<u4"), np.zeros(0, dtype="<f8")
+    return np.frombuffer(packed, dtype="<u4", count=count), np.frombuffer(packed, dtype="<f8", count=count, offset=4 * count)
+
+def interest_norm(weights: Dict[int, float]) -> float:
+    return float(np.sqrt(np.dot(list(weights.values()), list(weights.values())))) if weights else 0.0
+
+# --- Schema Migrations ---
+# create_all() only creates missing tables, so columns added to existing
+# tables are migrated here. Every step is idempotent and runs on startup.
+def migrate_event_datetimes(connection):
+    """Moves string start_at/end_at values into the indexed DateTime columns."""
+    columns = {c["name"] for c in inspect(connection).get_columns("events")}
+    events_table = Event.__table__
+
+    for column in ("start_time", "end_time"):
+        if column not in columns:
+            connection.execute(text(f"ALTER TABLE events ADD COLUMN {column} TIMESTAMP"))
+
+    if "start_at" in columns:
+        legacy_rows = connection.execute(text(
+            "SELECT id, start_at, end_at FROM events WHERE start_time IS NULL AND start_at IS NOT NULL"
+        )).fetchall()
+        for event_id, start_at, end_at in legacy_rows:
+            try:
+                values = {"start_time": parse_event_datetime(start_at), "end_time": parse_event_datetime(end_at)}
+            except ValueError:
+                print(f"Migration: could not parse dates for event {event_id}, leaving empty")
+                continue
+            connection.execute(events_table.update().where(events_table.c.id == event_id).values(**values))
+
+def migrate_event_geohash(connection):
+    """Adds and backfills the geohash column used by the map queries."""
+    columns = {c["name"] for c in inspect(connection).get_columns("events")}
+    events_table = Event.__table__
+
+    if "geohash" not in columns:
+        connection.execute(text(f"ALTER TABLE events ADD COLUMN geohash VARCHAR({GEOHASH_PRECISION})"))
+
+    missing = connection.execute(text(
+        "SELECT id, lat, lng FROM events WHERE geohash IS NULL AND lat IS NOT NULL AND lng IS NOT NULL"
+    )).fetchall()
+    for event_id, lat, lng in missing:
+        connection.execute(
+            events_table.update().where(events_table.c.id == event_id).values(geohash=geohash_encode(lat, lng))
+        )
+
+def migrate_event_updated_at(connection):
+    """Adds events.updated_at, compared by the event catalog before reloading."""
+    columns = {c["name"] for c in inspect(connection).get_columns("events")}
+    if "updated_at" not in columns:
+        connection.execute(text("ALTER TABLE events ADD COLUMN updated_at TIMESTAMP"))
+
+def migrate_event_tags(connection):
+    """Backfills event_tags from the legacy comma-separated tags column."""
+    legacy_rows = connection.execute(text(
+        "SELECT id, tags FROM events WHERE tags IS NOT NULL AND tags <> '' "
+        "AND id NOT IN (SELECT DISTINCT event_id FROM event_tags)"
+    )).fetchall()
+    if not legacy_rows:
+        return
+
+    tag_ids = dict(connection.execute(text("SELECT name, id FROM tags")).fetchall())
+    for event_id, tags in legacy_rows:
+        names = list(dict.fromkeys(tag.strip() for tag in tags.split(',') if tag.strip()))
+        for position, name in enumerate(names):
+            if name not in tag_ids:
+                tag_ids[name] = connection.execute(Tag.__table__.insert().values(name=name)).inserted_primary_key[0]
+            connection.execute(EventTag.__table__.insert().values(event_id=event_id, tag_id=tag_ids[name], position=position))
+
+def migrate_user_interest_duplicates(connection):
+    """Merges duplicate (user_id, interest) rows so the unique index can be built."""
+    existing = {index["name"] for index in inspect(connection).get_indexes("user_interests")}
+    if "uq_user_interests_user_interest" in existing:
+        return
+    # Keep the oldest row of each group with the highest score of the group
+    connection.execute(text("""
+        UPDATE user_interests SET score = (
+            SELECT MAX(dup.score) FROM user_interests dup
+            WHERE dup.user_id = user_interests.user_id AND dup.interest = user_interests.interest
+        )
+        WHERE id IN (SELECT MIN(id) FROM user_interests GROUP BY user_id, interest HAVING COUNT(*) > 1)
+    """))
+    connection.execute(text("""
+        DELETE FROM user_interests
+        WHERE id NOT IN (SELECT MIN(id) FROM user_interests GROUP BY user_id, interest)
+    """))
+
+def migrate_chat_conversation_key(connection):
+    """Adds and backfills chat_messages.conversation_key for the history index."""
+    columns = {c["name"] for c in inspect(connection).get_columns("chat_messages")}
+    if "conversation_key" not in columns:
+        connection.execute(text("ALTER TABLE chat_messages ADD COLUMN conversation_key VARCHAR"))
+
+    connection.execute(text("""
+        UPDATE chat_messages SET conversation_key = CASE
+            WHEN sender_id < receiver_id THEN CAST(sender_id AS VARCHAR) || ':' || CAST(receiver_id AS VARCHAR)
+            ELSE CAST(receiver_id AS VARCHAR) || ':' || CAST(sender_id AS VARCHAR)
+        END
+        WHERE conversation_key IS NULL
+    """))
+
+def migrate_user_interest_vectors(connection):
+    """Adds users.interest_vector/interest_norm and packs them for existing users."""
+    columns = {c["name"] for c in inspect(connection).get_columns("users")}
+    if "interest_vector" not in columns:
+        connection.execute(text(f"ALTER TABLE users ADD COLUMN interest_vector {LargeBinary().compile(dialect=connection.dialect)}"))
+    if "interest_norm" not in columns:
+        connection.execute(text("ALTER TABLE users ADD COLUMN interest_norm FLOAT"))
+
+    rows = connection.execute(text("""
+        SELECT ui.user_id, ui.interest, ui.score FROM user_interests ui
+        JOIN users u ON u.id = ui.user_id
+        WHERE u.interest_vector IS NULL AND ui.interest IS NOT NULL
+        ORDER BY ui.user_id, ui.id
+    """)).fetchall()
+    if not rows:
+        return
+    # Interests become part of the tag vocabulary
+    tag_ids = dict(connection.execute(text("SELECT name, id FROM tags")).fetchall())
+    for name in dict.fromkeys(interest for _, interest, _ in rows):
+        if name not in tag_ids:
+            tag_ids[name] = connection.execute(Tag.__table__.insert().values(name=name)).inserted_primary_key[0]
+    weights_by_user: Dict[int, Dict[int, float]] = {}
+    for user_id, interest, score in rows:
+        weights_by_user.setdefault(user_id, {})[tag_ids[interest]] = score
+    users_table = User.__table__
+    for user_id, weights in weights_by_user.items():
+        connection.execute(
+            users_table.update().where(users_table.c.id == user_id)
+            .values(interest_vector=pack_interests(weights), interest_norm=interest_norm(weights))
+        )
+
+def create_user_search_indexes(connection):
+    """Trigram indexes for user search on Postgres; SQLite searches the in-process UserSearchIndex."""
+    if connection.dialect.name != "postgresql":
+        return
+    try:
+        with connection.begin_nested():
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError as e:
+        print(f"pg_trgm is not available, user search will use the in-process index: {e}")
+        return
+    for column in ("username", "first_name", "last_name"):
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_users_{column}_trgm ON users USING gin (lower({column}) gin_trgm_ops)"))
+    # Ordered by byte value so username completion is a range scan
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_users_username_prefix ON users ((lower(username) COLLATE "C"))'))
+
+REPLACED_INDEXES = [
+    "ix_chat_messages_conversation_id", # By (conversation_key, timestamp, id) now
+]
+
+def drop_replaced_indexes(connection):
+    for name in REPLACED_INDEXES:
+        connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+def create_missing_indexes(connection):
+    """Creates indexes declared on the models for columns added by migrations."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+def run_migrations():
+    with engine.begin() as connection:
+        migrate_event_datetimes(connection)
+        migrate_event_geohash(connection)
+        migrate_event_updated_at(connection)
+        migrate_event_tags(connection)
+        migrate_user_interest_duplicates(connection)
+        migrate_chat_conversation_key(connection)
+        migrate_user_interest_vectors(connection)
+        create_user_search_indexes(connection)
+        drop_replaced_indexes(connection)
+        create_missing_indexes(connection)
+
+run_migrations()
+
 # --- Pydantic Schemas (API Data Shapes) ---
 # Defines the shape of event data returned by the API.
 class EventSchema(BaseModel):
     id: int
     title: str
     description: str
-    start_at: str
-    end_at: str
+    start_at: datetime
+    end_at: datetime
     venue: str
     tags: List[str] # The API will return tags as a list of strings
     lat: float
@@ -184,21 +816,14 @@ class EventSchema(BaseModel):
     is_joined: Optional[bool] = False # Added is_joined status
     owner_id: Optional[int] = None
 
-    @field_validator('tags', mode='before')
-    @classmethod
-    def split_tags(cls, v):
-        if isinstance(v, str):
-            return [tag.strip() for tag in v.split(',')] if v else []
-        return v
-
     class Config:
         from_attributes = True
 
 class EventCreate(BaseModel):
     title: str
     description: str
-    start_at: str
-    end_at: str
+    start_at: datetime
+    end_at: datetime
     venue: str
     lat: float
     lng: float
@@ -289,6 +914,14 @@ class FriendResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class UserSearchResult(FriendResponse):
+    is_friend: bool = False
+
+class FriendsOverview(BaseModel):
+    friends: List[FriendResponse]
+    received: List[FriendRequestResponse]
+    sent: List[FriendRequestResponse]
+
 class ChatMessageResponse(BaseModel):
     id: int
     sender_id: int
@@ -299,48 +932,233 @@ class ChatMessageResponse(BaseModel):
         from_attributes = True
 
 # --- Dependency for Database Session ---
-def get_db():
-    """Dependency to get a DB session for each request."""
-    db = SessionLocal()
-    try:
+async def get_db():
+    """Dependency to get an async DB session for each request."""
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
+# --- Authenticated Principal Cache ---
+# Decoded bearer tokens are kept for a short while so authenticated requests
+# skip jwt.decode and the users lookup. Entries never outlive the token's exp.
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+
+class Principal(NamedTuple):
+    """The authenticated user's identity; enough for endpoints that don't read the profile."""
+    id: int
+    email: str
+    username: str
+
+class PrincipalCache:
+    """LRU of bearer token -> Principal with a TTL and per-user invalidation."""
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict() # token -> (principal, expires_at)
+        self.tokens_by_user: Dict[int, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[Principal]:
+        entry = self.entries.get(token)
+        if entry is not None and time.time() < entry[1]:
+            self.entries.move_to_end(token)
+            self.hits += 1
+            return entry[0]
+        if entry is not None:
+            self.discard(token)
+        self.misses += 1
+        return None
+
+    def put(self, token: str, principal: Principal, token_exp: Optional[float]):
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        self.entries[token] = (principal, expires_at)
+        self.entries.move_to_end(token)
+        self.tokens_by_user.setdefault(principal.id, set()).add(token)
+        while len(self.entries) > self.max_entries:
+            self.discard(next(iter(self.entries)))
+
+    def discard(self, token: str):
+        entry = self.entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self.tokens_by_user.get(entry[0].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self.tokens_by_user[entry[0].id]
+
+    def invalidate_user(self, user_id: int):
+        """Drops every cached token of the user, e.g. after a profile change or deletion."""
+        for token in self.tokens_by_user.pop(user_id, ()):
+            self.entries.pop(token, None)
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_MAX_ENTRIES, PRINCIPAL_CACHE_TTL_SECONDS)
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+async def resolve_principal(token: str, db: AsyncSession, log_errors: bool = False) -> Optional[Principal]:
+    """Maps a bearer token to its Principal, or None if the token is invalid or the user is gone."""
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            print("Auth Error: No sub (email) in token")
-            raise credentials_exception
     except JWTError as e:
-        print(f"Auth Error: JWT Validation failed: {e}")
-        raise credentials_exception
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
-        raise credentials_exception
-    return user
-
-async def get_current_user_optional(token: Optional[str] = Depends(oauth2_scheme_optional), db: Session = Depends(get_db)):
-    """Returns the current user if authenticated, else None."""
-    if not token:
+        if log_errors:
+            print(f"Auth Error: JWT Validation failed: {e}")
         return None
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            return None
-    except JWTError:
+    email: str = payload.get("sub")
+    if email is None:
+        if log_errors:
+            print("Auth Error: No sub (email) in token")
+        return None
+    row = (await db.execute(select(User.id, User.email, User.username).where(User.email == email))).first()
+    if row is None:
+        return None
+    principal = Principal(*row)
+    principal_cache.put(token, principal, payload.get("exp"))
+    return principal
+
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> Principal:
+    principal = await resolve_principal(token, db, log_errors=True)
+    if principal is None:
+        raise credentials_exception()
+    return principal
+
+async def get_current_principal_optional(token: Optional[str] = Depends(oauth2_scheme_optional), db: AsyncSession = Depends(get_db)) -> Optional[Principal]:
+    """Returns the current principal if authenticated, else None."""
+    if not token:
         return None
-    user = db.query(User).filter(User.email == email).first()
+    return await resolve_principal(token, db)
+
+async def get_current_user(principal: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_db)) -> User:
+    """Loads the full ORM user, for endpoints that read or modify the profile."""
+    user = await db.get(User, principal.id)
+    if user is None:
+        principal_cache.invalidate_user(principal.id)
+        raise credentials_exception()
     return user
 
+# --- Tag Helpers ---
+def normalize_tag_names(names: List[str]) -> List[str]:
+    """Strips whitespace and drops empty and duplicate tags, keeping order."""
+    return list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+
+def get_or_create_tags(db: Session, names: List[str]) -> Dict[str, Tag]:
+    """Returns the Tag rows for the given names, creating missing ones."""
+    tags = {tag.name: tag for tag in db.query(Tag).filter(Tag.name.in_(names)).all()} if names else {}
+    missing = [name for name in names if name not in tags]
+    for name in missing:
+        tags[name] = Tag(name=name)
+        db.add(tags[name])
+    if missing:
+        db.flush() # Assign ids so later lookups in this session see them
+    return tags
+
+def set_event_tags(db: Session, event: Event, names: List[str]):
+    """Replaces an event's tags in event_tags and the legacy tags column."""
+    names = normalize_tag_names(names)
+    tags = get_or_create_tags(db, names)
+    existing = {link.tag_id: link for link in event.tag_links}
+    links = []
+    for position, name in enumerate(names):
+        link = existing.get(tags[name].id) or EventTag(tag_id=tags[name].id, tag=tags[name])
+        link.position = position
+        links.append(link)
+    event.tag_links = links
+    event.tags = ",".join(names)
+
+# --- Interest Weight Helpers ---
+JOIN_INTEREST_START = 1.5 # Weight of an interest first discovered by joining an event
+JOIN_INTEREST_BUMP = 1.0 # Added to an existing interest for each joined event with that tag
+SELECTED_INTEREST_MIN = 5.0 # Floor for interests picked manually in the profile
+
+def dialect_insert(model):
+    """INSERT construct supporting ON CONFLICT for the configured database."""
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    return dialect.insert(model)
+
+def lock_user_row(user_id: int):
+    """
+    SELECT ... FOR NO KEY UPDATE of the user's row (a no-op on SQLite, which
+    serializes writers anyway). FOR NO KEY UPDATE rather than FOR UPDATE, so
+    it doesn't deadlock with the KEY SHARE locks that foreign keys to users
+    (e.g. a user_events insert earlier in the same transaction) take.
+    """
+    return select(User.id).where(User.id == user_id).with_for_update(key_share=True)
+
+async def upsert_user_interests(db: AsyncSession, user_id: int, values: Dict[str, float], on_conflict_score):
+    """
+    Inserts or updates all of a user's interest rows in one statement.
+    `values` maps interest -> inserted score; `on_conflict_score(stmt)` returns
+    the new score expression for existing rows (stmt.excluded.score is the
+    value that would have been inserted).
+    """
+    if not values:
+        return
+    # Serializes interest writers per user until commit, so the vector
+    # repacked below always sees every other writer's rows
+    await db.execute(lock_user_row(user_id))
+    stmt = dialect_insert(UserInterest).values([
+        {"user_id": user_id, "interest": interest, "score": score}
+        for interest, score in values.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UserInterest.user_id, UserInterest.interest],
+        set_={"score": on_conflict_score(stmt)},
+    )
+    await db.execute(stmt)
+    await store_interest_vector(db, user_id, list(values))
+
+async def store_interest_vector(db: AsyncSession, user_id: int, new_interests: List[str]):
+    """Repacks the user's interest rows into users.interest_vector and interest_norm."""
+    # Interests are keyed by tag id, so make sure each one has a tag row
+    await db.execute(
+        dialect_insert(Tag).values([{"name": name} for name in new_interests]).on_conflict_do_nothing(index_elements=[Tag.name])
+    )
+    weights = dict((await db.execute(
+        select(Tag.id, UserInterest.score)
+        .join(Tag, Tag.name == UserInterest.interest)
+        .where(UserInterest.user_id == user_id)
+    )).all())
+    await db.execute(
+        update(User).where(User.id == user_id)
+        .values(interest_vector=pack_interests(weights), interest_norm=interest_norm(weights))
+    )
+
+async def bump_join_interests(db: AsyncSession, user_id: int, tag_counts: Dict[str, int]):
+    """Bumps interests for joined events; tag_counts is how many joined events carry each tag."""
+    await upsert_user_interests(
+        db,
+        user_id,
+        # A new interest starts at JOIN_INTEREST_START and gets a bump for every further event
+        {tag: JOIN_INTEREST_START + (count - 1) * JOIN_INTEREST_BUMP for tag, count in tag_counts.items()},
+        # Existing interests get count bumps: excluded.score - (START - BUMP) == count * BUMP
+        lambda stmt: UserInterest.score + stmt.excluded.score - (JOIN_INTEREST_START - JOIN_INTEREST_BUMP),
+    )
+
 # --- Database Seeding Function ---
 def seed_database():
     """Populates the database with initial data if it's empty."""
@@ -393,9 +1211,16 @@ def seed_database():
             # 2025-12-28: 1 event
             Event(title="Sunset Music Jam", description="Live music as the sun sets.", start_at="2025-12-28T18:00:00", end_at="2025-12-28T20:00:00", venue="Fete Area", tags="music,chill", lat=30.3580, lng=76.3695),
         ]
-        db.add_all(initial_events)
-        db.commit()
-        print("Seeding complete with 14 events.")
+        try:
+            for event in initial_events:
+                set_event_tags(db, event, event.tags.split(','))
+            db.add_all(initial_events)
+            db.commit()
+            print("Seeding complete with 14 events.")
+        except IntegrityError:
+            # Another worker seeded first; its tags collide with ours
+            db.rollback()
+            print("Database was seeded by another worker. Skipping seed.")
     else:
         print("Database already contains data. Skipping seed.")
     db.close()
@@ -404,6 +1229,15 @@ def seed_database():
 @app.on_event("startup")
 async def startup_event():
     seed_database()
+    chat_writer.start()
+    await manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Persist every chat message accepted before the server goes down
+    await asyncio.to_thread(chat_writer.stop)
+    await broker.stop()
+    await google_verifier.close()
 
 # --- API Endpoints ---
 @app.get("/")
@@ -414,100 +1248,759 @@ def read_root():
 async def root_head():
     return
 
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
 @app.api_route("/health", methods=["GET", "HEAD"])
 async def health_check():
     return {"status": "active"}
 
 import math # Ensure math is imported
+import hashlib
 
-@app.get("/events", response_model=List[EventSchema])
-async def get_all_events(
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional) # Use optional auth
-):
-    """Fetches all events from the database with recommendation scores (Cosine Similarity)."""
-    db_events = db.query(Event).all()
-    
-    # Get user interests and joined events if logged in
+# --- Recommendation Engine ---
+class RecommendationEngine:
+    """
+    Keeps the event catalog as a dense event x tag matrix so a user's interest
+    vector can be scored against every event in one matrix-vector product.
+    An inverted index (tag -> event ids) limits scoring to the events that
+    share at least one tag with the user; every other event scores 0.
+    Rows are updated in place when admins create, edit or delete events.
+    """
+    def __init__(self):
+        self.loaded = False
+        self.tag_index: Dict[str, int] = {}     # tag -> column
+        self.row_index: Dict[int, int] = {}     # event_id -> row
+        self.events_by_tag: Dict[str, Set[int]] = {} # tag -> event ids (inverted index)
+        self.event_ids = np.zeros(0, dtype=np.int64)
+        self.matrix = np.zeros((0, 0), dtype=np.float64)
+        self.norms = np.zeros(0, dtype=np.float64)
+
+    def load(self, events):
+        """Builds the matrix from scratch from the catalog snapshots."""
+        tag_lists: Dict[int, List[str]] = {event.id: event.tags for event in events}
+
+        self.tag_index = {}
+        self.events_by_tag = {}
+        for event_id, tags in tag_lists.items():
+            for tag in tags:
+                self.tag_index.setdefault(tag, len(self.tag_index))
+                self.events_by_tag.setdefault(tag, set()).add(event_id)
+
+        self.event_ids = np.array(list(tag_lists), dtype=np.int64)
+        self.row_index = {event_id: row for row, event_id in enumerate(tag_lists)}
+        self.matrix = np.zeros((len(tag_lists), len(self.tag_index)), dtype=np.float64)
+        self.norms = np.zeros(len(tag_lists), dtype=np.float64)
+        for row, tags in enumerate(tag_lists.values()):
+            for tag in tags:
+                self.matrix[row, self.tag_index[tag]] = 1.0
+            self.norms[row] = math.sqrt(len(tags))
+        self.loaded = True
+
+    def replace(self, other: "RecommendationEngine"):
+        """Takes over a matrix built elsewhere (off the event loop) in one step."""
+        self.__dict__.update(other.__dict__)
+
+    def _column(self, tag: str) -> int:
+        col = self.tag_index.get(tag)
+        if col is None:
+            col = len(self.tag_index)
+            self.tag_index[tag] = col
+            # Grow the matrix by one zero column for the new tag
+            self.matrix = np.hstack([self.matrix, np.zeros((self.matrix.shape[0], 1))])
+        return col
+
+    def _unlink_tags(self, event_id: int, row: int):
+        for tag, col in self.tag_index.items():
+            if self.matrix[row, col]:
+                self.events_by_tag[tag].discard(event_id)
+
+    def upsert_event(self, event_id: int, tags: List[str]):
+        """Adds or replaces the row for a single event."""
+        cols = [self._column(tag) for tag in tags]
+
+        row = self.row_index.get(event_id)
+        if row is None:
+            row = len(self.event_ids)
+            self.row_index[event_id] = row
+            self.event_ids = np.append(self.event_ids, event_id)
+            self.matrix = np.vstack([self.matrix, np.zeros((1, self.matrix.shape[1]))])
+            self.norms = np.append(self.norms, 0.0)
+        else:
+            self._unlink_tags(event_id, row)
+
+        self.matrix[row, :] = 0.0
+        # Event vector uses binary weight 1.0 per tag
+        for tag, col in zip(tags, cols):
+            self.matrix[row, col] = 1.0
+            self.events_by_tag.setdefault(tag, set()).add(event_id)
+        self.norms[row] = math.sqrt(len(tags))
+
+    def remove_event(self, event_id: int):
+        """Drops an event's row by moving the last row into its slot."""
+        row = self.row_index.pop(event_id, None)
+        if row is None:
+            return
+        self._unlink_tags(event_id, row)
+        last = len(self.event_ids) - 1
+        if row != last:
+            moved_id = int(self.event_ids[last])
+            self.event_ids[row] = moved_id
+            self.matrix[row] = self.matrix[last]
+            self.norms[row] = self.norms[last]
+            self.row_index[moved_id] = row
+        self.event_ids = self.event_ids[:last]
+        self.matrix = self.matrix[:last]
+        self.norms = self.norms[:last]
+
+    def score(self, user_interests: Dict[str, float], user_magnitude: float) -> Dict[int, float]:
+        """
+        Returns cosine similarity per event_id for the given interest weights.
+        Events sharing no tag with the user are left out (their score is 0).
+        """
+        if user_magnitude <= 0 or len(self.event_ids) == 0:
+            return {}
+        user_vector = np.zeros(len(self.tag_index), dtype=np.float64)
+        candidates: Set[int] = set()
+        for tag, weight in user_interests.items():
+            col = self.tag_index.get(tag)
+            if col is not None:
+                user_vector[col] = weight
+                candidates |= self.events_by_tag.get(tag, set())
+        if not candidates:
+            return {}
+
+        candidate_ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        rows = np.fromiter((self.row_index[event_id] for event_id in candidate_ids), dtype=np.int64, count=len(candidates))
+        dots = self.matrix[rows] @ user_vector
+        norms = self.norms[rows]
+        similarity = dots / (user_magnitude * norms) # Candidates have at least one tag, so norms > 0
+        return dict(zip(candidate_ids.tolist(), similarity.tolist()))
+
+    def score_all(self, user_interests: Dict[str, float], user_magnitude: float):
+        """Returns (event_ids, similarities) as arrays covering every event."""
+        scores = np.zeros(len(self.event_ids), dtype=np.float64)
+        similarities = self.score(user_interests, user_magnitude)
+        if similarities:
+            rows = np.fromiter((self.row_index[event_id] for event_id in similarities), dtype=np.int64, count=len(similarities))
+            scores[rows] = np.fromiter(similarities.values(), dtype=np.float64, count=len(similarities))
+        return self.event_ids.copy(), scores
+
+    def score_event(self, event_id: int, user_interests: Dict[str, float], user_magnitude: float) -> float:
+        """Cosine similarity of a single event."""
+        row = self.row_index.get(event_id)
+        if row is None or user_magnitude <= 0 or not self.norms[row]:
+            return 0.0
+        user_vector = np.zeros(len(self.tag_index), dtype=np.float64)
+        for tag, weight in user_interests.items():
+            col = self.tag_index.get(tag)
+            if col is not None:
+                user_vector[col] = weight
+        return float(self.matrix[row] @ user_vector / (user_magnitude * self.norms[row]))
+
+recommender = RecommendationEngine()
+
+# --- Event Catalog Cache ---
+EVENT_CACHE_TTL_SECONDS = float(os.getenv("EVENT_CACHE_TTL_SECONDS", "60"))
+
+class EventCatalog:
+    """
+    In-memory copy of the events table, so feed requests don't re-read it.
+    The admin endpoints write changed events through to the cache (and the
+    recommender) and tell other workers which event to re-read. A TTL check
+    compares the table's row count and latest updated_at with the snapshot
+    and only reloads in full when they differ.
+
+    A reload runs once at a time: requests arriving meanwhile keep serving
+    the current snapshot, and the new one is built in a worker thread and
+    swapped in whole.
+
+    `version` is an XOR of per-event content hashes: it changes with any
+    edit, is cheap to update, and is the same in every process serving the
+    same data, which makes it safe to use in ETags.
+    """
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.events: Dict[int, EventSchema] = {} # Snapshots with owner_id, unscored
+        self.fragments: Dict[int, bytes] = {} # Pre-encoded JSON of each event's shared fields
+        self.loaded_at: Optional[float] = None
+        self.full_loads = 0
+        self._hashes: Dict[int, int] = {}
+        self._digest = 0
+        self._fingerprint: Optional[tuple] = None
+        self._reload_lock = asyncio.Lock()
+        self._changed_during_reload: Optional[Set[int]] = None
+
+    @property
+    def version(self) -> str:
+        return f"{self._digest:040x}"
+
+    @staticmethod
+    def _fragment(snapshot: EventSchema) -> bytes:
+        """The event's JSON object up to the per-user fields, left open (no closing brace)."""
+        return orjson.dumps(snapshot.model_dump(exclude=PER_USER_EVENT_FIELDS))[:-1]
+
+    @staticmethod
+    def _hash(fragment: bytes, snapshot: EventSchema) -> int:
+        return int(hashlib.sha1(fragment + b"|" + str(snapshot.owner_id).encode()).hexdigest(), 16)
+
+    def _fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at <= self.ttl_seconds
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if self._fresh():
+            return
+        if self.loaded_at is not None and self._reload_lock.locked():
+            return # Another request is refreshing; serve the current snapshot meanwhile
+        async with self._reload_lock:
+            if not self._fresh():
+                await self._refresh(db)
+
+    @staticmethod
+    async def _read_fingerprint(db: AsyncSession) -> tuple:
+        return tuple((await db.execute(select(func.count(Event.id), func.max(Event.id), func.max(Event.updated_at)))).one())
+
+    async def _refresh(self, db: AsyncSession):
+        fingerprint = await self._read_fingerprint(db)
+        if self.loaded_at is not None and fingerprint == self._fingerprint:
+            self.loaded_at = time.monotonic() # Nothing changed since the last load
+            return
+        self._changed_during_reload = set()
+        try:
+            rows = (await db.execute(
+                select(Event.id, Event.title, Event.description, Event.start_at, Event.end_at, Event.venue, Event.lat, Event.lng, Event.owner_id)
+                .order_by(Event.id)
+            )).all()
+            tag_rows = (await db.execute(
+                select(EventTag.event_id, Tag.name).join(Tag, Tag.id == EventTag.tag_id).order_by(EventTag.event_id, EventTag.position)
+            )).all()
+            events, fragments, hashes, engine_state = await asyncio.to_thread(self._build, rows, tag_rows)
+            previous = self._digest if self.loaded_at is not None else None
+            self.events, self.fragments, self._hashes = events, fragments, hashes
+            self._digest = 0
+            for value in hashes.values():
+                self._digest ^= value
+            self._fingerprint = fingerprint
+            self.loaded_at = time.monotonic()
+            self.full_loads += 1
+            if self._digest != previous or not recommender.loaded:
+                recommender.replace(engine_state)
+        finally:
+            changed, self._changed_during_reload = self._changed_during_reload, None
+        # Writes that landed while the snapshot was being read may be missing from it
+        for event_id in changed:
+            await self.refresh_event(db, event_id)
+
+    @classmethod
+    def _build(cls, rows, tag_rows):
+        """Builds snapshots, fragments, hashes and a recommender from plain rows (runs in a thread)."""
+        tags_by_event: Dict[int, List[str]] = {}
+        for event_id, name in tag_rows:
+            tags_by_event.setdefault(event_id, []).append(name)
+        events = {
+            row[0]: EventSchema(
+                id=row[0], title=row[1], description=row[2], start_at=row[3], end_at=row[4], venue=row[5],
+                tags=tags_by_event.get(row[0], []), lat=row[6], lng=row[7], owner_id=row[8],
+            )
+            for row in rows
+        }
+        fragments = {event_id: cls._fragment(snapshot) for event_id, snapshot in events.items()}
+        hashes = {event_id: cls._hash(fragments[event_id], snapshot) for event_id, snapshot in events.items()}
+        engine_state = RecommendationEngine()
+        engine_state.load(events.values())
+        return events, fragments, hashes, engine_state
+
+    async def refresh_event(self, db: AsyncSession, event_id: int):
+        """Re-reads one event after another worker created, edited or deleted it."""
+        if self.loaded_at is None:
+            return
+        event = await db.scalar(select(Event).where(Event.id == event_id))
+        if event is None:
+            self.remove(event_id)
+        else:
+            self.put(event)
+
+    def put(self, event: Event):
+        """Writes a created or updated event through to the cache."""
+        if self.loaded_at is None:
+            return # Loaded in full on first use
+        if self._changed_during_reload is not None:
+            self._changed_during_reload.add(event.id)
+        snapshot = event_to_schema(event, include_owner=True)
+        previous = self.version
+        self._digest ^= self._hashes.get(event.id, 0)
+        self.events[event.id] = snapshot
+        self.fragments[event.id] = self._fragment(snapshot)
+        self._hashes[event.id] = self._hash(self.fragments[event.id], snapshot)
+        self._digest ^= self._hashes[event.id]
+        recommender.upsert_event(event.id, snapshot.tags)
+        feed_cache.place_event(event.id, previous, self.version)
+
+    def remove(self, event_id: int):
+        if self.loaded_at is None:
+            return
+        if self._changed_during_reload is not None:
+            self._changed_during_reload.add(event_id)
+        previous = self.version
+        self.events.pop(event_id, None)
+        self.fragments.pop(event_id, None)
+        self._digest ^= self._hashes.pop(event_id, 0)
+        recommender.remove_event(event_id)
+        feed_cache.drop_event(event_id, previous, self.version)
+
+    def stats(self) -> dict:
+        return {
+            "events": len(self.events),
+            "version": self.version,
+            "full_loads": self.full_loads,
+            "reloading": self._reload_lock.locked(),
+            "age_seconds": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at is not None else None,
+        }
+
+event_catalog = EventCatalog(EVENT_CACHE_TTL_SECONDS)
+
+# --- Event List Serialization ---
+# Event lists are written straight from the catalog's pre-encoded fragments,
+# so only the per-user fields are encoded per request and FastAPI's
+# response_model validation is skipped (the snapshots are already EventSchema).
+PER_USER_EVENT_FIELDS = {"match_score", "match_percentage", "is_joined", "owner_id"}
+
+def encode_event(event_id: int, match_score: float = 0.0, is_joined: bool = False, owner_id: Optional[int] = None) -> bytes:
+    """Completes an event's cached fragment with its per-user fields."""
+    return b"".join((
+        event_catalog.fragments[event_id],
+        b',"match_score":', orjson.dumps(float(match_score)),
+        b',"match_percentage":', str(int(match_score * 100)).encode(),
+        b',"is_joined":', b"true" if is_joined else b"false",
+        b',"owner_id":', b"null" if owner_id is None else str(owner_id).encode(),
+        b"}",
+    ))
+
+def event_list_response(items: List[bytes], response: Response) -> Response:
+    """JSON array response that keeps the headers set on the endpoint's Response parameter."""
+    return Response(content=b"[" + b",".join(items) + b"]", media_type="application/json", headers=dict(response.headers))
+
+# --- Conditional GET Helpers ---
+CACHE_CONTROL = "private, no-cache" # Per-user data; clients must revalidate with the ETag
+
+def make_etag(*parts) -> str:
+    return '"' + hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest() + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+def conditional_response(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Sets caching headers; returns a 304 response if the client copy is current."""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL, "Vary": "Authorization"}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# --- Feed Pagination Helpers ---
+# The feed is ordered by match_percentage descending, ties broken by event id.
+# A cursor is the "<match_percentage>:<event_id>" of the last item on a page.
+def feed_rank_key(match_percentage: int, event_id: int):
+    """Sort key where larger means earlier in the feed."""
+    return (match_percentage, -event_id)
+
+def encode_feed_cursor(match_percentage: int, event_id: int) -> str:
+    return f"{match_percentage}:{event_id}"
+
+def decode_feed_cursor(cursor: str):
+    try:
+        match_percentage, event_id = cursor.split(":")
+        return feed_rank_key(int(match_percentage), int(event_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def filter_events_query(query, date_from=None, date_to=None, tags=None, venue=None):
+    """Applies the /events filters as SQL conditions."""
+    if date_from:
+        # Anything still running at date_from
+        query = query.filter(Event.end_at >= date_from)
+    if date_to:
+        query = query.filter(Event.start_at < date_to)
+    if venue:
+        query = query.filter(Event.venue == venue)
+    if tags:
+        # Resolved through the tags.name and event_tags.tag_id indexes
+        tagged_event_ids = select(EventTag.event_id).join(Tag, Tag.id == EventTag.tag_id).where(Tag.name.in_(tags))
+        query = query.filter(Event.id.in_(tagged_event_ids))
+    return query
+
+def event_to_schema(event: Event, match_score: float = 0.0, is_joined: bool = False, include_owner: bool = False) -> EventSchema:
+    """Builds the API representation of an event."""
+    return EventSchema(
+        id=event.id,
+        title=event.title,
+        description=event.description,
+        start_at=event.start_at,
+        end_at=event.end_at,
+        venue=event.venue,
+        tags=event.tag_names,
+        lat=event.lat,
+        lng=event.lng,
+        match_score=match_score, # This is now the similarity score (0.0 to 1.0)
+        match_percentage=int(match_score * 100), # New field (0 to 100)
+        is_joined=is_joined,
+        owner_id=event.owner_id if include_owner else None
+    )
+
+class TagVocabulary:
+    """
+    Process-wide tag id -> name map for reading packed interest vectors.
+    Tags are never renamed or deleted, so the map only ever grows; an
+    unknown id reloads it.
+    """
+    def __init__(self):
+        self.names: Dict[int, str] = {}
+
+    async def names_for(self, db: AsyncSession, tag_ids: List[int]) -> List[str]:
+        if any(tag_id not in self.names for tag_id in tag_ids):
+            self.names = dict((await db.execute(select(Tag.id, Tag.name))).all())
+        return [self.names[tag_id] for tag_id in tag_ids]
+
+tag_vocabulary = TagVocabulary()
+
+async def load_feed_state(db: AsyncSession, current_user: Optional[Principal]):
+    """Returns (interest weights, interest magnitude, joined event ids) for the user."""
     user_interests = {}
     joined_event_ids = set()
     user_magnitude = 0.0
     
     if current_user:
-        # Fetch weighted interests
-        db_interests = db.query(UserInterest).filter(UserInterest.user_id == current_user.id).all()
-        sum_sq = 0.0
-        for ui in db_interests:
-            user_interests[ui.interest] = ui.score
-            sum_sq += ui.score * ui.score
-        user_magnitude = math.sqrt(sum_sq)
+        # Weighted interests and their norm come packed in one row
+        row = (await db.execute(select(User.interest_vector, User.interest_norm).where(User.id == current_user.id))).first()
+        if row and row.interest_vector:
+            tag_ids, weights = unpack_interests(row.interest_vector)
+            user_interests = dict(zip(await tag_vocabulary.names_for(db, tag_ids.tolist()), weights.tolist()))
+            user_magnitude = row.interest_norm
             
         # Fetch joined events
-        joined = db.query(UserEvent).filter(UserEvent.user_id == current_user.id).all()
-        joined_event_ids = {je.event_id for je in joined}
+        joined = await db.scalars(select(UserEvent.event_id).where(UserEvent.user_id == current_user.id))
+        joined_event_ids = set(joined)
+
+    return user_interests, user_magnitude, joined_event_ids
+
+def feed_etag(request: Request, current_user: Optional[Principal], feed: "UserFeed") -> str:
+    """ETag covering everything a feed response depends on."""
+    return make_etag(
+        event_catalog.version,
+        request.url.path,
+        request.url.query,
+        current_user.id if current_user else "",
+        sorted(feed.interests.items()),
+        sorted(feed.joined),
+    )
 
-    results = []
-    for event in db_events:
-        tags = event.tags.split(',') if event.tags else []
-        
-        # Calculate Cosine Similarity
-        match_percentage = 0
-        score = 0.0 # Keep raw score for sorting backup or debugging
-        
-        if current_user and user_magnitude > 0 and tags:
-            dot_product = 0.0
-            # Event vector magnitude (assuming binary weight 1.0 for each tag present)
-            # Magnitude = sqrt(1^2 + 1^2 + ... + 1^2) = sqrt(count(tags))
-            event_magnitude = math.sqrt(len(tags))
-            
-            for tag in tags:
-                # User score for this tag * Event weight (1.0)
-                dot_product += user_interests.get(tag, 0.0) * 1.0
-            
-            if event_magnitude > 0:
-                similarity = dot_product / (user_magnitude * event_magnitude)
-                match_percentage = int(similarity * 100)
-                score = similarity # Use similarity as the primary sort score
-        
-        # Create response object
-        event_resp = EventSchema(
-            id=event.id,
-            title=event.title,
-            description=event.description,
-            start_at=event.start_at,
-            end_at=event.end_at,
-            venue=event.venue,
+# --- Materialized Feeds ---
+# Each cached feed holds every catalog event in feed order, 12 bytes per event
+# per user (about 240 KB per user for 20k events), so size
+# FEED_CACHE_MAX_USERS with the catalog in mind.
+FEED_CACHE_MAX_USERS = int(os.getenv("FEED_CACHE_MAX_USERS", "250"))
+FEED_CACHE_TTL_SECONDS = float(os.getenv("FEED_CACHE_TTL_SECONDS", "600"))
+FEED_KEY_SCALE = 1 << 40 # Event ids stay below this, so id - match_percentage * scale sorts like the feed
+
+class UserFeed:
+    """
+    One user's ranked feed over the whole catalog, plus the interest and join
+    state it was ranked from. ids (int32) and scores (float64, the exact
+    match_score) are parallel arrays in feed order: highest match_percentage
+    first, ties by event id.
+    """
+    def __init__(self, interests: Dict[str, float], magnitude: float, joined: Set[int]):
+        self.interests = interests
+        self.magnitude = magnitude
+        self.joined = joined
+        self.loaded_at = time.monotonic()
+        self.catalog_version = None
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.scores = np.zeros(0, dtype=np.float64)
+
+    @staticmethod
+    def _sort_keys(event_ids: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        return event_ids.astype(np.int64) - (scores * 100).astype(np.int64) * FEED_KEY_SCALE
+
+    def rank(self):
+        """Re-ranks the whole catalog in one pass."""
+        event_ids, scores = recommender.score_all(self.interests, self.magnitude)
+        order = np.argsort(self._sort_keys(event_ids, scores))
+        self.ids, self.scores = event_ids[order].astype(np.int32), scores[order]
+        self.catalog_version = event_catalog.version
+
+    def sort_keys(self) -> np.ndarray:
+        """id - match_percentage * FEED_KEY_SCALE per position, ascending; built on demand."""
+        return self._sort_keys(self.ids, self.scores)
+
+    def drop_event(self, event_id: int):
+        keep = self.ids != event_id
+        self.ids, self.scores = self.ids[keep], self.scores[keep]
+
+    def place_event(self, event_id: int):
+        """Moves a created or edited event to its new position."""
+        self.drop_event(event_id)
+        score = recommender.score_event(event_id, self.interests, self.magnitude)
+        at = int(np.searchsorted(self.sort_keys(), event_id - int(score * 100) * FEED_KEY_SCALE))
+        self.ids = np.insert(self.ids, at, event_id)
+        self.scores = np.insert(self.scores, at, score)
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.scores.nbytes
+
+class FeedCache:
+    """
+    LRU of materialized feeds: user id -> UserFeed (None for signed-out
+    visitors). Admin event writes are patched into every cached feed in
+    place. A user's own joins and profile edits invalidate their feed, so
+    the next read reloads their state and re-ranks. Feeds ranked against an
+    older catalog version (a reload after another worker's edit) are
+    re-ranked on read, and state older than ttl_seconds is reloaded.
+    """
+    def __init__(self, max_users: int, ttl_seconds: float):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.feeds: "OrderedDict[Optional[int], UserFeed]" = OrderedDict()
+        self.invalidations = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.stale_reranks = 0
+        self.patches = 0
+
+    async def get(self, db: AsyncSession, current_user: Optional[Principal]) -> UserFeed:
+        """Returns the user's feed; the event catalog must already be loaded."""
+        key = current_user.id if current_user else None
+        feed = self.feeds.get(key)
+        if feed is not None and time.monotonic() - feed.loaded_at > self.ttl_seconds:
+            self.feeds.pop(key)
+            self.expired += 1
+            feed = None
+        if feed is None:
+            self.misses += 1
+            invalidations = self.invalidations
+            feed = UserFeed(*await load_feed_state(db, current_user))
+            feed.rank()
+            if invalidations != self.invalidations:
+                return feed # Someone's state changed while we loaded; don't cache a possibly stale copy
+            self.feeds[key] = feed
+            while len(self.feeds) > self.max_users:
+                self.feeds.popitem(last=False)
+        elif feed.catalog_version != event_catalog.version:
+            self.stale_reranks += 1
+            feed.rank()
+        else:
+            self.hits += 1
+        self.feeds.move_to_end(key)
+        return feed
+
+    def invalidate(self, user_id: int):
+        """Drops a user's feed after their interests or joins changed."""
+        self.feeds.pop(user_id, None)
+        self.invalidations += 1
+
+    def place_event(self, event_id: int, previous_version: str, version: str):
+        for feed in self.feeds.values():
+            if feed.catalog_version == previous_version: # Others are re-ranked on their next read
+                feed.place_event(event_id)
+                feed.catalog_version = version
+                self.patches += 1
+
+    def drop_event(self, event_id: int, previous_version: str, version: str):
+        for feed in self.feeds.values():
+            if feed.catalog_version == previous_version:
+                feed.drop_event(event_id)
+                feed.catalog_version = version
+                self.patches += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.stale_reranks
+        return {
+            "users": len(self.feeds),
+            "max_users": self.max_users,
+            "bytes": sum(feed.nbytes for feed in self.feeds.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stale_reranks": self.stale_reranks,
+            "expired": self.expired,
+            "invalidations": self.invalidations,
+            "patches": self.patches,
+        }
+
+feed_cache = FeedCache(FEED_CACHE_MAX_USERS, FEED_CACHE_TTL_SECONDS)
+
+def feed_changed(user_id: int):
+    """Invalidates the user's feed here and on the other workers."""
+    feed_cache.invalidate(user_id)
+    broker.publish({"kind": "feed_changed", "user_id": user_id})
+
+def build_event_feed(
+    candidates: Optional[Dict[int, EventSchema]],
+    feed: UserFeed,
+    response: Response,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    cursor: Optional[str] = None,
+) -> Response:
+    """
+    Returns the requested page of the user's materialized feed (ordered by
+    match_percentage), restricted to `candidates` unless that is None.
+    Without a limit every event is returned. With a limit only the page
+    (after `offset`, or after `cursor`) is serialized, and the cursor for
+    the next page is sent in the X-Next-Cursor header.
+    """
+    start = 0
+    if cursor:
+        match_percentage, negative_id = decode_feed_cursor(cursor)
+        start = int(np.searchsorted(feed.sort_keys(), -negative_id - match_percentage * FEED_KEY_SCALE, side="right"))
+
+    positions = np.arange(start, len(feed.ids))
+    if candidates is not None:
+        wanted = np.fromiter(candidates, dtype=np.int32, count=len(candidates))
+        positions = positions[np.isin(feed.ids[start:], wanted)]
+
+    page = positions[offset:] if limit is None else positions[offset:offset + limit]
+    if limit is not None and len(page) == limit and len(positions) > offset + limit:
+        last = page[-1]
+        response.headers["X-Next-Cursor"] = encode_feed_cursor(int(feed.scores[last] * 100), int(feed.ids[last]))
+
+    # Only the selected page is serialized
+    return event_list_response([
+        encode_event(event_id, score, event_id in feed.joined)
+        for event_id, score in zip(feed.ids[page].tolist(), feed.scores[page].tolist())
+    ], response)
+
+def catalog_subset(event_ids) -> Dict[int, EventSchema]:
+    return {event_id: event_catalog.events[event_id] for event_id in event_ids if event_id in event_catalog.events}
+
+@app.get("/events", response_model=List[EventSchema])
+async def get_all_events(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    tags: Optional[List[str]] = Query(None),
+    venue: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[Principal] = Depends(get_current_principal_optional) # Use optional auth
+):
+    """
+    Fetches events with recommendation scores (Cosine Similarity) from the
+    catalog cache. date_from/date_to (events overlapping the range), tags
+    (any of) and venue are applied in SQL before scoring. See
+    build_event_feed for paging. Supports conditional GET via ETag.
+    """
+    await event_catalog.ensure_loaded(db)
+    feed = await feed_cache.get(db, current_user)
+    not_modified = conditional_response(request, response, feed_etag(request, current_user, feed))
+    if not_modified:
+        return not_modified
+
+    if date_from or date_to or tags or venue:
+        query = filter_events_query(
+            select(Event.id),
+            date_from=parse_event_datetime(date_from),
+            date_to=parse_event_datetime(date_to),
             tags=tags,
-            lat=event.lat,
-            lng=event.lng,
-            match_score=score, # This is now the similarity score (0.0 to 1.0)
-            match_percentage=match_percentage, # New field (0 to 100)
-            is_joined=(event.id in joined_event_ids)
+            venue=venue,
         )
-        results.append(event_resp)
-        
-    # Sort by match_percentage descending
-    results.sort(key=lambda x: x.match_percentage, reverse=True)
-    
-    return results
+        candidates = catalog_subset(await db.scalars(query))
+    else:
+        candidates = None
+    return build_event_feed(candidates, feed, response, limit=limit, offset=offset, cursor=cursor)
+
+async def query_event_ids_in_bounds(db: AsyncSession, south: float, west: float, north: float, east: float) -> List[int]:
+    """Reads the ids of events inside a lat/lng box through the geohash index."""
+    cells = geohash_cells_for_bounds(south, west, north, east)
+    query = select(Event.id).filter(
+        # Each covering cell is a contiguous range of the geohash B-tree index
+        or_(*[geohash_cell_condition(Event.geohash, cell) for cell in cells]),
+        Event.lat >= south,
+        Event.lat <= north,
+    )
+    if west <= east:
+        query = query.filter(Event.lng >= west, Event.lng <= east)
+    else:
+        # Box crosses the antimeridian
+        query = query.filter(or_(Event.lng >= west, Event.lng <= east))
+    return list(await db.scalars(query))
+
+@app.get("/events/in-bounds", response_model=List[EventSchema])
+async def get_events_in_bounds(
+    response: Response,
+    south: float = Query(..., ge=-90, le=90),
+    west: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[Principal] = Depends(get_current_principal_optional)
+):
+    """Fetches the scored events inside the map viewport."""
+    if south > north:
+        raise HTTPException(status_code=400, detail="south must not be greater than north")
+    await event_catalog.ensure_loaded(db)
+    candidates = catalog_subset(await query_event_ids_in_bounds(db, south, west, north, east))
+    feed = await feed_cache.get(db, current_user)
+    return build_event_feed(candidates, feed, response, limit=limit, offset=offset, cursor=cursor)
+
+@app.get("/events/nearby", response_model=List[EventSchema])
+async def get_events_nearby(
+    response: Response,
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(2.0, gt=0, le=100),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[Principal] = Depends(get_current_principal_optional)
+):
+    """Fetches the scored events within radius_km of a point."""
+    await event_catalog.ensure_loaded(db)
+    south, west, north, east = bounds_around(lat, lng, radius_km)
+    in_box = catalog_subset(await query_event_ids_in_bounds(db, south, west, north, east))
+    # The box is a superset of the circle, so trim its corners exactly
+    candidates = {
+        event_id: event for event_id, event in in_box.items()
+        if haversine_km(lat, lng, event.lat, event.lng) <= radius_km
+    }
+    feed = await feed_cache.get(db, current_user)
+    return build_event_feed(candidates, feed, response, limit=limit, offset=offset, cursor=cursor)
 
 @app.post("/events/{event_id}/join")
 async def join_event(
     event_id: int, 
-    db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db), 
+    current_user: Principal = Depends(get_current_principal)
 ):
     """Allows a user to join an event and updates their interest weights."""
     # Check if event exists
-    event = db.query(Event).filter(Event.id == event_id).first()
+    event = await db.scalar(select(Event).where(Event.id == event_id))
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
         
     # Check if already joined
-    existing = db.query(UserEvent).filter(
+    existing = await db.scalar(select(UserEvent).where(
         UserEvent.user_id == current_user.id, 
         UserEvent.event_id == event_id
-    ).first()
+    ))
     
     if existing:
         return {"message": "Already joined this event"}
@@ -517,68 +2010,154 @@ async def join_event(
     db.add(new_join)
     
     # Update interest weights
-    # "Bump" the interests associated with this event
-    tags = event.tags.split(',') if event.tags else []
-    for tag in tags:
-        user_interest = db.query(UserInterest).filter(
-            UserInterest.user_id == current_user.id,
-            UserInterest.interest == tag
-        ).first()
-        
-        if user_interest:
-            user_interest.score += 1.0 # Increase weight
-        else:
-            # New interest discovered via event
-            new_interest = UserInterest(user_id=current_user.id, interest=tag, score=1.5) # Start with a bump
-            db.add(new_interest)
+    # "Bump" the interests associated with this event in a single upsert
+    await bump_join_interests(db, current_user.id, {tag: 1 for tag in event.tag_names})
             
-    db.commit()
+    await db.commit()
+    feed_changed(current_user.id)
     return {"message": "Successfully joined event", "event_title": event.title}
 
+class JoinBatch(BaseModel):
+    event_ids: List[int]
+
+@app.post("/events/join-batch")
+async def join_events_batch(
+    batch: JoinBatch,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal)
+):
+    """Joins several events (e.g. during onboarding) in one transaction."""
+    event_ids = list(dict.fromkeys(batch.event_ids))
+    events = (await db.scalars(select(Event).where(Event.id.in_(event_ids)))).all() if event_ids else []
+    found = {event.id: event for event in events}
+    already = set(await db.scalars(select(UserEvent.event_id).where(
+        UserEvent.user_id == current_user.id,
+        UserEvent.event_id.in_(list(found))
+    )))
+    to_join = [event_id for event_id in event_ids if event_id in found and event_id not in already]
+
+    if to_join:
+        await db.execute(
+            dialect_insert(UserEvent)
+            .values([{"user_id": current_user.id, "event_id": event_id} for event_id in to_join])
+            .on_conflict_do_nothing()
+        )
+        tag_counts: Dict[str, int] = {}
+        for event_id in to_join:
+            for tag in found[event_id].tag_names:
+                tag_counts[tag] = tag_counts.get(tag, 0) + 1
+        await bump_join_interests(db, current_user.id, tag_counts)
+        await db.commit()
+        feed_changed(current_user.id)
+
+    return {
+        "message": f"Joined {len(to_join)} events",
+        "joined": to_join,
+        "already_joined": [event_id for event_id in event_ids if event_id in already],
+        "not_found": [event_id for event_id in event_ids if event_id not in found],
+    }
+
 class GoogleLogin(BaseModel):
     token: str
 
+# --- Google Sign-In ---
+# Endpoints are configurable so a local fake can stand in for Google.
+GOOGLE_CLIENT_ID = os.getenv("VITE_GOOGLE_CLIENT_ID")
+GOOGLE_CERTS_URL = os.getenv("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs")
+GOOGLE_USERINFO_URL = os.getenv("GOOGLE_USERINFO_URL", "https://www.googleapis.com/oauth2/v3/userinfo")
+GOOGLE_HTTP_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_HTTP_TIMEOUT_SECONDS", "5"))
+GOOGLE_CERTS_DEFAULT_MAX_AGE = 300 # Used when the certs response has no Cache-Control max-age
+GOOGLE_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
+
+class GoogleVerifier:
+    """
+    Verifies Google ID tokens and access tokens without blocking the event loop.
+    Requests go through one pooled AsyncClient, the signing certs are cached
+    for as long as Google's Cache-Control allows (one fetch at a time), and
+    the signature check runs in a worker thread.
+    """
+    def __init__(self, certs_url: str, userinfo_url: str, timeout: float):
+        self.certs_url = certs_url
+        self.userinfo_url = userinfo_url
+        self.timeout = timeout
+        self.client: Optional[httpx.AsyncClient] = None
+        self.certs: Dict[str, str] = {}
+        self.certs_expire_at = 0.0
+        self.certs_lock = asyncio.Lock()
+        self.cert_fetches = 0
+
+    def http(self) -> httpx.AsyncClient:
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=self.timeout)
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get_certs(self) -> Dict[str, str]:
+        if time.monotonic() < self.certs_expire_at:
+            return self.certs
+        async with self.certs_lock:
+            if time.monotonic() < self.certs_expire_at: # Fetched while we waited
+                return self.certs
+            response = await self.http().get(self.certs_url)
+            response.raise_for_status()
+            max_age = re.search(r"max-age=(\d+)", response.headers.get("cache-control", ""))
+            ttl = int(max_age.group(1)) if max_age else GOOGLE_CERTS_DEFAULT_MAX_AGE
+            ttl -= int(response.headers.get("age", "0") or 0)
+            self.certs = response.json()
+            self.certs_expire_at = time.monotonic() + max(ttl, 0)
+            self.cert_fetches += 1
+            return self.certs
+
+    async def verify_id_token(self, token: str, audience: Optional[str]) -> dict:
+        """Returns the token's claims; raises ValueError if it isn't a valid Google ID token."""
+        certs = await self.get_certs()
+        id_info = await asyncio.to_thread(google_jwt.decode, token, certs=certs, audience=audience)
+        if id_info.get("iss") not in GOOGLE_ISSUERS:
+            raise ValueError(f"Wrong issuer: {id_info.get('iss')}")
+        return id_info
+
+    async def fetch_userinfo(self, access_token: str) -> dict:
+        """Returns the profile for an OAuth access token; raises ValueError if Google rejects it."""
+        response = await self.http().get(self.userinfo_url, headers={"Authorization": f"Bearer {access_token}"})
+        if response.status_code != 200:
+            raise ValueError("Invalid Access Token")
+        return response.json()
+
+google_verifier = GoogleVerifier(GOOGLE_CERTS_URL, GOOGLE_USERINFO_URL, GOOGLE_HTTP_TIMEOUT_SECONDS)
+
 @app.post("/auth/google", response_model=Token)
 @app.post("/auth/google", response_model=Token)
-async def google_login(login_data: GoogleLogin, db: Session = Depends(get_db)):
+async def google_login(login_data: GoogleLogin, db: AsyncSession = Depends(get_db)):
     email = None
     first_name = None
     last_name = None
     
     # Try verifying as ID Token (JWT)
     try:
-        id_info = id_token.verify_oauth2_token(
-            login_data.token, 
-            google_requests.Request(),
-            audience=os.getenv("VITE_GOOGLE_CLIENT_ID")
-        )
+        id_info = await google_verifier.verify_id_token(login_data.token, GOOGLE_CLIENT_ID)
         email = id_info['email']
         first_name = id_info.get('given_name')
         last_name = id_info.get('family_name')
+    except httpx.HTTPError as e:
+        print(f"Google Certs Fetch Error: {e}")
+        raise HTTPException(status_code=503, detail="Google sign-in is temporarily unavailable")
     except ValueError:
         # If ID Token verification fails, try as Access Token
         try:
-            # We need 'requests' library here. It's usually installed with google-auth, 
-            # but let's import it inside to be safe or ensure it's at top. 
-            # Ideally imports should be at top, but for this snippet:
-            import requests
-            response = requests.get(
-                "https://www.googleapis.com/oauth2/v3/userinfo",
-                headers={"Authorization": f"Bearer {login_data.token}"}
-            )
-            if response.status_code == 200:
-                user_info = response.json()
-                email = user_info['email']
-                first_name = user_info.get('given_name')
-                last_name = user_info.get('family_name')
-            else:
-                raise ValueError("Invalid Access Token")
+            user_info = await google_verifier.fetch_userinfo(login_data.token)
+            email = user_info['email']
+            first_name = user_info.get('given_name')
+            last_name = user_info.get('family_name')
         except Exception as e:
              print(f"Google Token Verification Error: {e}")
              raise HTTPException(status_code=400, detail="Invalid Google token")
 
     # Check if user exists
-    user = db.query(User).filter(User.email == email).first()
+    user = await db.scalar(select(User).where(User.email == email))
     is_new_user = False
     
     if not user:
@@ -586,12 +2165,12 @@ async def google_login(login_data: GoogleLogin, db: Session = Depends(get_db)):
         # Create new user
         username = email.split('@')[0]
         # Ensure username is unique
-        if db.query(User).filter(User.username == username).first():
+        if await db.scalar(select(User).where(User.username == username)):
             username = f"{username}_{secrets.token_hex(4)}"
             
         # Create a random password (user won't know it, they use Google)
         random_password = secrets.token_urlsafe(16)
-        hashed_password = get_password_hash(random_password)
+        hashed_password = await hash_password(random_password)
         
         user = User(
             email=email, 
@@ -601,8 +2180,9 @@ async def google_login(login_data: GoogleLogin, db: Session = Depends(get_db)):
             last_name=last_name
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
+        user_search_changed(user)
         
     access_token = create_access_token(data={"sub": user.email})
     return {
@@ -615,41 +2195,47 @@ async def google_login(login_data: GoogleLogin, db: Session = Depends(get_db)):
     }
 
 @app.post("/users/signup", response_model=UserSchema, status_code=status.HTTP_201_CREATED)
-async def create_user(user: UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """Handles new user registration."""
-    db_user = db.query(User).filter(User.email == user.email).first()
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered",
         )
-    db_username = db.query(User).filter(User.username == user.username).first()
+    db_username = await db.scalar(select(User).where(User.username == user.username))
     if db_username:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already taken",
         )
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await hash_password(user.password)
     new_user = User(email=user.email, username=user.username, hashed_password=hashed_password)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
+    user_search_changed(new_user)
     return new_user
 
 @app.post("/users/login", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     Handles user login and returns a JWT access token.
     FastAPI's OAuth2PasswordRequestForm expects 'username' and 'password' fields.
     We'll map our 'email' to 'username' on the frontend.
     """
-    user = db.query(User).filter(or_(User.email == form_data.username, User.username == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await db.scalar(select(User).where(or_(User.email == form_data.username, User.username == form_data.username)))
+    verified, new_hash = await verify_and_update_password(form_data.password, user.hashed_password) if user else (False, None)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Cost parameters changed since this hash was made
+        user.hashed_password = new_hash
+        await db.commit()
     access_token = create_access_token(data={"sub": user.email})
     return {
         "access_token": access_token, 
@@ -665,7 +2251,7 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
     return user_data
 
 @app.put("/users/me", response_model=UserSchema)
-async def update_user_me(user_update: UserUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def update_user_me(user_update: UserUpdate, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     if user_update.interests is not None:
         # Update the legacy string column
         current_user.interests = ",".join(user_update.interests)
@@ -673,84 +2259,90 @@ async def update_user_me(user_update: UserUpdate, current_user: User = Depends(g
         # Update the weighted interests table
         # Ensure selected interests exist with at least base weight (5.0).
         # Do NOT reset existing higher scores.
-        
-        for interest in user_update.interests:
-            ui = db.query(UserInterest).filter(
-                UserInterest.user_id == current_user.id,
-                UserInterest.interest == interest
-            ).first()
-            if not ui:
-                # New manual interest
-                new_ui = UserInterest(user_id=current_user.id, interest=interest, score=5.0)
-                db.add(new_ui)
-            else:
-                # Existing, ensure it has at least base weight
-                if ui.score < 5.0:
-                    ui.score = 5.0
+        await upsert_user_interests(
+            db,
+            current_user.id,
+            {interest: SELECTED_INTEREST_MIN for interest in user_update.interests},
+            lambda stmt: case((UserInterest.score < SELECTED_INTEREST_MIN, SELECTED_INTEREST_MIN), else_=UserInterest.score),
+        )
                     
     if user_update.first_name is not None:
         current_user.first_name = user_update.first_name
     if user_update.last_name is not None:
         current_user.last_name = user_update.last_name
-    db.commit()
-    db.refresh(current_user)
+    await db.commit()
+    principal_cache.invalidate_user(current_user.id)
+    feed_changed(current_user.id)
+    await db.refresh(current_user)
+    if user_update.first_name is not None or user_update.last_name is not None:
+        user_search_changed(current_user)
     return current_user
 
 @app.delete("/users/me", status_code=status.HTTP_204_NO_CONTENT)
-def delete_user_me(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    db.delete(current_user)
-    db.commit()
+async def delete_user_me(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    await db.delete(current_user)
+    await db.commit()
+    friend_graph.remove_user(current_user.id)
+    principal_cache.invalidate_user(current_user.id)
+    feed_cache.invalidate(current_user.id)
+    user_search_index.remove(current_user.id)
+    broker.publish({"kind": "user_removed", "user_id": current_user.id})
     return None
 
 
 @app.get("/events/{event_id}/carpool", response_model=List[CarpoolGroupResponse])
 async def get_carpool_groups(
     event_id: int, 
-    db: Session = Depends(get_db),
-    current_user: Optional[User] = Depends(get_current_user_optional)
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[Principal] = Depends(get_current_principal_optional)
 ):
-    groups = db.query(CarpoolGroup).filter(CarpoolGroup.event_id == event_id).all()
+    # Owners are joined in; accepted members (only shown to owners) come in one more query
+    query = select(CarpoolGroup).options(joinedload(CarpoolGroup.owner)).where(CarpoolGroup.event_id == event_id)
+    if current_user:
+        query = query.options(selectinload(CarpoolGroup.accepted_requests).joinedload(CarpoolRequest.requester))
+    groups = (await db.scalars(query)).all()
+
+    results = []
     for group in groups:
-        owner = db.query(User).filter(User.id == group.owner_id).first()
-        group.owner_username = owner.username if owner else "Unknown"
-        group.members = None  # keep response shape stable for non-owners
+        members = None  # keep response shape stable for non-owners
 
         # If current user is owner, populate members
         if current_user and current_user.id == group.owner_id:
-            accepted_requests = db.query(CarpoolRequest).filter(
-                CarpoolRequest.group_id == group.id,
-                CarpoolRequest.status == "accepted"
-            ).all()
-            
-            member_list = []
-            for req in accepted_requests:
-                member_user = db.query(User).filter(User.id == req.requester_id).first()
-                if member_user:
-                    member_list.append({
-                        "username": member_user.username,
-                        "email": member_user.email
-                    })
-            group.members = member_list
+            members = [
+                {"username": req.requester.username, "email": req.requester.email}
+                for req in group.accepted_requests if req.requester
+            ]
+
+        results.append(CarpoolGroupResponse(
+            id=group.id,
+            event_id=group.event_id,
+            owner_id=group.owner_id,
+            location=group.location,
+            time=group.time,
+            capacity=group.capacity,
+            owner_username=group.owner.username if group.owner else "Unknown",
+            members=members
+        ))
             
-    return groups
+    return results
 
 @app.post("/events/{event_id}/carpool", response_model=CarpoolGroupResponse)
 async def create_carpool_group(
     event_id: int,
     group: CarpoolGroupCreate,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal)
 ):
     # Check if event exists
-    event = db.query(Event).filter(Event.id == event_id).first()
+    event = await db.scalar(select(Event.id).where(Event.id == event_id))
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
         
     # Check if user has joined the event
-    is_joined = db.query(UserEvent).filter(
+    is_joined = await db.scalar(select(UserEvent).where(
         UserEvent.user_id == current_user.id,
         UserEvent.event_id == event_id
-    ).first()
+    ))
     
     if not is_joined:
         raise HTTPException(status_code=400, detail="You must join the event before creating a carpool group")
@@ -763,8 +2355,8 @@ async def create_carpool_group(
         capacity=group.capacity
     )
     db.add(new_group)
-    db.commit()
-    db.refresh(new_group)
+    await db.commit()
+    await db.refresh(new_group)
     
     # Add owner username for response
     new_group.owner_username = current_user.username
@@ -775,28 +2367,28 @@ async def create_carpool_group(
 @app.post("/carpool/{group_id}/join")
 async def join_carpool_group(
     group_id: int, 
-    db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db), 
+    current_user: Principal = Depends(get_current_principal)
 ):
-    group = db.query(CarpoolGroup).filter(CarpoolGroup.id == group_id).first()
+    group = await db.scalar(select(CarpoolGroup).where(CarpoolGroup.id == group_id))
     if not group:
         raise HTTPException(status_code=404, detail="Group not found")
         
     if group.owner_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot join your own group")
 
-    accepted_count = db.query(CarpoolRequest).filter(
+    accepted_count = await db.scalar(select(func.count()).select_from(CarpoolRequest).where(
         CarpoolRequest.group_id == group_id,
         CarpoolRequest.status == "accepted"
-    ).count()
+    ))
 
     if accepted_count >= group.capacity:
         raise HTTPException(status_code=400, detail="This carpool group is already full")
 
-    existing = db.query(CarpoolRequest).filter(
+    existing = await db.scalar(select(CarpoolRequest).where(
         CarpoolRequest.group_id == group_id,
         CarpoolRequest.requester_id == current_user.id
-    ).first()
+    ))
 
     if existing:
         return {"message": "Request already sent"}
@@ -806,57 +2398,66 @@ async def join_carpool_group(
         requester_id=current_user.id
     )
     db.add(new_request)
-    db.commit()
+    await db.commit()
     return {"message": "Request sent"}
 
+# Carpool listings only show the event title, so skip the eager tag load
+EVENT_TITLE_ONLY = (load_only(Event.title), lazyload(Event.tag_links))
+
+def carpool_request_response(req: CarpoolRequest, requester_username: Optional[str] = None) -> CarpoolRequestResponse:
+    """Builds a request response from a request with its group and event loaded."""
+    group = req.group
+    event = group.event if group else None
+    return CarpoolRequestResponse(
+        id=req.id,
+        group_id=req.group_id,
+        requester_id=req.requester_id,
+        status=req.status,
+        requester_username=requester_username,
+        group_location=group.location if group else None,
+        event_title=event.title if event else None
+    )
+
 @app.get("/carpool/requests/received", response_model=List[CarpoolRequestResponse])
-async def get_received_requests(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Get groups owned by user
-    owned_groups = db.query(CarpoolGroup).filter(CarpoolGroup.owner_id == current_user.id).all()
-    group_ids = [g.id for g in owned_groups]
-    
-    requests = db.query(CarpoolRequest).filter(CarpoolRequest.group_id.in_(group_ids)).all()
-    
-    results = []
-    for req in requests:
-        requester = db.query(User).filter(User.id == req.requester_id).first()
-        group = db.query(CarpoolGroup).filter(CarpoolGroup.id == req.group_id).first()
-        event = db.query(Event).filter(Event.id == group.event_id).first()
-        
-        req.requester_username = requester.username if requester else "Unknown"
-        req.group_location = group.location
-        req.event_title = event.title
-        results.append(req)
-        
-    return results
+async def get_received_requests(db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
+    # Requests to groups owned by user, with requester, group and event in one query
+    requests = await db.scalars(
+        select(CarpoolRequest)
+        .join(CarpoolRequest.group)
+        .where(CarpoolGroup.owner_id == current_user.id)
+        .options(
+            contains_eager(CarpoolRequest.group).joinedload(CarpoolGroup.event).options(*EVENT_TITLE_ONLY),
+            joinedload(CarpoolRequest.requester),
+        )
+        .order_by(CarpoolRequest.id)
+    )
+    return [
+        carpool_request_response(req, requester_username=req.requester.username if req.requester else "Unknown")
+        for req in requests
+    ]
 
 @app.get("/carpool/requests/sent", response_model=List[CarpoolRequestResponse])
-async def get_sent_requests(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    requests = db.query(CarpoolRequest).filter(CarpoolRequest.requester_id == current_user.id).all()
-    
-    results = []
-    for req in requests:
-        group = db.query(CarpoolGroup).filter(CarpoolGroup.id == req.group_id).first()
-        event = db.query(Event).filter(Event.id == group.event_id).first()
-        
-        req.group_location = group.location
-        req.event_title = event.title
-        results.append(req)
-        
-    return results
+async def get_sent_requests(db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
+    requests = await db.scalars(
+        select(CarpoolRequest)
+        .where(CarpoolRequest.requester_id == current_user.id)
+        .options(joinedload(CarpoolRequest.group).joinedload(CarpoolGroup.event).options(*EVENT_TITLE_ONLY))
+        .order_by(CarpoolRequest.id)
+    )
+    return [carpool_request_response(req) for req in requests]
 
 @app.post("/carpool/requests/{request_id}/{action}")
 async def manage_request(
     request_id: int, 
     action: str, 
-    db: Session = Depends(get_db), 
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db), 
+    current_user: Principal = Depends(get_current_principal)
 ):
-    req = db.query(CarpoolRequest).filter(CarpoolRequest.id == request_id).first()
+    req = await db.scalar(select(CarpoolRequest).where(CarpoolRequest.id == request_id))
     if not req:
         raise HTTPException(status_code=404, detail="Request not found")
         
-    group = db.query(CarpoolGroup).filter(CarpoolGroup.id == req.group_id).first()
+    group = await db.scalar(select(CarpoolGroup).where(CarpoolGroup.id == req.group_id))
     if group.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
         
@@ -867,13 +2468,13 @@ async def manage_request(
     else:
         raise HTTPException(status_code=400, detail="Invalid action")
         
-    db.commit()
+    await db.commit()
     return {"message": f"Request {action}ed"}
 
 # --- Admin Endpoints ---
 
 @app.post("/events", response_model=EventSchema, status_code=status.HTTP_201_CREATED)
-async def create_event(event: EventCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def create_event(event: EventCreate, db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
     if current_user.email not in ADMIN_EMAILS:
         raise HTTPException(status_code=403, detail="Admin access required")
         
@@ -885,20 +2486,22 @@ async def create_event(event: EventCreate, db: Session = Depends(get_db), curren
         venue=event.venue,
         lat=event.lat,
         lng=event.lng,
-        tags=",".join(event.tags),
         owner_id=current_user.id
     )
     db.add(new_event)
-    db.commit()
-    db.refresh(new_event)
-    return new_event
+    await db.run_sync(set_event_tags, new_event, event.tags)
+    await db.commit()
+    await db.refresh(new_event)
+    event_catalog.put(new_event)
+    broker.publish({"kind": "catalog_changed", "event_id": new_event.id})
+    return event_to_schema(new_event, include_owner=True)
 
 @app.put("/events/{event_id}", response_model=EventSchema)
-async def update_event(event_id: int, event: EventCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def update_event(event_id: int, event: EventCreate, db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
     if current_user.email not in ADMIN_EMAILS:
         raise HTTPException(status_code=403, detail="Admin access required")
         
-    db_event = db.query(Event).filter(Event.id == event_id).first()
+    db_event = await db.scalar(select(Event).where(Event.id == event_id))
     if not db_event:
         raise HTTPException(status_code=404, detail="Event not found")
         
@@ -916,81 +2519,166 @@ async def update_event(event_id: int, event: EventCreate, db: Session = Depends(
     db_event.venue = event.venue
     db_event.lat = event.lat
     db_event.lng = event.lng
-    db_event.tags = ",".join(event.tags)
+    db_event.updated_at = datetime.now() # Tag-only edits don't dirty the row itself
+    await db.run_sync(set_event_tags, db_event, event.tags)
     
-    db.commit()
-    db.refresh(db_event)
-    return db_event
+    await db.commit()
+    await db.refresh(db_event)
+    event_catalog.put(db_event)
+    broker.publish({"kind": "catalog_changed", "event_id": event_id})
+    return event_to_schema(db_event, include_owner=True)
 
 @app.delete("/events/{event_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_event(event_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def delete_event(event_id: int, db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
     if current_user.email not in ADMIN_EMAILS:
         raise HTTPException(status_code=403, detail="Admin access required")
         
-    db_event = db.query(Event).filter(Event.id == event_id).first()
+    db_event = await db.scalar(select(Event).where(Event.id == event_id))
     if not db_event:
         raise HTTPException(status_code=404, detail="Event not found")
         
     if db_event.owner_id and db_event.owner_id != current_user.id:
          raise HTTPException(status_code=403, detail="You can only delete events you created")
 
-    db.delete(db_event)
-    db.commit()
+    await db.delete(db_event)
+    await db.commit()
+    event_catalog.remove(event_id)
+    broker.publish({"kind": "catalog_changed", "event_id": event_id})
     return None
 
 @app.get("/admin/events", response_model=List[EventSchema])
-async def get_admin_events(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+async def get_admin_events(request: Request, response: Response, db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
     if current_user.email not in ADMIN_EMAILS:
         raise HTTPException(status_code=403, detail="Admin access required")
+
+    await event_catalog.ensure_loaded(db)
+    not_modified = conditional_response(request, response, make_etag(event_catalog.version, request.url.path, current_user.id))
+    if not_modified:
+        return not_modified
         
     # "They can view events added by them only!"
-    events = db.query(Event).filter(Event.owner_id == current_user.id).all()
-    
-    # Reuse the logic to populate match_score etc (though not strictly needed for admin view, it keeps schema consistent)
-    results = []
-    for event in events:
-        tags = event.tags.split(',') if event.tags else []
-        event_resp = EventSchema(
-            id=event.id,
-            title=event.title,
-            description=event.description,
-            start_at=event.start_at,
-            end_at=event.end_at,
-            venue=event.venue,
-            tags=tags,
-            lat=event.lat,
-            lng=event.lng,
-            match_score=0.0,
-            match_percentage=0,
-            is_joined=False,
-            owner_id=event.owner_id
-        )
-        results.append(event_resp)
-        
-    return results
+    return event_list_response([
+        encode_event(event.id, owner_id=event.owner_id)
+        for event in event_catalog.events.values() if event.owner_id == current_user.id
+    ], response)
+
+@app.get("/admin/feed-cache")
+async def get_feed_cache_stats(current_user: Principal = Depends(get_current_principal)):
+    if current_user.email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return feed_cache.stats()
+
+@app.get("/admin/event-catalog")
+async def get_event_catalog_stats(current_user: Principal = Depends(get_current_principal)):
+    if current_user.email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return event_catalog.stats()
+
+@app.get("/admin/principal-cache")
+async def get_principal_cache_stats(current_user: Principal = Depends(get_current_principal)):
+    if current_user.email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return principal_cache.stats()
+
+@app.get("/admin/hashing-pool")
+async def get_hashing_pool_stats(current_user: Principal = Depends(get_current_principal)):
+    if current_user.email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return hashing_pool.stats()
+
+@app.get("/admin/db-pool")
+async def get_db_pool_stats(current_user: Principal = Depends(get_current_principal)):
+    """Connection pool usage for request handlers (async) and background work (sync)."""
+    if current_user.email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return {"async": pool_stats(async_engine.sync_engine), "sync": pool_stats(engine)}
 
 # --- Friends System Endpoints ---
 
+def friend_ids_select(user_id: int):
+    """Accepted friends in either direction, as a UNION of two index-friendly selects."""
+    # Each branch uses its own single-column index instead of an OR across both
+    return union(
+        select(FriendRequest.receiver_id.label("friend_id")).where(
+            FriendRequest.requester_id == user_id, FriendRequest.status == "accepted"
+        ),
+        select(FriendRequest.requester_id.label("friend_id")).where(
+            FriendRequest.receiver_id == user_id, FriendRequest.status == "accepted"
+        ),
+    )
+
+FRIEND_GRAPH_MAX_USERS = int(os.getenv("FRIEND_GRAPH_MAX_USERS", "100000"))
+FRIEND_GRAPH_TTL_SECONDS = float(os.getenv("FRIEND_GRAPH_TTL_SECONDS", "300"))
+
+class FriendGraph:
+    """
+    Process-level cache of accepted friendships as adjacency sets.
+    A user's set is loaded on first use and then kept current by the
+    friend request endpoints, so presence fan-out and /friends don't
+    re-scan friend_requests. Least recently used sets are evicted past
+    max_users, and sets are reloaded after ttl_seconds to pick up changes
+    made by other processes.
+    """
+    def __init__(self, max_users: int, ttl_seconds: float):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.adjacency: "OrderedDict[int, Set[int]]" = OrderedDict()
+        self.loaded_at: Dict[int, float] = {}
+
+    async def friends_of(self, db: AsyncSession, user_id: int) -> Set[int]:
+        """Returns a copy of the user's friend ids, loading them if needed."""
+        friends = self.adjacency.get(user_id)
+        if friends is None or time.monotonic() - self.loaded_at[user_id] > self.ttl_seconds:
+            friends = set(await db.scalars(friend_ids_select(user_id)))
+            self.adjacency[user_id] = friends
+            self.loaded_at[user_id] = time.monotonic()
+            while len(self.adjacency) > self.max_users:
+                evicted, _ = self.adjacency.popitem(last=False)
+                self.loaded_at.pop(evicted, None)
+        self.adjacency.move_to_end(user_id)
+        return set(friends)
+
+    def add_friendship(self, user_a: int, user_b: int):
+        # Users that aren't loaded will read the new row from the database
+        if user_a in self.adjacency:
+            self.adjacency[user_a].add(user_b)
+        if user_b in self.adjacency:
+            self.adjacency[user_b].add(user_a)
+
+    def remove_friendship(self, user_a: int, user_b: int):
+        if user_a in self.adjacency:
+            self.adjacency[user_a].discard(user_b)
+        if user_b in self.adjacency:
+            self.adjacency[user_b].discard(user_a)
+
+    def remove_user(self, user_id: int):
+        self.adjacency.pop(user_id, None)
+        self.loaded_at.pop(user_id, None)
+        for friends in self.adjacency.values():
+            friends.discard(user_id)
+
+friend_graph = FriendGraph(FRIEND_GRAPH_MAX_USERS, FRIEND_GRAPH_TTL_SECONDS)
+
 @app.post("/friends/request/{user_id}")
 async def send_friend_request(
     user_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal)
 ):
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot send friend request to yourself")
     
-    target_user = db.query(User).filter(User.id == user_id).first()
+    target_user = await db.scalar(select(User).where(User.id == user_id))
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Check if request already exists (in either direction)
-    existing = db.query(FriendRequest).filter(
+    existing = await db.scalar(select(FriendRequest).where(
         or_(
             and_(FriendRequest.requester_id == current_user.id, FriendRequest.receiver_id == user_id),
             and_(FriendRequest.requester_id == user_id, FriendRequest.receiver_id == current_user.id)
         )
-    ).first()
+    ))
 
     if existing:
         if existing.status == "accepted":
@@ -1002,24 +2690,24 @@ async def send_friend_request(
             existing.status = "pending"
             existing.requester_id = current_user.id
             existing.receiver_id = user_id
-            db.commit()
+            await db.commit()
             return {"message": "Friend request sent"}
         
         return {"message": "Friend request already exists"}
 
     new_request = FriendRequest(requester_id=current_user.id, receiver_id=user_id)
     db.add(new_request)
-    db.commit()
+    await db.commit()
     return {"message": "Friend request sent"}
 
 @app.post("/friends/respond/{request_id}/{action}")
 async def respond_friend_request(
     request_id: int,
     action: str,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal)
 ):
-    req = db.query(FriendRequest).filter(FriendRequest.id == request_id).first()
+    req = await db.scalar(select(FriendRequest).where(FriendRequest.id == request_id))
     if not req:
         raise HTTPException(status_code=404, detail="Request not found")
 
@@ -1033,129 +2721,888 @@ async def respond_friend_request(
     else:
         raise HTTPException(status_code=400, detail="Invalid action")
 
-    db.commit()
+    await db.commit()
+
+    # Keep the friend graph and live sockets in step with the new state
+    if req.status == "accepted":
+        friend_graph.add_friendship(req.requester_id, req.receiver_id)
+        await manager.announce_friendship(req.requester_id, req.receiver_id)
+    else:
+        friend_graph.remove_friendship(req.requester_id, req.receiver_id)
+    broker.publish({"kind": "friendship", "users": [req.requester_id, req.receiver_id], "accepted": req.status == "accepted"})
     return {"message": f"Friend request {action}ed"}
 
+async def query_received_friend_requests(db: AsyncSession, user_id: int) -> List[FriendRequestResponse]:
+    """Pending requests to the user, with requester usernames joined in."""
+    requests = await db.scalars(
+        select(FriendRequest)
+        .options(joinedload(FriendRequest.requester))
+        .where(FriendRequest.receiver_id == user_id, FriendRequest.status == "pending")
+        .order_by(FriendRequest.id)
+    )
+    return [
+        FriendRequestResponse(
+            id=req.id,
+            requester_id=req.requester_id,
+            receiver_id=req.receiver_id,
+            status=req.status,
+            created_at=req.created_at,
+            requester_username=req.requester.username if req.requester else "Unknown"
+        )
+        for req in requests
+    ]
+
+async def query_sent_friend_requests(db: AsyncSession, user_id: int) -> List[FriendRequestResponse]:
+    """Pending requests from the user, with receiver usernames joined in."""
+    requests = await db.scalars(
+        select(FriendRequest)
+        .options(joinedload(FriendRequest.receiver))
+        .where(FriendRequest.requester_id == user_id, FriendRequest.status == "pending")
+        .order_by(FriendRequest.id)
+    )
+    return [
+        FriendRequestResponse(
+            id=req.id,
+            requester_id=req.requester_id,
+            receiver_id=req.receiver_id,
+            status=req.status,
+            created_at=req.created_at,
+            receiver_username=req.receiver.username if req.receiver else "Unknown"
+        )
+        for req in requests
+    ]
+
+async def query_friends(db: AsyncSession, user_id: int) -> List[User]:
+    """Accepted friends of the user, with ids from the friend graph cache."""
+    friend_ids = await friend_graph.friends_of(db, user_id)
+    if not friend_ids:
+        return []
+    return (await db.scalars(select(User).where(User.id.in_(friend_ids)).order_by(User.id))).all()
+
 @app.get("/friends/requests/received", response_model=List[FriendRequestResponse])
-async def get_friend_requests_received(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    requests = db.query(FriendRequest).filter(
-        FriendRequest.receiver_id == current_user.id,
-        FriendRequest.status == "pending"
-    ).all()
-    
-    for req in requests:
-        requester = db.query(User).filter(User.id == req.requester_id).first()
-        req.requester_username = requester.username if requester else "Unknown"
-        
-    return requests
+async def get_friend_requests_received(db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
+    return await query_received_friend_requests(db, current_user.id)
 
 @app.get("/friends/requests/sent", response_model=List[FriendRequestResponse])
-async def get_friend_requests_sent(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    requests = db.query(FriendRequest).filter(
-        FriendRequest.requester_id == current_user.id,
-        FriendRequest.status == "pending"
-    ).all()
-    
-    for req in requests:
-        receiver = db.query(User).filter(User.id == req.receiver_id).first()
-        req.receiver_username = receiver.username if receiver else "Unknown"
-        
-    return requests
+async def get_friend_requests_sent(db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
+    return await query_sent_friend_requests(db, current_user.id)
 
 @app.get("/friends", response_model=List[FriendResponse])
-async def get_friends(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    # Find all accepted requests where user is either requester or receiver
-    friendships = db.query(FriendRequest).filter(
-        or_(
-            FriendRequest.requester_id == current_user.id,
-            FriendRequest.receiver_id == current_user.id
-        ),
-        FriendRequest.status == "accepted"
-    ).all()
-
-    friends = []
-    for f in friendships:
-        friend_id = f.receiver_id if f.requester_id == current_user.id else f.requester_id
-        friend = db.query(User).filter(User.id == friend_id).first()
-        if friend:
-            friends.append(friend)
-    
-    return friends
+async def get_friends(db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
+    return await query_friends(db, current_user.id)
+
+@app.get("/friends/overview", response_model=FriendsOverview)
+async def get_friends_overview(db: AsyncSession = Depends(get_db), current_user: Principal = Depends(get_current_principal)):
+    """Friends plus received and sent pending requests in one round trip."""
+    return FriendsOverview(
+        friends=await query_friends(db, current_user.id),
+        received=await query_received_friend_requests(db, current_user.id),
+        sent=await query_sent_friend_requests(db, current_user.id),
+    )
+
+# --- User Search ---
 
-@app.get("/users/search", response_model=List[FriendResponse])
-async def search_users(query: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+USER_SEARCH_LIMIT = int(os.getenv("USER_SEARCH_LIMIT", "10"))
+USER_SEARCH_MAX_LIMIT = 50
+USER_SEARCH_INDEX_TTL_SECONDS = float(os.getenv("USER_SEARCH_INDEX_TTL_SECONDS", "300"))
+
+def trigrams(value: str) -> Set[str]:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+def search_rank(query: str, names: Tuple[str, str, str]) -> Optional[int]:
+    """
+    Rank of a match on lowercased (username, first_name, last_name): 0 for a
+    username prefix, 1 for a first or last name prefix, 2 for a substring
+    anywhere, None for no match.
+    """
+    username, first_name, last_name = names
+    if username.startswith(query):
+        return 0
+    if first_name.startswith(query) or last_name.startswith(query):
+        return 1
+    if query in username or query in first_name or query in last_name:
+        return 2
+    return None
+
+def prefix_scan(entries: List[Tuple[str, int]], prefix: str):
+    """Yields the (name, user id) entries of a sorted list whose name starts with `prefix`."""
+    at = bisect.bisect_left(entries, (prefix,))
+    while at < len(entries) and entries[at][0].startswith(prefix):
+        yield entries[at]
+        at += 1
+
+class UserSearchIndex:
+    """
+    In-process trigram index over usernames and first/last names, for
+    databases without trigram indexes (SQLite). The users holding every
+    trigram of a query are the candidates, which search_rank() then checks
+    and orders. Queries shorter than three characters have no trigrams and
+    match name prefixes only, found by bisecting sorted name lists (which
+    also serve username completion).
+    Signups and profile edits write through; a TTL reload or a
+    user_search_changed broker message picks up other processes' writes.
+    Like EventCatalog, a reload builds the new index in a worker thread and
+    swaps it in whole while requests keep searching the current one.
+    """
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self.users: Dict[int, dict] = {} # FriendResponse fields
+        self.names: Dict[int, Tuple[str, str, str]] = {} # Lowercased (username, first_name, last_name)
+        self.postings: Dict[str, Set[int]] = {}
+        self.usernames: List[Tuple[str, int]] = [] # Sorted (lowercased username, user id)
+        self.given_names: List[Tuple[str, int]] = [] # Sorted (lowercased first or last name, user id)
+        self.loaded_at: Optional[float] = None
+        self._reload_lock = asyncio.Lock()
+        self._changed_during_reload: Optional[Set[int]] = None
+
+    def _fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at <= self.ttl_seconds
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if self._fresh():
+            return
+        if self.loaded_at is not None and self._reload_lock.locked():
+            return # Another request is reloading; search the current index meanwhile
+        async with self._reload_lock:
+            if not self._fresh():
+                await self._reload(db)
+
+    async def _reload(self, db: AsyncSession):
+        self._changed_during_reload = set()
+        try:
+            rows = (await db.execute(select(User.id, User.username, User.first_name, User.last_name, User.email))).all()
+            built = await asyncio.to_thread(self._build, rows)
+            self.users, self.names, self.postings = built.users, built.names, built.postings
+            self.usernames, self.given_names = built.usernames, built.given_names
+            self.loaded_at = time.monotonic()
+        finally:
+            changed, self._changed_during_reload = self._changed_during_reload, None
+        # Writes that landed while the rows were being read may be missing from them
+        for user_id in changed:
+            await self.refresh_user(db, user_id)
+
+    @classmethod
+    def _build(cls, rows) -> "UserSearchIndex":
+        """Builds a complete index from plain rows (runs in a thread)."""
+        index = cls(0)
+        for row in rows:
+            index._add(row._asdict(), keep_sorted=False)
+        index.usernames.sort()
+        index.given_names.sort()
+        return index
+
+    async def refresh_user(self, db: AsyncSession, user_id: int):
+        """Re-reads one user after another worker created or renamed them."""
+        if self.loaded_at is None:
+            return
+        row = (await db.execute(
+            select(User.id, User.username, User.first_name, User.last_name, User.email).where(User.id == user_id)
+        )).first()
+        if row is None:
+            self.remove(user_id)
+        else:
+            self._put(row._asdict())
+
+    def put(self, user: User):
+        """Writes a created or renamed user through to the index."""
+        self._put({"id": user.id, "username": user.username, "first_name": user.first_name, "last_name": user.last_name, "email": user.email})
+
+    def _put(self, user: dict):
+        if self._changed_during_reload is not None:
+            self._changed_during_reload.add(user["id"])
+        if self.loaded_at is None:
+            return # Loaded in full on first use
+        self.remove(user["id"])
+        self._add(user)
+
+    def remove(self, user_id: int):
+        if self._changed_during_reload is not None:
+            self._changed_during_reload.add(user_id)
+        names = self.names.pop(user_id, None)
+        if names is None:
+            return
+        del self.users[user_id]
+        for gram in trigrams(names[0]) | trigrams(names[1]) | trigrams(names[2]):
+            self.postings[gram].discard(user_id)
+            if not self.postings[gram]:
+                del self.postings[gram]
+        self._discard(self.usernames, (names[0], user_id))
+        for name in names[1:]:
+            if name:
+                self._discard(self.given_names, (name, user_id))
+
+    @staticmethod
+    def _discard(entries: List[Tuple[str, int]], entry: Tuple[str, int]):
+        at = bisect.bisect_left(entries, entry)
+        if at < len(entries) and entries[at] == entry:
+            del entries[at]
+
+    def _add(self, user: dict, keep_sorted: bool = True):
+        user_id = user["id"]
+        names = tuple((user[field] or "").lower() for field in ("username", "first_name", "last_name"))
+        self.users[user_id] = user
+        self.names[user_id] = names
+        for gram in trigrams(names[0]) | trigrams(names[1]) | trigrams(names[2]):
+            self.postings.setdefault(gram, set()).add(user_id)
+        entries = [(self.usernames, names[0])] + [(self.given_names, name) for name in names[1:] if name]
+        for sorted_entries, name in entries:
+            if keep_sorted:
+                bisect.insort(sorted_entries, (name, user_id))
+            else:
+                sorted_entries.append((name, user_id))
+
+    def search(self, query: str, limit: int, skip: Set[int]) -> List[dict]:
+        """Best `limit` users matching the lowercased `query`, leaving out ids in `skip`."""
+        grams = trigrams(query)
+        if not grams:
+            return [self.users[user_id] for user_id in self._prefix_search(query, limit, skip)]
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        ranked = []
+        for user_id in candidates:
+            if user_id in skip:
+                continue
+            rank = search_rank(query, self.names[user_id])
+            if rank is not None:
+                ranked.append((rank, self.names[user_id][0], user_id))
+        return [self.users[user_id] for _, _, user_id in heapq.nsmallest(limit, ranked)]
+
+    def _prefix_search(self, query: str, limit: int, skip: Set[int]) -> List[int]:
+        # Username prefixes (rank 0) come out of the sorted list already in order
+        found = []
+        for _, user_id in prefix_scan(self.usernames, query):
+            if user_id not in skip:
+                found.append(user_id)
+                if len(found) >= limit:
+                    return found
+        # Every username match is in, so the rest are first/last name prefixes (rank 1)
+        seen = skip | set(found)
+        by_name = {(self.names[user_id][0], user_id) for _, user_id in prefix_scan(self.given_names, query) if user_id not in seen}
+        return found + [user_id for _, user_id in heapq.nsmallest(limit - len(found), by_name)]
+
+    def complete(self, prefix: str, limit: int, skip: Set[int]) -> List[str]:
+        """Usernames starting with the lowercased `prefix`, in order."""
+        completions = []
+        for _, user_id in prefix_scan(self.usernames, prefix):
+            if user_id not in skip:
+                completions.append(self.users[user_id]["username"])
+                if len(completions) >= limit:
+                    break
+        return completions
+
+    def stats(self) -> dict:
+        return {
+            "in_database": USER_SEARCH_IN_DATABASE,
+            "loaded": self.loaded_at is not None,
+            "users": len(self.users),
+            "trigrams": len(self.postings),
+            "age_seconds": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at is not None else None,
+        }
+
+def trigram_search_available() -> bool:
+    """Whether user search can run on pg_trgm indexes (see create_user_search_indexes)."""
+    if engine.dialect.name != "postgresql":
+        return False
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+
+USER_SEARCH_IN_DATABASE = trigram_search_available()
+user_search_index = UserSearchIndex(USER_SEARCH_INDEX_TTL_SECONDS)
+
+def user_search_changed(user: User):
+    """Updates this process's search index and tells other workers to re-read the user."""
+    user_search_index.put(user)
+    broker.publish({"kind": "user_search_changed", "user_id": user.id})
+
+async def query_user_search(db: AsyncSession, query: str, user_id: int, exclude_friends: bool, limit: int) -> List[UserSearchResult]:
+    """search_rank() on the pg_trgm indexes, with friends flagged by the same query."""
+    lowered = [func.lower(column) for column in (User.username, User.first_name, User.last_name)]
+    if len(query) < 3:
+        # Too short for trigrams; prefixes still use the indexes
+        matches = or_(*(column.startswith(query, autoescape=True) for column in lowered))
+    else:
+        matches = or_(*(column.contains(query, autoescape=True) for column in lowered))
+    rank = case(
+        (lowered[0].startswith(query, autoescape=True), 0),
+        (or_(lowered[1].startswith(query, autoescape=True), lowered[2].startswith(query, autoescape=True)), 1),
+        else_=2,
+    )
+    is_friend = User.id.in_(friend_ids_select(user_id))
+    stmt = select(User.id, User.username, User.first_name, User.last_name, User.email, is_friend.label("is_friend")).where(matches, User.id != user_id)
+    if exclude_friends:
+        stmt = stmt.where(~is_friend)
+    rows = await db.execute(stmt.order_by(rank, lowered[0]).limit(limit))
+    return [UserSearchResult(**row._asdict()) for row in rows]
+
+@app.get("/users/search", response_model=List[UserSearchResult])
+async def search_users(
+    query: str,
+    exclude_friends: bool = False,
+    limit: int = Query(USER_SEARCH_LIMIT, ge=1, le=USER_SEARCH_MAX_LIMIT),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal),
+):
+    """
+    Users whose username, first or last name contains `query`, username
+    prefix matches first and then name prefixes. Queries shorter than three
+    characters match prefixes only. Friends are flagged with is_friend, or
+    left out with exclude_friends.
+    """
+    query = query.strip().lower()
     if not query:
         return []
-    users = db.query(User).filter(User.username.ilike(f"%{query}%"), User.id != current_user.id).limit(10).all()
-    return users
+    if USER_SEARCH_IN_DATABASE:
+        return await query_user_search(db, query, current_user.id, exclude_friends, limit)
+    await user_search_index.ensure_loaded(db)
+    friend_ids = await friend_graph.friends_of(db, current_user.id)
+    skip = friend_ids | {current_user.id} if exclude_friends else {current_user.id}
+    return [
+        UserSearchResult(**user, is_friend=user["id"] in friend_ids)
+        for user in user_search_index.search(query, limit, skip)
+    ]
+
+@app.get("/users/autocomplete", response_model=List[str])
+async def autocomplete_usernames(
+    prefix: str,
+    limit: int = Query(USER_SEARCH_LIMIT, ge=1, le=USER_SEARCH_MAX_LIMIT),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal),
+):
+    """Usernames completing `prefix` (case-insensitive), alphabetically, for type-ahead."""
+    prefix = prefix.strip().lower()
+    if not prefix:
+        return []
+    if USER_SEARCH_IN_DATABASE:
+        lowered = func.lower(User.username).collate("C")
+        return (await db.scalars(
+            select(User.username)
+            .where(lowered >= prefix, lowered < prefix + "\U0010ffff", User.id != current_user.id)
+            .order_by(lowered)
+            .limit(limit)
+        )).all()
+    await user_search_index.ensure_loaded(db)
+    return user_search_index.complete(prefix, limit, {current_user.id})
+
+@app.get("/admin/user-search")
+async def get_user_search_stats(current_user: Principal = Depends(get_current_principal)):
+    if current_user.email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user_search_index.stats()
 
 # --- Chat System ---
 
+CHAT_FLUSH_MAX_BATCH = int(os.getenv("CHAT_FLUSH_MAX_BATCH", "200"))
+CHAT_FLUSH_INTERVAL_SECONDS = float(os.getenv("CHAT_FLUSH_INTERVAL_SECONDS", "0.05"))
+CHAT_FLUSH_RETRIES = int(os.getenv("CHAT_FLUSH_RETRIES", "5")) # Attempts per batch once shutting down
+CHAT_FLUSH_MAX_BACKOFF_SECONDS = float(os.getenv("CHAT_FLUSH_MAX_BACKOFF_SECONDS", "5"))
+CHAT_MAX_PENDING = int(os.getenv("CHAT_MAX_PENDING", "10000"))
+CHAT_SUBMIT_TIMEOUT_SECONDS = float(os.getenv("CHAT_SUBMIT_TIMEOUT_SECONDS", "5"))
+CHAT_ID_BLOCK_SIZE = int(os.getenv("CHAT_ID_BLOCK_SIZE", "100"))
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+
+class ChatBacklogFull(Exception):
+    """The chat writer's queue stayed full; the message was not accepted."""
+
+class ChatWriter:
+    """
+    Write-behind persistence for chat messages.
+    Messages get their id (from a reserved block) and timestamp as soon as
+    they arrive, so they can be delivered right away; a background thread
+    then inserts them in batches once max_batch messages are waiting or
+    flush_interval has passed. stop() drains everything before returning.
+
+    Transient database errors are retried (with backoff) until they clear,
+    so a delivered message is never dropped because the database was down.
+    Only rows the database rejects outright (IntegrityError) are dropped.
+    At most max_pending messages wait: submit() holds the sender back while
+    the queue is full and raises ChatBacklogFull if it stays full.
+    """
+    def __init__(self, max_batch: int, flush_interval: float, id_block_size: int, max_pending: int, submit_timeout: float):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+        self.max_pending = max_pending
+        self.submit_timeout = submit_timeout
+        self.pending: List[dict] = []
+        self.in_flight: List[dict] = []
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = False
+        # Reserved ids; popleft is atomic, so the event loop never takes id_lock
+        self.reserved_ids: deque = deque()
+        self.id_lock = threading.Lock()
+        # Metrics
+        self.flush_count = 0
+        self.flushed_messages = 0
+        self.flush_errors = 0
+        self.dropped_messages = 0
+        self.rejected_messages = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout: float = 30.0):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                print(f"Chat writer still flushing after {timeout}s; {len(self.pending) + len(self.in_flight)} messages unsaved")
+                return
+        if self.pending:
+            # Thread never started or died; write what is left inline
+            self._flush(self._take_batch(len(self.pending)))
+
+    def _reserve_ids(self):
+        with self.id_lock:
+            if self.reserved_ids:
+                return  # Another caller refilled while we waited
+            with SessionLocal() as db:
+                if engine.dialect.name == "postgresql":
+                    # One round trip reserves a whole block from the id sequence
+                    ids = db.execute(
+                        text("SELECT nextval(pg_get_serial_sequence('chat_messages', 'id')) FROM generate_series(1, :n)"),
+                        {"n": self.id_block_size},
+                    ).scalars().all()
+                else:
+                    # SQLite has no sequences; a shared high-water mark keeps workers' blocks apart.
+                    # The UPDATE takes the write lock, so the read after it sees our own block.
+                    first_free = (db.query(func.max(ChatMessage.id)).scalar() or 0) + 1
+                    db.execute(dialect_insert(IdReservation).values(name="chat_messages", next_id=first_free).on_conflict_do_nothing())
+                    db.execute(
+                        update(IdReservation).where(IdReservation.name == "chat_messages")
+                        .values(next_id=func.max(IdReservation.next_id, first_free) + self.id_block_size)
+                    )
+                    end = db.query(IdReservation.next_id).filter(IdReservation.name == "chat_messages").scalar()
+                    db.commit()
+                    ids = range(end - self.id_block_size, end)
+            self.reserved_ids.extend(ids)
+
+    async def next_id(self) -> int:
+        while True:
+            try:
+                return self.reserved_ids.popleft()
+            except IndexError:
+                await asyncio.to_thread(self._reserve_ids)
+
+    async def submit(self, sender_id: int, receiver_id: int, content: str) -> dict:
+        """Assigns an id and timestamp and queues the message for the next flush."""
+        # Backpressure: while the database is behind, the sender waits (and its socket isn't read)
+        deadline = time.monotonic() + self.submit_timeout
+        while len(self.pending) >= self.max_pending:
+            if time.monotonic() >= deadline:
+                self.rejected_messages += 1
+                raise ChatBacklogFull()
+            await asyncio.sleep(self.flush_interval)
+        message = {
+            "id": await self.next_id(),
+            "sender_id": sender_id,
+            "receiver_id": receiver_id,
+            "conversation_key": conversation_key(sender_id, receiver_id),
+            "content": content,
+            "timestamp": datetime.now(),
+        }
+        with self.condition:
+            self.pending.append(message)
+            # Wake the writer when it is idle or a full batch is ready
+            if len(self.pending) == 1 or len(self.pending) >= self.max_batch:
+                self.condition.notify()
+        return message
+
+    def unflushed_in(self, key: str) -> List[dict]:
+        """Queued messages of a conversation that may not be in the database yet."""
+        with self.condition:
+            waiting = self.in_flight + self.pending
+        return [m for m in waiting if m["conversation_key"] == key]
+
+    def _take_batch(self, size: int) -> List[dict]:
+        with self.condition:
+            batch = self.pending[:size]
+            del self.pending[:size]
+            self.in_flight = batch
+        return batch
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.stopping:
+                    self.condition.wait()
+                if not self.stopping and len(self.pending) < self.max_batch:
+                    self.condition.wait(self.flush_interval)  # Let the batch fill up
+                if not self.pending and self.stopping:
+                    return
+            self._flush(self._take_batch(self.max_batch))
+
+    def _insert(self, rows: List[dict]):
+        with SessionLocal() as db:
+            db.execute(insert(ChatMessage), rows)
+            db.commit()
+
+    def _retry_delay(self, attempt: int) -> Optional[float]:
+        """Backoff before the next attempt, or None to give up (only once shutting down)."""
+        if self.stopping and attempt >= CHAT_FLUSH_RETRIES:
+            return None
+        return min(0.1 * 2 ** attempt, CHAT_FLUSH_MAX_BACKOFF_SECONDS)
+
+    def _insert_with_retry(self, rows: List[dict]) -> bool:
+        """Inserts rows, retrying transient errors; IntegrityError is raised to the caller."""
+        attempt = 0
+        while True:
+            try:
+                self._insert(rows)
+                return True
+            except IntegrityError:
+                raise
+            except Exception as e:
+                self.flush_errors += 1
+                attempt += 1
+                print(f"Chat flush of {len(rows)} messages failed (attempt {attempt}): {e!r}")
+                delay = self._retry_delay(attempt)
+                if delay is None:
+                    self.dropped_messages += len(rows)
+                    print(f"Giving up on {len(rows)} chat messages at shutdown")
+                    return False
+                time.sleep(delay)
+
+    def _flush(self, batch: List[dict]):
+        started = time.perf_counter()
+        try:
+            self._insert_with_retry(batch)
+        except IntegrityError as e:
+            # One bad row (e.g. a receiver deleted meanwhile) fails the whole batch: keep the others
+            self.flush_errors += 1
+            print(f"Chat flush of {len(batch)} messages hit {e!r}; inserting them one by one")
+            for row in batch:
+                try:
+                    self._insert_with_retry([row])
+                except IntegrityError as e:
+                    self.dropped_messages += 1
+                    print(f"Dropping chat message {row['id']}: {e!r}")
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self.condition:
+            self.in_flight = []
+            self.flush_count += 1
+            self.flushed_messages += len(batch)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                "queue_depth": len(self.pending),
+                "in_flight": len(self.in_flight),
+                "reserved_ids": len(self.reserved_ids),
+                "flush_count": self.flush_count,
+                "flushed_messages": self.flushed_messages,
+                "flush_errors": self.flush_errors,
+                "dropped_messages": self.dropped_messages,
+                "rejected_messages": self.rejected_messages,
+                "max_pending": self.max_pending,
+                "last_flush_ms": round(self.last_flush_ms, 3),
+                "max_flush_ms": round(self.max_flush_ms, 3),
+                "avg_flush_ms": round(self.total_flush_ms / self.flush_count, 3) if self.flush_count else 0.0,
+            }
+
+chat_writer = ChatWriter(CHAT_FLUSH_MAX_BATCH, CHAT_FLUSH_INTERVAL_SECONDS, CHAT_ID_BLOCK_SIZE, CHAT_MAX_PENDING, CHAT_SUBMIT_TIMEOUT_SECONDS)
+
+async def chat_message_error(sender_id: int, receiver_id, content) -> Optional[str]:
+    """Why a websocket chat message can't be accepted, or None if it can."""
+    if not isinstance(receiver_id, int) or isinstance(receiver_id, bool) or receiver_id <= 0:
+        return "receiver_id must be a user id"
+    if not isinstance(content, str) or not content:
+        return "content must be a non-empty string"
+    async with AsyncSessionLocal() as db:
+        # Friends come from the in-memory graph; anyone else needs one lookup
+        if receiver_id in await friend_graph.friends_of(db, sender_id):
+            return None
+        if await db.scalar(select(User.id).where(User.id == receiver_id)) is None:
+            return "Unknown receiver"
+    return None
+
+# A history cursor is the "<timestamp>_<id>" of the oldest message on a page.
+def encode_chat_cursor(timestamp: datetime, message_id: int) -> str:
+    return f"{timestamp.isoformat()}_{message_id}"
+
+def decode_chat_cursor(cursor: str):
+    try:
+        timestamp, _, message_id = cursor.rpartition("_")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def chat_order_key(message):
+    """(timestamp, id) of a stored message or a queued one (a dict)."""
+    if isinstance(message, dict):
+        return message["timestamp"], message["id"]
+    return message.timestamp, message.id
+
 @app.get("/chat/history/{friend_id}", response_model=List[ChatMessageResponse])
 async def get_chat_history(
     friend_id: int,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
+    response: Response,
+    before: Optional[str] = None,
+    limit: int = Query(CHAT_HISTORY_PAGE_SIZE, ge=1, le=CHAT_HISTORY_MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_principal)
 ):
-    messages = db.query(ChatMessage).filter(
-        or_(
-            and_(ChatMessage.sender_id == current_user.id, ChatMessage.receiver_id == friend_id),
-            and_(ChatMessage.sender_id == friend_id, ChatMessage.receiver_id == current_user.id)
-        )
-    ).order_by(ChatMessage.timestamp.asc()).all()
+    """
+    One page of a conversation, newest first.
+    Pass the X-Next-Cursor value back as `before` to get older messages.
+    """
+    key = conversation_key(current_user.id, friend_id)
+    cursor = decode_chat_cursor(before) if before else None
+    # Read the write-behind queue first so a message flushed in between shows up in one place or the other
+    unflushed = [m for m in chat_writer.unflushed_in(key) if cursor is None or chat_order_key(m) < cursor]
+
+    query = select(ChatMessage).where(ChatMessage.conversation_key == key)
+    if cursor is not None:
+        query = query.where(tuple_(ChatMessage.timestamp, ChatMessage.id) < tuple_(*cursor))
+    messages = list(await db.scalars(query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit)))
+
+    if unflushed:
+        stored_ids = {m.id for m in messages}
+        messages.extend(m for m in unflushed if m["id"] not in stored_ids)
+        messages.sort(key=chat_order_key, reverse=True)
+        del messages[limit:]
+
+    if len(messages) == limit:
+        response.headers["X-Next-Cursor"] = encode_chat_cursor(*chat_order_key(messages[-1]))
     return messages
 
+@app.get("/admin/chat-writer")
+async def get_chat_writer_stats(current_user: Principal = Depends(get_current_principal)):
+    if current_user.email not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return chat_writer.stats()
+
+# --- Message Broker ---
+# Routes websocket traffic and cache invalidations between uvicorn workers
+# (transports live in message_broker.py).
+#   BROKER_URL=memory://                       single worker (default)
+#   BROKER_URL=unix:///tmp/theloop-broker.sock  workers on one host
+BROKER_URL = os.getenv("BROKER_URL", "memory://")
+WORKER_ID = f"{os.getpid()}-{secrets.token_hex(4)}"
+
+broker = make_broker(BROKER_URL)
+
 # WebSocket Connection Manager
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_OVERFLOW_POLICY = os.getenv("WS_OVERFLOW_POLICY", "drop")  # "drop" or "disconnect"
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+
+class ClientConnection:
+    """
+    One websocket with a bounded outbound queue drained by its own writer task,
+    so a slow or dead client only ever delays itself.
+    """
+    def __init__(self, websocket: WebSocket, user_id: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_QUEUE_SIZE)
+        self.writer: Optional[asyncio.Task] = None
+
+    async def run(self, manager: "ConnectionManager"):
+        try:
+            while True:
+                payload = await self.queue.get()
+                await asyncio.wait_for(self.websocket.send_text(payload), WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"WebSocket send to user {self.user_id} failed: {e!r}")
+            manager.remove(self)
+            await self.close()
+
+    async def close(self, code: int = status.WS_1011_INTERNAL_ERROR):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # Already closed by the peer
+
 class ConnectionManager:
-    def __init__(self):
-        # Map user_id to list of active websocket connections (allowing multiple tabs)
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+    def __init__(self, broker: Broker, worker_id: str = WORKER_ID):
+        # Map user_id to list of active connections (allowing multiple tabs)
+        self.active_connections: Dict[int, List[ClientConnection]] = {}
+        # Users connected to other workers: user_id -> worker ids
+        self.remote_presence: Dict[int, Set[str]] = {}
+        # remote_presence from before a rejoin, kept until the others have re-announced their users
+        self.unconfirmed_presence: Dict[int, Set[str]] = {}
+        self.settle_task: Optional[asyncio.Task] = None
+        self.broker = broker
+        self.worker_id = worker_id
+        self.dropped_messages = 0
+        self.overflow_disconnects = 0
+
+    async def start(self):
+        await self.broker.start(self.handle_broker_message, self.announce_worker)
+
+    def is_online(self, user_id: int) -> bool:
+        """True if the user has a socket on this or any other worker."""
+        return user_id in self.active_connections or user_id in self.remote_presence or user_id in self.unconfirmed_presence
 
     async def connect(self, websocket: WebSocket, user_id: int):
         await websocket.accept()
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+        connection = ClientConnection(websocket, user_id)
+        connection.writer = asyncio.create_task(connection.run(self))
+        self.add(connection)
+
+    def add(self, connection: ClientConnection):
+        if connection.user_id not in self.active_connections:
+            self.active_connections[connection.user_id] = []
+            self.broker.publish({"kind": "presence", "worker": self.worker_id, "user_id": connection.user_id, "online": True})
+        self.active_connections[connection.user_id].append(connection)
+
+    def remove(self, connection: ClientConnection):
+        connections = self.active_connections.get(connection.user_id)
+        if connections and connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self.active_connections[connection.user_id]
+                self.broker.publish({"kind": "presence", "worker": self.worker_id, "user_id": connection.user_id, "online": False})
+        if connection.writer and connection.writer is not asyncio.current_task():
+            connection.writer.cancel()
 
     def disconnect(self, websocket: WebSocket, user_id: int):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
+        for connection in list(self.active_connections.get(user_id, [])):
+            if connection.websocket is websocket:
+                self.remove(connection)
+
+    def enqueue(self, payload: str, user_id: int):
+        """Queues an encoded message for the user on this worker and forwards it to others."""
+        if user_id in self.remote_presence or user_id in self.unconfirmed_presence:
+            self.broker.publish({"kind": "deliver", "user_id": user_id, "payload": payload})
+        self.enqueue_local(payload, user_id)
+
+    def enqueue_local(self, payload: str, user_id: int):
+        """Queues an encoded message on every local socket of the user without waiting."""
+        for connection in list(self.active_connections.get(user_id, [])):
+            try:
+                connection.queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                if WS_OVERFLOW_POLICY == "disconnect":
+                    # Cut the client loose; it can reconnect and reload history
+                    self.overflow_disconnects += 1
+                    self.remove(connection)
+                    asyncio.create_task(connection.close(status.WS_1013_TRY_AGAIN_LATER))
+                else:
+                    self.dropped_messages += 1
 
     async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            for connection in self.active_connections[user_id]:
-                await connection.send_json(message)
+        if self.is_online(user_id):
+            self.enqueue(json.dumps(message, separators=(",", ":"), ensure_ascii=False), user_id)
+
+    async def announce_friendship(self, user_a: int, user_b: int):
+        """Tells two new friends about each other's online status."""
+        for user_id, friend_id in ((user_a, user_b), (user_b, user_a)):
+            if self.is_online(user_id) and self.is_online(friend_id):
+                await self.send_personal_message({"type": "status", "user_id": friend_id, "status": "online"}, user_id)
 
     async def broadcast_status(self, user_id: int, status: str, friend_ids: List[int]):
         """Broadcasts a user's status (online/offline) to their friends."""
-        message = {"type": "status", "user_id": user_id, "status": status}
+        # Encoded once; each friend's writer task delivers it independently
+        payload = json.dumps({"type": "status", "user_id": user_id, "status": status}, separators=(",", ":"))
         for friend_id in friend_ids:
-            if friend_id in self.active_connections:
-                await self.send_personal_message(message, friend_id)
-
-manager = ConnectionManager()
-
-def get_user_friends_ids(user_id: int, db: Session) -> List[int]:
-    """Helper to get a list of friend IDs for a user."""
-    friendships = db.query(FriendRequest).filter(
-        or_(
-            FriendRequest.requester_id == user_id,
-            FriendRequest.receiver_id == user_id
-        ),
-        FriendRequest.status == "accepted"
-    ).all()
-    
-    friend_ids = []
-    for f in friendships:
-        fid = f.receiver_id if f.requester_id == user_id else f.requester_id
-        friend_ids.append(fid)
-    return friend_ids
+            if self.is_online(friend_id):
+                self.enqueue(payload, friend_id)
+
+    async def announce_worker(self):
+        """
+        (Re)joins the other workers: shares our users and relearns theirs from
+        their presence_sync replies. Users known from before who haven't been
+        re-announced after BROKER_HANDOVER_SECONDS were on a worker that is
+        gone (the old hub, which has nobody left to send worker_gone for it).
+        """
+        for user_id, workers in self.remote_presence.items():
+            self.unconfirmed_presence.setdefault(user_id, set()).update(workers)
+        self.remote_presence = {}
+        self.broker.publish({"kind": "hello", "worker": self.worker_id, "users": list(self.active_connections)})
+        if self.unconfirmed_presence:
+            if self.settle_task:
+                self.settle_task.cancel()
+            self.settle_task = asyncio.create_task(self.settle_presence())
+
+    async def settle_presence(self):
+        await asyncio.sleep(BROKER_HANDOVER_SECONDS)
+        unconfirmed, self.unconfirmed_presence = self.unconfirmed_presence, {}
+        await self.announce_offline([user_id for user_id in unconfirmed if not self.is_online(user_id)])
+
+    async def announce_offline(self, user_ids: List[int]):
+        """Tells local friends about users who went offline along with their worker."""
+        if not user_ids:
+            return
+        async with AsyncSessionLocal() as db:
+            for user_id in user_ids:
+                if not self.is_online(user_id):
+                    friend_ids = [f for f in await friend_graph.friends_of(db, user_id) if f in self.active_connections]
+                    payload = json.dumps({"type": "status", "user_id": user_id, "status": "offline"}, separators=(",", ":"))
+                    for friend_id in friend_ids:
+                        self.enqueue_local(payload, friend_id)
+
+    def set_remote_presence(self, worker: str, user_id: int, online: bool):
+        if online:
+            self.remote_presence.setdefault(user_id, set()).add(worker)
+            return
+        for presence in (self.remote_presence, self.unconfirmed_presence):
+            if user_id in presence:
+                presence[user_id].discard(worker)
+                if not presence[user_id]:
+                    del presence[user_id]
+
+    async def handle_broker_message(self, message: dict):
+        kind = message["kind"]
+        if kind == "deliver":
+            self.enqueue_local(message["payload"], message["user_id"])
+        elif kind == "presence":
+            self.set_remote_presence(message["worker"], message["user_id"], message["online"])
+        elif kind in ("hello", "presence_sync"):
+            for user_id in message["users"]:
+                self.set_remote_presence(message["worker"], user_id, True)
+            if kind == "hello":
+                self.broker.publish({"kind": "presence_sync", "worker": self.worker_id, "users": list(self.active_connections)})
+        elif kind == "worker_gone":
+            gone = {
+                user_id
+                for presence in (self.remote_presence, self.unconfirmed_presence)
+                for user_id, workers in presence.items() if message["worker"] in workers
+            }
+            for user_id in gone:
+                self.set_remote_presence(message["worker"], user_id, False)
+            # Users whose only sockets were on that worker just went offline
+            await self.announce_offline(list(gone))
+        elif kind == "friendship":
+            user_a, user_b = message["users"]
+            if message["accepted"]:
+                friend_graph.add_friendship(user_a, user_b)
+            else:
+                friend_graph.remove_friendship(user_a, user_b)
+        elif kind == "user_removed":
+            friend_graph.remove_user(message["user_id"])
+            principal_cache.invalidate_user(message["user_id"])
+            feed_cache.invalidate(message["user_id"])
+            user_search_index.remove(message["user_id"])
+        elif kind == "feed_changed":
+            feed_cache.invalidate(message["user_id"])
+        elif kind == "catalog_changed":
+            async with AsyncSessionLocal() as db:
+                await event_catalog.refresh_event(db, message["event_id"])
+        elif kind == "user_search_changed":
+            async with AsyncSessionLocal() as db:
+                await user_search_index.refresh_user(db, message["user_id"])
+
+manager = ConnectionManager(broker)
 
 @app.websocket("/ws/chat/{client_id}")
-async def websocket_endpoint(websocket: WebSocket, client_id: int, token: str = Query(...), db: Session = Depends(get_db)):
+async def websocket_endpoint(websocket: WebSocket, client_id: int, token: str = Query(...)):
     # Verify token
     # Note: In a real app, you'd want a more robust way to auth websockets, 
     # but passing token in query param is a common simple pattern.
@@ -1168,21 +3615,23 @@ async def websocket_endpoint(websocket: WebSocket, client_id: int, token: str =
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    user = db.query(User).filter(User.email == email).first()
-    if not user or user.id != client_id:
-        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-        return
+    # Short-lived sessions: a socket can stay open for hours and shouldn't pin a pooled connection
+    async with AsyncSessionLocal() as db:
+        user = await db.scalar(select(User).where(User.email == email))
+        if not user or user.id != client_id:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        friend_ids = await friend_graph.friends_of(db, user.id)
 
     await manager.connect(websocket, user.id)
     
     # Notify friends that user is online
-    friend_ids = get_user_friends_ids(user.id, db)
     await manager.broadcast_status(user.id, "online", friend_ids)
     
     # Send current online status of friends to the user
     online_friends = []
     for fid in friend_ids:
-        if fid in manager.active_connections:
+        if manager.is_online(fid):
             online_friends.append(fid)
             
     if online_friends:
@@ -1194,39 +3643,44 @@ async def websocket_endpoint(websocket: WebSocket, client_id: int, token: str =
     try:
         while True:
             data = await websocket.receive_json()
+            started = time.perf_counter()
             # data should contain { "receiver_id": int, "content": str }
             receiver_id = data.get("receiver_id")
             content = data.get("content")
             
-            if receiver_id and content:
-                # Save to DB
-                # Note: creating a new session here because the dependency one might be closed or not thread-safe in the loop? 
-                # Actually Depends(get_db) works for the initial setup, but for the loop we might need a fresh session or use the existing one carefully.
-                # Ideally, we should use `async with SessionLocal() as session:` but our SessionLocal is sync.
-                # For this simple implementation, we'll use the `db` session passed in, but we need to be careful about commits.
-                
-                new_msg = ChatMessage(sender_id=user.id, receiver_id=receiver_id, content=content)
-                db.add(new_msg)
-                db.commit()
-                db.refresh(new_msg)
-                
+            error = await chat_message_error(user.id, receiver_id, content)
+            if error is None:
+                # Queue for the background writer; id and timestamp are assigned up front
+                try:
+                    new_msg = await chat_writer.submit(user.id, receiver_id, content)
+                except ChatBacklogFull:
+                    error = "Chat is busy, message not sent. Please retry."
+            if error is not None:
+                await manager.send_personal_message({"type": "error", "detail": error, "receiver_id": receiver_id}, user.id)
+            else:
                 response_data = {
-                    "id": new_msg.id,
+                    "id": new_msg["id"],
                     "sender_id": user.id,
                     "receiver_id": receiver_id,
                     "content": content,
-                    "timestamp": new_msg.timestamp.isoformat()
+                    "timestamp": new_msg["timestamp"].isoformat()
                 }
                 
                 # Send to receiver
                 await manager.send_personal_message(response_data, receiver_id)
                 # Send back to sender (so they see it confirmed/echoed)
                 await manager.send_personal_message(response_data, user.id)
+            WS_MESSAGE_SECONDS.observe(time.perf_counter() - started)
                 
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket, user.id)
-        # Notify friends that user is offline
-        await manager.broadcast_status(user.id, "offline", friend_ids)
+        # Notify friends that user is offline (re-read, friendships may have changed)
+        if not manager.is_online(user.id):
+            async with AsyncSessionLocal() as db:
+                friend_ids = await friend_graph.friends_of(db, user.id)
+            await manager.broadcast_status(user.id, "offline", friend_ids)
 
 
 # --- How to Run ---
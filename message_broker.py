@@ -0,0 +1,225 @@
+"""
+Pub/sub transports that carry websocket traffic and cache invalidations
+between uvicorn workers. Kept apart from main.py so they can be imported
+(by bench_broker.py, for one) without opening the database.
+"""
+import asyncio
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set
+
+BROKER_MAX_BUFFER_BYTES = int(os.getenv("BROKER_MAX_BUFFER_BYTES", str(8 * 1024 * 1024)))
+BROKER_MAX_BACKLOG_FRAMES = int(os.getenv("BROKER_MAX_BACKLOG_FRAMES", "10000"))
+BROKER_HANDOVER_SECONDS = float(os.getenv("BROKER_HANDOVER_SECONDS", "2")) # How long workers take to find a new hub
+
+class Broker(ABC):
+    """
+    Pub/sub between worker processes. Every published message reaches every
+    other worker's handler; the publishing worker handles its own copy
+    directly, so publish() never loops back. Transports implement publish()
+    and stop(), and may extend start().
+    """
+    def __init__(self):
+        self.handler = None
+        self.on_connected = None
+        self.published = 0
+        self.received = 0
+
+    async def start(self, handler, on_connected):
+        """handler(message) runs for every message from another worker;
+        on_connected() runs whenever this worker (re)joins the others."""
+        self.handler = handler
+        self.on_connected = on_connected
+
+    @abstractmethod
+    def publish(self, message: dict):
+        """Send message to every other worker without blocking."""
+
+    @abstractmethod
+    async def stop(self):
+        """Release the transport's sockets, tasks and locks."""
+
+class InProcessBroker(Broker):
+    """Single worker: every connection is local, so there is nobody to tell."""
+    def publish(self, message: dict):
+        self.published += 1
+
+    async def stop(self):
+        pass
+
+class UnixSocketBroker(Broker):
+    """
+    Hub-and-spoke broker over a Unix socket for workers on one host.
+    Whichever worker holds the flock on `<path>.lock` binds the socket and
+    relays each newline-delimited JSON frame to every other worker. The
+    others connect as clients. If the hub exits, the OS releases its lock,
+    the clients reconnect, and one of them takes over.
+
+    A handover loses only frames already in flight: a worker holds what it
+    publishes while it has no hub (up to BROKER_MAX_BACKLOG_FRAMES) and
+    sends it on reconnecting, and for BROKER_HANDOVER_SECONDS a new hub
+    replays everything it has relayed to each worker that connects late.
+    """
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.lock_file = None
+        self.server = None
+        self.peers: Dict[asyncio.StreamWriter, Optional[str]] = {} # Hub only: client -> worker id
+        self.upstream: Optional[asyncio.StreamWriter] = None # Clients only
+        self.task: Optional[asyncio.Task] = None
+        self.peer_tasks: Set[asyncio.Task] = set()
+        self.stopping = False
+        self.backlog: Deque[bytes] = deque() # Frames published while between hubs
+        self.replay: Optional[List[bytes]] = None # Hub only, during the handover window
+        self.hub_since = 0.0
+        self.dropped = 0
+
+    @property
+    def is_hub(self) -> bool:
+        return self.server is not None
+
+    async def start(self, handler, on_connected):
+        await super().start(handler, on_connected)
+        self.task = asyncio.create_task(self._maintain())
+
+    def _try_lock(self) -> bool:
+        import fcntl # Unix only, like the transport itself
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    async def _maintain(self):
+        while True:
+            if self._try_lock():
+                # Any socket file left behind belongs to a hub that has exited
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                self.server = await asyncio.start_unix_server(self._serve_peer, path=self.path, limit=2 ** 20)
+                self.hub_since = time.monotonic()
+                self.replay = []
+                while self.backlog:
+                    self._relay(self.backlog.popleft())
+                await self.on_connected()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=2 ** 20)
+            except OSError:
+                await asyncio.sleep(0.05) # Hub is starting up or being replaced
+                continue
+            self.upstream = writer
+            while self.backlog:
+                writer.write(self.backlog.popleft())
+            await self.on_connected()
+            try:
+                while line := await reader.readline():
+                    await self._dispatch(json.loads(line))
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            self.upstream = None
+            writer.close()
+
+    def _in_handover(self) -> bool:
+        if self.replay is not None and time.monotonic() - self.hub_since > BROKER_HANDOVER_SECONDS:
+            self.replay = None
+        return self.replay is not None
+
+    def _relay(self, frame: bytes, exclude: Optional[asyncio.StreamWriter] = None):
+        """Sends a frame to the connected workers and keeps it for those still reconnecting."""
+        self._send(frame, exclude=exclude)
+        if self._in_handover() and len(self.replay) < BROKER_MAX_BACKLOG_FRAMES:
+            self.replay.append(frame)
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.peers[writer] = None
+        self.peer_tasks.add(asyncio.current_task())
+        if self._in_handover():
+            # This worker was still looking for us while these went out
+            for frame in self.replay:
+                writer.write(frame)
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message.get("kind") == "hello":
+                    self.peers[writer] = message["worker"]
+                self._relay(line, exclude=writer)
+                await self._dispatch(message)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            worker = self.peers.pop(writer, None)
+            self.peer_tasks.discard(asyncio.current_task())
+            writer.close()
+            if worker and not self.stopping:
+                # Tell everyone (including ourselves) that the worker's users are gone
+                gone = {"kind": "worker_gone", "worker": worker}
+                self._relay(self._encode(gone))
+                await self._dispatch(gone)
+
+    async def _dispatch(self, message: dict):
+        self.received += 1
+        try:
+            await self.handler(message)
+        except Exception as e:
+            print(f"Broker handler failed for {message.get('kind')}: {e!r}")
+
+    @staticmethod
+    def _encode(message: dict) -> bytes:
+        return json.dumps(message, separators=(",", ":")).encode() + b"\n"
+
+    def _send(self, frame: bytes, exclude: Optional[asyncio.StreamWriter] = None):
+        for writer in list(self.peers):
+            if writer is exclude:
+                continue
+            if writer.transport.get_write_buffer_size() > BROKER_MAX_BUFFER_BYTES:
+                # A stuck worker gets dropped rather than buffering without bound
+                print(f"Broker dropping unresponsive worker {self.peers.get(writer)}")
+                writer.close()
+                continue
+            writer.write(frame)
+
+    def publish(self, message: dict):
+        self.published += 1
+        frame = self._encode(message)
+        if self.is_hub:
+            self._relay(frame)
+        elif self.upstream is not None:
+            self.upstream.write(frame)
+        elif len(self.backlog) < BROKER_MAX_BACKLOG_FRAMES:
+            self.backlog.append(frame) # Between hubs; sent once we reach the next one
+        else:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"Broker backlog full, {self.dropped} frames dropped so far")
+
+    async def stop(self):
+        self.stopping = True
+        if self.task:
+            self.task.cancel()
+        if self.upstream:
+            self.upstream.close()
+        if self.server:
+            self.server.close()
+            for writer in list(self.peers):
+                writer.close()
+            # Closing the writers ends each peer's read loop
+            await asyncio.gather(*self.peer_tasks, return_exceptions=True)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+        if self.lock_file:
+            self.lock_file.close()
+
+def make_broker(url: str) -> Broker:
+    if url.startswith("unix://"):
+        return UnixSocketBroker(url[len("unix://"):])
+    if url.startswith("memory://"):
+        return InProcessBroker()
+    raise ValueError(f"Unsupported BROKER_URL: {url}")
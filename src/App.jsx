@@ -568,6 +568,9 @@ export default function App() {
                     onClose={() => chatSystem.setActiveChatFriend(null)}
                     isMobile={isMobile}
                     isLoadingChat={chatSystem.isLoadingChat}
+                    hasOlderMessages={chatSystem.hasOlderMessages}
+                    isLoadingOlder={chatSystem.isLoadingOlder}
+                    onLoadOlder={chatSystem.loadOlderMessages}
                     connectionStatus={chatSystem.connectionStatus}
                 />
             )}
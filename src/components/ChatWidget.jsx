@@ -12,6 +12,9 @@ export default function ChatWidget({
     onClose,
     isMobile,
     isLoadingChat,
+    hasOlderMessages = false,
+    isLoadingOlder = false,
+    onLoadOlder,
     connectionStatus = 'open'
 }) {
     const [isMinimized, setIsMinimized] = useState(true);
@@ -29,6 +32,8 @@ export default function ChatWidget({
         }
     }, [activeFriend]);
 
+    // Scroll down for new messages only, not when older ones are prepended
+    const newestMessageId = messages.length ? messages[messages.length - 1].id : null;
     useEffect(() => {
         if (view === 'chat') {
             messagesEndRef.current?.scrollIntoView({ behavior: "smooth" });
@@ -36,7 +41,7 @@ export default function ChatWidget({
                 inputRef.current?.focus();
             }
         }
-    }, [messages, view, isMobile]);
+    }, [newestMessageId, view, isMobile]);
 
     const handleSubmit = (e) => {
         e.preventDefault();
@@ -190,10 +195,21 @@ export default function ChatWidget({
                                             </div>
                                         ) : (
                                             <>
+                                                {hasOlderMessages && (
+                                                    <div className="flex justify-center">
+                                                        <button
+                                                            onClick={onLoadOlder}
+                                                            disabled={isLoadingOlder}
+                                                            className="text-xs text-purple-600 hover:text-purple-700 disabled:opacity-50 transition-colors"
+                                                        >
+                                                            {isLoadingOlder ? 'Loading...' : 'Load older messages'}
+                                                        </button>
+                                                    </div>
+                                                )}
                                                 {messages.map((msg, idx) => {
                                                     const isMe = msg.sender_id === currentUser.id;
                                                     return (
-                                                        <div key={idx} className={`flex ${isMe ? 'justify-end' : 'justify-start'}`}>
+                                                        <div key={msg.id ?? idx} className={`flex ${isMe ? 'justify-end' : 'justify-start'}`}>
                                                             <div className={`max-w-[80%] px-3 py-2 rounded-2xl text-sm ${isMe
                                                                 ? 'bg-purple-600 text-white rounded-br-none'
                                                                 : 'bg-gray-100 dark:bg-slate-800 text-gray-900 dark:text-white rounded-bl-none'
@@ -488,12 +488,16 @@ export default function ProfilePage({ setIsLoggedIn, setPage, initialTab = 'prof
                                         {userSearchResults.map(u => (
                                             <div key={u.id} className="p-3 hover:bg-gray-50 dark:hover:bg-slate-700 flex justify-between items-center border-b border-gray-100 dark:border-gray-700 last:border-0">
                                                 <span className="font-medium text-gray-900 dark:text-white">@{u.username}</span>
-                                                <button
-                                                    onClick={() => sendFriendRequest(u.id)}
-                                                    className="text-xs bg-purple-600 text-white px-3 py-1.5 rounded-full hover:bg-purple-700 transition-colors"
-                                                >
-                                                    Add
-                                                </button>
+                                                {u.is_friend ? (
+                                                    <span className="text-xs text-gray-500 dark:text-gray-400 px-3 py-1.5">Friends</span>
+                                                ) : (
+                                                    <button
+                                                        onClick={() => sendFriendRequest(u.id)}
+                                                        className="text-xs bg-purple-600 text-white px-3 py-1.5 rounded-full hover:bg-purple-700 transition-colors"
+                                                    >
+                                                        Add
+                                                    </button>
+                                                )}
                                             </div>
                                         ))}
                                     </div>
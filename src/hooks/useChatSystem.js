@@ -1,6 +1,8 @@
 import { useState, useEffect, useRef, useCallback } from 'react';
 import { toast } from '../lib/toast';
 
+const USER_SEARCH_DEBOUNCE_MS = 200;
+
 export const useChatSystem = (currentUser, isLoggedIn) => {
     // Friends System State
     const [friends, setFriends] = useState([]);
@@ -11,6 +13,8 @@ export const useChatSystem = (currentUser, isLoggedIn) => {
     const [activeChatFriend, setActiveChatFriend] = useState(null);
     const [chatMessages, setChatMessages] = useState([]);
     const [isLoadingChat, setIsLoadingChat] = useState(false);
+    const [olderMessagesCursor, setOlderMessagesCursor] = useState(null); // X-Next-Cursor of the oldest loaded page
+    const [isLoadingOlder, setIsLoadingOlder] = useState(false);
     const [ws, setWs] = useState(null);
     const [connectionStatus, setConnectionStatus] = useState('connecting'); // 'connecting' | 'open' | 'closed'
 
@@ -18,6 +22,8 @@ export const useChatSystem = (currentUser, isLoggedIn) => {
     const [userSearchQuery, setUserSearchQuery] = useState('');
     const [userSearchResults, setUserSearchResults] = useState([]);
     const [isSearching, setIsSearching] = useState(false);
+    const searchTimerRef = useRef(null);
+    const searchAbortRef = useRef(null);
 
     // --- Friends Functions ---
 
@@ -25,44 +31,64 @@ export const useChatSystem = (currentUser, isLoggedIn) => {
         if (!isLoggedIn) return;
         const token = localStorage.getItem('token');
         try {
-            const [resFriends, resRec, resSent] = await Promise.all([
-                fetch(`${import.meta.env.VITE_API_URL}/friends`, { headers: { 'Authorization': `Bearer ${token}` } }),
-                fetch(`${import.meta.env.VITE_API_URL}/friends/requests/received`, { headers: { 'Authorization': `Bearer ${token}` } }),
-                fetch(`${import.meta.env.VITE_API_URL}/friends/requests/sent`, { headers: { 'Authorization': `Bearer ${token}` } })
-            ]);
-
-            if (resFriends.ok) setFriends(await resFriends.json());
-            if (resRec.ok) setFriendRequests(await resRec.json());
-            if (resSent.ok) setSentFriendRequests(await resSent.json());
+            const response = await fetch(`${import.meta.env.VITE_API_URL}/friends/overview`, {
+                headers: { 'Authorization': `Bearer ${token}` }
+            });
+
+            if (response.ok) {
+                const data = await response.json();
+                setFriends(data.friends);
+                setFriendRequests(data.received);
+                setSentFriendRequests(data.sent);
+            }
         } catch (e) {
             console.error("Failed to fetch friends data", e);
         }
     }, [isLoggedIn]);
 
-    const searchUsers = async (query) => {
-        if (!query) {
+    // Drops the pending keystroke's search and aborts the one in flight
+    const cancelUserSearch = () => {
+        clearTimeout(searchTimerRef.current);
+        searchAbortRef.current?.abort();
+        searchAbortRef.current = null;
+    };
+
+    // Called on every keystroke: only the last one in a burst reaches the API,
+    // and a newer search aborts an older one so its results can't land late
+    const searchUsers = (query) => {
+        cancelUserSearch();
+        const trimmed = (query || '').trim();
+        const cleanQuery = trimmed.startsWith('@') ? trimmed.slice(1) : trimmed;
+        if (!cleanQuery) {
             setUserSearchResults([]);
+            setIsSearching(false);
             return;
         }
         setIsSearching(true);
-        const token = localStorage.getItem('token');
-        const trimmed = query.trim();
-        const cleanQuery = trimmed.startsWith('@') ? trimmed.slice(1) : trimmed;
 
-        try {
-            const response = await fetch(`${import.meta.env.VITE_API_URL}/users/search?query=${encodeURIComponent(cleanQuery)}`, {
-                headers: { 'Authorization': `Bearer ${token}` }
-            });
+        searchTimerRef.current = setTimeout(async () => {
+            const controller = new AbortController();
+            searchAbortRef.current = controller;
+            const token = localStorage.getItem('token');
+            try {
+                const response = await fetch(`${import.meta.env.VITE_API_URL}/users/search?query=${encodeURIComponent(cleanQuery)}`, {
+                    headers: { 'Authorization': `Bearer ${token}` },
+                    signal: controller.signal
+                });
 
-            if (response.ok) {
-                const data = await response.json();
-                setUserSearchResults(data);
+                if (response.ok) {
+                    const data = await response.json();
+                    if (!controller.signal.aborted) setUserSearchResults(data);
+                }
+            } catch (e) {
+                if (e.name !== 'AbortError') console.error("Failed to search users", e);
+            } finally {
+                if (searchAbortRef.current === controller) {
+                    searchAbortRef.current = null;
+                    setIsSearching(false);
+                }
             }
-        } catch (e) {
-            console.error("Failed to search users", e);
-        } finally {
-            setIsSearching(false);
-        }
+        }, USER_SEARCH_DEBOUNCE_MS);
     };
 
     const sendFriendRequest = async (userId) => {
@@ -75,6 +101,8 @@ export const useChatSystem = (currentUser, isLoggedIn) => {
             if (response.ok) {
                 toast.success("Friend request sent!");
                 fetchFriendsData();
+                cancelUserSearch();
+                setIsSearching(false);
                 setUserSearchResults([]);
                 setUserSearchQuery('');
             } else {
@@ -111,12 +139,16 @@ export const useChatSystem = (currentUser, isLoggedIn) => {
     const fetchChatHistory = useCallback(async (friendId) => {
         const token = localStorage.getItem('token');
         setIsLoadingChat(true);
+        setOlderMessagesCursor(null);
         try {
             const response = await fetch(`${import.meta.env.VITE_API_URL}/chat/history/${friendId}`, {
                 headers: { 'Authorization': `Bearer ${token}` }
             });
             if (response.ok) {
-                setChatMessages(await response.json());
+                // History comes back newest first; the chat window renders oldest first
+                const messages = await response.json();
+                setChatMessages(messages.reverse());
+                setOlderMessagesCursor(response.headers.get('X-Next-Cursor'));
             }
         } catch (e) {
             console.error("Failed to fetch chat history", e);
@@ -125,6 +157,29 @@ export const useChatSystem = (currentUser, isLoggedIn) => {
         }
     }, []);
 
+    // Prepends the next page of older messages, following the history cursor
+    const loadOlderMessages = async () => {
+        if (!activeChatFriend || !olderMessagesCursor || isLoadingOlder) return;
+        const friendId = activeChatFriend.id;
+        const token = localStorage.getItem('token');
+        setIsLoadingOlder(true);
+        try {
+            const response = await fetch(`${import.meta.env.VITE_API_URL}/chat/history/${friendId}?before=${encodeURIComponent(olderMessagesCursor)}`, {
+                headers: { 'Authorization': `Bearer ${token}` }
+            });
+            // Ignore the page if the user switched to another chat meanwhile
+            if (response.ok && activeChatFriendRef.current?.id === friendId) {
+                const older = (await response.json()).reverse();
+                setChatMessages(prev => [...older.filter(m => !prev.some(p => p.id === m.id)), ...prev]);
+                setOlderMessagesCursor(response.headers.get('X-Next-Cursor'));
+            }
+        } catch (e) {
+            console.error("Failed to load older messages", e);
+        } finally {
+            setIsLoadingOlder(false);
+        }
+    };
+
     const handleSendMessage = (content) => {
         if (!content.trim() || !ws || ws.readyState !== WebSocket.OPEN) return;
 
@@ -138,6 +193,9 @@ export const useChatSystem = (currentUser, isLoggedIn) => {
 
     // --- Effects ---
 
+    // Don't let a pending search fire after unmount
+    useEffect(() => cancelUserSearch, []);
+
     // Initial fetch and auto-refresh for friends
     useEffect(() => {
         if (isLoggedIn) {
@@ -206,6 +264,11 @@ export const useChatSystem = (currentUser, isLoggedIn) => {
                     return;
                 }
 
+                if (msg.type === 'error') {
+                    toast.error(msg.detail || "Message could not be sent.");
+                    return;
+                }
+
                 // Handle Chat Messages
                 const currentActive = activeChatFriendRef.current;
 
@@ -259,6 +322,9 @@ export const useChatSystem = (currentUser, isLoggedIn) => {
         setActiveChatFriend,
         chatMessages,
         isLoadingChat,
+        hasOlderMessages: Boolean(olderMessagesCursor),
+        isLoadingOlder,
+        loadOlderMessages,
         connectionStatus,
         userSearchQuery,
         setUserSearchQuery,
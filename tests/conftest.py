@@ -0,0 +1,34 @@
+"""
+Shared setup: main.py configures its engines at import time, so point it at a
+throwaway SQLite database before any test imports it.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='the-loop-tests-')}/test.db"
+os.environ["ADMIN_EMAILS"] = "admin@example.com"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def make_user(client):
+    """Signs up (once) and logs in a user, returning their auth headers."""
+    def make(username: str, password: str = "password123") -> dict:
+        email = f"{username}@example.com"
+        client.post("/users/signup", json={"email": email, "username": username, "password": password})
+        response = client.post("/users/login", data={"username": email, "password": password})
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return make
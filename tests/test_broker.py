@@ -0,0 +1,172 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import main
+import message_broker
+from message_broker import Broker, InProcessBroker, UnixSocketBroker, make_broker
+
+
+def test_broker_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        Broker()
+
+
+def test_transport_must_implement_publish_and_stop():
+    class NoPublish(Broker):
+        async def stop(self):
+            pass
+
+    class NoStop(Broker):
+        def publish(self, message: dict):
+            pass
+
+    for transport in (NoPublish, NoStop):
+        with pytest.raises(TypeError):
+            transport()
+
+
+def test_make_broker_builds_concrete_transports(tmp_path):
+    assert isinstance(make_broker("memory://"), InProcessBroker)
+    assert isinstance(make_broker(f"unix://{tmp_path}/broker.sock"), UnixSocketBroker)
+    with pytest.raises(ValueError):
+        make_broker("redis://localhost")
+
+
+class FakeConnection:
+    """Stands in for a ClientConnection: just the outbound queue."""
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue()
+        self.writer = None
+
+    def received(self) -> list:
+        items = []
+        while not self.queue.empty():
+            items.append(json.loads(self.queue.get_nowait()))
+        return items
+
+
+async def until(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def start_worker(path, worker_id: str) -> main.ConnectionManager:
+    manager = main.ConnectionManager(UnixSocketBroker(str(path)), worker_id=worker_id)
+    await manager.start()
+    await until(lambda: manager.broker.is_hub or manager.broker.upstream is not None)
+    return manager
+
+
+async def stop_workers(*managers):
+    for manager in managers:
+        if manager.settle_task:
+            manager.settle_task.cancel()
+        await manager.broker.stop()
+
+
+@pytest.fixture
+def all_friends(monkeypatch):
+    async def friends_of(db, user_id):
+        return {1, 2, 3} - {user_id}
+    monkeypatch.setattr(main.friend_graph, "friends_of", friends_of)
+
+
+def offline_statuses(connection: FakeConnection) -> set:
+    return {message["user_id"] for message in connection.received() if message.get("status") == "offline"}
+
+
+def test_workers_share_presence_and_messages(client, tmp_path, all_friends):
+    async def scenario():
+        hub = await start_worker(tmp_path / "broker.sock", "w0")
+        worker = await start_worker(tmp_path / "broker.sock", "w1")
+        users = {user_id: FakeConnection(user_id) for user_id in (1, 2, 3)}
+        hub.add(users[1])
+        worker.add(users[2])
+        await until(lambda: worker.is_online(1) and hub.is_online(2))
+
+        # A late worker learns the others' users from their presence_sync replies
+        late = await start_worker(tmp_path / "broker.sock", "w2")
+        await until(lambda: late.is_online(1) and late.is_online(2))
+        late.add(users[3])
+        await until(lambda: hub.is_online(3) and worker.is_online(3))
+
+        late.enqueue('"from w2"', 2)
+        worker.enqueue('"from w1"', 1)
+        await until(lambda: not users[2].queue.empty() and not users[1].queue.empty())
+        assert users[2].received() == ["from w2"]
+        assert users[1].received() == ["from w1"]
+
+        # A client worker exits: the hub sends worker_gone
+        await late.broker.stop()
+        await until(lambda: not hub.is_online(3) and not worker.is_online(3))
+        await until(lambda: not users[1].queue.empty() and not users[2].queue.empty())
+        assert offline_statuses(users[1]) == offline_statuses(users[2]) == {3}
+        await stop_workers(hub, worker)
+    client.portal.call(scenario)
+
+
+def test_hub_exit_marks_its_users_offline(client, tmp_path, monkeypatch, all_friends):
+    monkeypatch.setattr(main, "BROKER_HANDOVER_SECONDS", 0.3)
+
+    async def scenario():
+        hub, a, b = [await start_worker(tmp_path / "broker.sock", f"w{i}") for i in range(3)]
+        users = {user_id: FakeConnection(user_id) for user_id in (1, 2, 3)}
+        for manager, user_id in ((hub, 1), (a, 2), (b, 3)):
+            manager.add(users[user_id])
+        await until(lambda: all(manager.is_online(user_id) for manager in (hub, a, b) for user_id in users))
+
+        # Nobody is left to send worker_gone for the hub itself
+        await hub.broker.stop()
+        await until(lambda: not a.is_online(1) and not b.is_online(1))
+        assert a.is_online(3) and b.is_online(2)
+        assert offline_statuses(users[2]) == offline_statuses(users[3]) == {1}
+
+        # The survivors elected a new hub and still reach each other
+        assert a.broker.is_hub != b.broker.is_hub
+        a.enqueue('"after handover"', 3)
+        await until(lambda: not users[3].queue.empty())
+        assert users[3].received() == ["after handover"]
+        await stop_workers(a, b)
+    client.portal.call(scenario)
+
+
+def test_frames_published_between_hubs_are_delivered(tmp_path):
+    path = str(tmp_path / "broker.sock")
+
+    async def scenario():
+        received = {name: [] for name in ("hub", "early", "late")}
+
+        async def start(broker, name):
+            async def handler(message):
+                received[name].append(message["n"])
+            async def on_connected():
+                pass
+            await broker.start(handler, on_connected)
+            await until(lambda: broker.is_hub or broker.upstream is not None)
+
+        hub, early, late = UnixSocketBroker(path), UnixSocketBroker(path), UnixSocketBroker(path)
+        late.publish({"kind": "test", "n": 1}) # No hub yet: held until connected
+        await start(hub, "hub")
+        await start(early, "early")
+        early.publish({"kind": "test", "n": 2}) # late is still reconnecting
+        await until(lambda: received["hub"] == [2])
+        await start(late, "late")
+        await until(lambda: received["late"] == [2] and received["hub"] == [2, 1] and received["early"] == [1])
+        for broker in (hub, early, late):
+            await broker.stop()
+    asyncio.run(scenario())
+
+
+def test_backlog_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(message_broker, "BROKER_MAX_BACKLOG_FRAMES", 2)
+    broker = UnixSocketBroker(str(tmp_path / "broker.sock"))
+    for n in range(3):
+        broker.publish({"kind": "test", "n": n})
+    assert len(broker.backlog) == 2
+    assert broker.dropped == 1
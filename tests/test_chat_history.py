@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta
+
+import main
+from main import ChatMessage, conversation_key
+
+
+def test_pages_follow_time_order_across_id_blocks(client, make_user):
+    me, friend = make_user("history_me"), make_user("history_friend")
+    my_id = client.get("/users/me", headers=me).json()["id"]
+    friend_id = client.get("/users/me", headers=friend).json()["id"]
+    key = conversation_key(my_id, friend_id)
+
+    # Two workers' id blocks (500.. and 900..) interleaved in time, plus two messages in the same instant
+    started = datetime(2030, 1, 1, 12)
+    rows = []
+    for i in range(30):
+        message_id = (500 if i % 2 else 900) + i
+        timestamp = started + timedelta(seconds=i // 2 * 2 + (i % 2))
+        rows.append({"id": message_id, "sender_id": my_id if i % 3 else friend_id, "receiver_id": friend_id if i % 3 else my_id,
+                     "conversation_key": key, "content": f"m{i}", "timestamp": timestamp})
+    rows.append({**rows[-1], "id": 499, "content": "same instant"})
+    with main.SessionLocal() as db:
+        db.execute(main.insert(ChatMessage), rows)
+        db.commit()
+
+    expected = [row["id"] for row in sorted(rows, key=lambda row: (row["timestamp"], row["id"]), reverse=True)]
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 7, **({"before": cursor} if cursor else {})}
+        response = client.get(f"/chat/history/{friend_id}", params=params, headers=me)
+        assert response.status_code == 200
+        seen += [message["id"] for message in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == expected
+
+
+def test_invalid_cursor_is_rejected(client, make_user):
+    me = make_user("history_me")
+    assert client.get("/chat/history/1", params={"before": "yesterday"}, headers=me).status_code == 400
@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import main
+from main import ChatBacklogFull, ChatWriter
+
+
+class FakeDatabaseWriter(ChatWriter):
+    """A ChatWriter whose inserts go to a list, failing as scripted, with no backoff sleeps."""
+    def __init__(self, failures=(), bad_ids=(), **options):
+        super().__init__(max_batch=50, flush_interval=0.01, id_block_size=10,
+                         max_pending=options.get("max_pending", 100), submit_timeout=options.get("submit_timeout", 1.0))
+        self.failures = list(failures)
+        self.bad_ids = set(bad_ids)
+        self.stored = []
+
+    def _retry_delay(self, attempt):
+        return None if self.stopping and attempt >= main.CHAT_FLUSH_RETRIES else 0
+
+    def _insert(self, rows):
+        if self.failures:
+            raise self.failures.pop(0)
+        if any(row["id"] in self.bad_ids for row in rows):
+            raise IntegrityError("INSERT", {}, Exception("FOREIGN KEY constraint failed"))
+        self.stored.extend(rows)
+
+
+def messages(count: int):
+    return [{"id": i, "sender_id": 1, "receiver_id": 2, "conversation_key": "1:2", "content": f"m{i}", "timestamp": datetime.now()}
+            for i in range(1, count + 1)]
+
+
+def test_transient_errors_are_retried_without_dropping():
+    # Many more failures than CHAT_FLUSH_RETRIES: a running writer keeps retrying
+    outage = [OperationalError("INSERT", {}, Exception("database is locked"))] * (main.CHAT_FLUSH_RETRIES * 3)
+    writer = FakeDatabaseWriter(failures=outage)
+    writer._flush(messages(5))
+    assert [row["id"] for row in writer.stored] == [1, 2, 3, 4, 5]
+    assert writer.dropped_messages == 0
+
+
+def test_integrity_error_drops_only_the_bad_row():
+    writer = FakeDatabaseWriter(bad_ids={3})
+    writer._flush(messages(5))
+    assert [row["id"] for row in writer.stored] == [1, 2, 4, 5]
+    assert writer.dropped_messages == 1
+
+
+def test_transient_error_during_row_split_is_retried():
+    writer = FakeDatabaseWriter(bad_ids={2})
+    original_insert = writer._insert
+    calls = []
+
+    def insert(rows):
+        calls.append(len(rows))
+        if len(calls) == 2:
+            raise OperationalError("INSERT", {}, Exception("connection reset"))
+        original_insert(rows)
+    writer._insert = insert
+    writer._flush(messages(3))
+    assert [row["id"] for row in writer.stored] == [1, 3]
+    assert writer.dropped_messages == 1
+
+
+def test_full_queue_pushes_back_on_submit(client):
+    writer = FakeDatabaseWriter(max_pending=2, submit_timeout=0.05) # Never started, so nothing drains
+
+    async def fill():
+        await writer.submit(1, 2, "a")
+        await writer.submit(1, 2, "b")
+        with pytest.raises(ChatBacklogFull):
+            await writer.submit(1, 2, "c")
+    client.portal.call(fill)
+    assert len(writer.pending) == 2
+    assert writer.rejected_messages == 1
+
+
+def test_invalid_receiver_gets_an_error_frame(client, make_user):
+    headers = make_user("chat_sender")
+    me = client.get("/users/me", headers=headers).json()
+    token = headers["Authorization"].split()[1]
+    with client.websocket_connect(f"/ws/chat/{me['id']}?token={token}") as socket:
+        for receiver_id in (987654, "2", None, True):
+            socket.send_json({"receiver_id": receiver_id, "content": "hello"})
+            frame = socket.receive_json()
+            assert frame["type"] == "error", frame
+    assert not [m for m in main.chat_writer.pending if m["sender_id"] == me["id"]]
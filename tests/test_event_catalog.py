@@ -0,0 +1,56 @@
+import asyncio
+
+import main
+
+EVENT = dict(title="Catalog test", description="d", start_at="2030-01-01T10:00", end_at="2030-01-01T11:00",
+             venue="V", lat=30.35, lng=76.36, tags=["catalog-test"])
+
+
+def run(client, coroutine_function):
+    return client.portal.call(coroutine_function)
+
+
+def test_concurrent_expired_requests_reload_once(client):
+    client.get("/events")
+    catalog = main.event_catalog
+    catalog.loaded_at = -1e9
+    catalog._fingerprint = None # Forces a full reload
+    full_loads = catalog.full_loads
+
+    async def many():
+        async def one():
+            async with main.AsyncSessionLocal() as db:
+                await catalog.ensure_loaded(db)
+        await asyncio.gather(*(one() for _ in range(10)))
+    run(client, many)
+    assert catalog.full_loads == full_loads + 1
+
+
+def test_unchanged_table_skips_full_reload(client):
+    client.get("/events")
+    catalog = main.event_catalog
+    full_loads, version = catalog.full_loads, catalog.version
+    catalog.loaded_at = -1e9
+    client.get("/events")
+    assert catalog.full_loads == full_loads
+    assert catalog.version == version
+
+
+def test_catalog_changed_message_applies_one_event(client, make_user):
+    admin = make_user("admin")
+    client.get("/events")
+    event_id = client.post("/events", json=EVENT, headers=admin).json()["id"]
+    catalog = main.event_catalog
+    # Pretend the write happened on another worker: drop it locally, then replay the message
+    catalog.remove(event_id)
+    full_loads = catalog.full_loads
+
+    async def deliver():
+        await main.manager.handle_broker_message({"kind": "catalog_changed", "event_id": event_id})
+    run(client, deliver)
+    assert catalog.events[event_id].title == "Catalog test"
+    assert catalog.full_loads == full_loads
+
+    client.delete(f"/events/{event_id}", headers=admin)
+    run(client, lambda: main.manager.handle_broker_message({"kind": "catalog_changed", "event_id": event_id}))
+    assert event_id not in catalog.events
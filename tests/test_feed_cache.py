@@ -0,0 +1,42 @@
+import numpy as np
+
+import main
+
+
+def cached_feed(client, headers) -> main.UserFeed:
+    client.get("/events", headers=headers)
+    return main.feed_cache.feeds[client.get("/users/me", headers=headers).json()["id"]]
+
+
+def test_feed_is_compact_and_keeps_the_float64_scores(client, make_user):
+    headers = make_user("feeduser")
+    client.put("/users/me", headers=headers, json={"interests": ["tech", "music"]})
+    feed = cached_feed(client, headers)
+
+    assert (feed.ids.dtype, feed.scores.dtype) == (np.int32, np.float64)
+    assert feed.nbytes == 12 * len(feed.ids)
+
+    event_ids, scores = main.recommender.score_all(feed.interests, feed.magnitude)
+    expected = sorted(zip(event_ids.tolist(), scores.tolist()), key=lambda pair: (-int(pair[1] * 100), pair[0]))
+    assert list(zip(feed.ids.tolist(), feed.scores.tolist())) == expected
+    assert np.all(np.diff(feed.sort_keys()) > 0)
+
+    # Both fields come from the same float64 score
+    events = client.get("/events", headers=headers).json()
+    assert [(event["id"], event["match_score"]) for event in events] == expected
+    assert all(event["match_percentage"] == int(event["match_score"] * 100) for event in events)
+
+
+def test_cursor_walk_matches_full_feed(client, make_user):
+    headers = make_user("feedwalker")
+    client.put("/users/me", headers=headers, json={"interests": ["tech"]})
+    full = client.get("/events", headers=headers).json()
+
+    seen, cursor = [], None
+    while True:
+        response = client.get("/events", headers=headers, params={"limit": 4, **({"cursor": cursor} if cursor else {})})
+        seen += response.json()
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert [event["id"] for event in seen] == [event["id"] for event in full]
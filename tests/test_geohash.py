@@ -0,0 +1,50 @@
+import os
+import random
+
+import pytest
+from sqlalchemy import Column, MetaData, String, Table, create_engine, or_, select
+
+from main import GEOHASH_BASE32, geohash_cell_condition, geohash_cell_end, geohash_encode
+
+
+def random_geohashes(count: int, seed: int = 7):
+    rng = random.Random(seed)
+    return [geohash_encode(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(count)]
+
+
+def test_cell_end_is_next_cell():
+    assert geohash_cell_end("u4pr") == "u4ps"
+    assert geohash_cell_end("u4pz") == "u4q"
+    assert geohash_cell_end("9") == "b"
+    assert geohash_cell_end("zz") is None
+    assert geohash_cell_end("") is None
+
+
+def test_ranges_hold_when_punctuation_is_ignored():
+    # en_US-style collations skip punctuation, so a "{" sentinel bound would
+    # collapse onto the cell itself; the next-cell bound must not depend on it
+    collate = lambda value: "".join(ch for ch in value if ch.isalnum())
+    hashes = random_geohashes(2000)
+    for cell in ["", "u", "u4", "9z", "zz"] + [h[:3] for h in hashes[:50]]:
+        end = geohash_cell_end(cell)
+        inside = {h for h in hashes if collate(h) >= collate(cell) and (end is None or collate(h) < collate(end))}
+        assert inside == {h for h in hashes if h.startswith(cell)}
+
+
+def test_every_base32_character_has_a_successor():
+    for char in GEOHASH_BASE32[:-1]:
+        assert geohash_cell_end(char) == GEOHASH_BASE32[GEOHASH_BASE32.index(char) + 1]
+
+
+@pytest.mark.skipif(not os.getenv("TEST_POSTGRES_URL"), reason="set TEST_POSTGRES_URL to run against Postgres")
+def test_ranges_under_postgres_default_collation():
+    """The range query must match prefixes under the database's own (usually en_US.UTF-8) collation."""
+    engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+    table = Table("geohash_range_test", MetaData(), Column("geohash", String(9)), prefixes=["TEMPORARY"])
+    hashes = random_geohashes(2000)
+    with engine.connect() as connection:
+        table.create(connection)
+        connection.execute(table.insert(), [{"geohash": h} for h in hashes])
+        for cells in (["u4pr"], ["9z", "b0"], ["zz"], [""], [h[:2] for h in hashes[:8]]):
+            found = set(connection.scalars(select(table.c.geohash).where(or_(*[geohash_cell_condition(table.c.geohash, cell) for cell in cells]))))
+            assert found == {h for h in hashes if any(h.startswith(cell) for cell in cells)}
@@ -0,0 +1,130 @@
+"""
+/auth/google against a fake Google: the verifier's AsyncClient is swapped for
+one on an httpx.MockTransport serving GOOGLE_CERTS_URL and GOOGLE_USERINFO_URL.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt
+from google.auth import jwt as google_jwt
+
+import main
+
+KEY_ID = "test-key"
+ACCESS_TOKEN = "ya29.test-access-token"
+
+
+def make_signing_key():
+    """An RSA key and the self-signed PEM certificate Google would publish for it."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "accounts.google.com")])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return crypt.RSASigner.from_string(key_pem, KEY_ID), cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+SIGNER, CERT_PEM = make_signing_key()
+
+
+def id_token(email: str, **claims) -> str:
+    now = int(time.time())
+    payload = {"iss": "https://accounts.google.com", "sub": email, "email": email,
+               "given_name": "Ada", "family_name": "Lovelace", "iat": now, "exp": now + 600}
+    payload.update(claims)
+    return google_jwt.encode(SIGNER, payload).decode()
+
+
+class FakeGoogle:
+    def __init__(self):
+        self.certs_status = 200
+        self.certs_headers = {"cache-control": "public, max-age=60", "age": "10"}
+        self.requests = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        url = str(request.url)
+        self.requests.append(url)
+        if url == main.GOOGLE_CERTS_URL:
+            if self.certs_status != 200:
+                return httpx.Response(self.certs_status)
+            return httpx.Response(200, json={KEY_ID: CERT_PEM}, headers=self.certs_headers)
+        if url == main.GOOGLE_USERINFO_URL:
+            if request.headers.get("authorization") != f"Bearer {ACCESS_TOKEN}":
+                return httpx.Response(401, json={"error": "invalid_token"})
+            return httpx.Response(200, json={"email": "access-user@example.com", "given_name": "Grace", "family_name": "Hopper"})
+        return httpx.Response(404)
+
+    def cert_fetches(self) -> int:
+        return self.requests.count(main.GOOGLE_CERTS_URL)
+
+
+@pytest.fixture
+def google(client, monkeypatch):
+    fake = FakeGoogle()
+    verifier = main.GoogleVerifier(main.GOOGLE_CERTS_URL, main.GOOGLE_USERINFO_URL, 1.0)
+    verifier.client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handle))
+    monkeypatch.setattr(main, "google_verifier", verifier)
+    yield fake
+    client.portal.call(verifier.close)
+
+
+def test_valid_id_token_signs_in(client, google):
+    response = client.post("/auth/google", json={"token": id_token("id-user@example.com")})
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["is_new_user"] is True
+    assert (body["first_name"], body["last_name"]) == ("Ada", "Lovelace")
+    assert google.requests == [main.GOOGLE_CERTS_URL]
+
+    again = client.post("/auth/google", json={"token": id_token("id-user@example.com")})
+    assert again.status_code == 200
+    assert again.json()["is_new_user"] is False
+
+
+def test_access_token_falls_back_to_userinfo(client, google):
+    response = client.post("/auth/google", json={"token": ACCESS_TOKEN})
+    assert response.status_code == 200, response.text
+    assert response.json()["first_name"] == "Grace"
+    assert google.requests == [main.GOOGLE_CERTS_URL, main.GOOGLE_USERINFO_URL]
+
+
+def test_rejected_tokens_are_400(client, google):
+    assert client.post("/auth/google", json={"token": "not-a-token"}).status_code == 400
+    wrong_issuer = id_token("issuer@example.com", iss="https://evil.example.com")
+    assert client.post("/auth/google", json={"token": wrong_issuer}).status_code == 400
+
+
+def test_certs_are_cached_for_max_age_minus_age(client, google):
+    for _ in range(3):
+        assert client.post("/auth/google", json={"token": id_token("cached@example.com")}).status_code == 200
+    assert google.cert_fetches() == 1
+
+    verifier = main.google_verifier
+    remaining = verifier.certs_expire_at - time.monotonic()
+    assert 45 < remaining <= 50  # max-age=60 less the 10 seconds the response already spent in a cache
+
+    verifier.certs_expire_at = time.monotonic() - 1  # max-age has passed
+    assert client.post("/auth/google", json={"token": id_token("cached@example.com")}).status_code == 200
+    assert google.cert_fetches() == 2
+
+
+def test_certs_outage_is_503(client, google):
+    google.certs_status = 500
+    response = client.post("/auth/google", json={"token": id_token("outage@example.com")})
+    assert response.status_code == 503
+    assert google.requests == [main.GOOGLE_CERTS_URL]  # No fallback guess at the token's type
@@ -0,0 +1,39 @@
+import asyncio
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+import main
+
+
+def test_interest_writers_lock_the_user_row():
+    statement = str(main.lock_user_row(1).compile(dialect=postgresql.dialect()))
+    # NO KEY UPDATE: plain FOR UPDATE would deadlock with the KEY SHARE lock a user_events insert takes
+    assert statement.endswith("FOR NO KEY UPDATE")
+
+
+def test_concurrent_interest_updates_all_reach_the_vector(client, make_user):
+    headers = make_user("vectoruser")
+    user_id = client.get("/users/me", headers=headers).json()["id"]
+    interests = [f"vector-tag-{i}" for i in range(8)]
+
+    async def concurrently():
+        async def bump(tag):
+            async with main.AsyncSessionLocal() as db:
+                await main.bump_join_interests(db, user_id, {tag: 1})
+                await db.commit()
+        await asyncio.gather(*(bump(tag) for tag in interests))
+
+        async with main.AsyncSessionLocal() as db:
+            packed = await db.scalar(select(main.User.interest_vector).where(main.User.id == user_id))
+            rows = dict((await db.execute(
+                select(main.Tag.id, main.UserInterest.score)
+                .join(main.Tag, main.Tag.name == main.UserInterest.interest)
+                .where(main.UserInterest.user_id == user_id)
+            )).all())
+        return packed, rows
+
+    packed, rows = client.portal.call(concurrently)
+    tag_ids, weights = main.unpack_interests(packed)
+    assert len(rows) == len(interests)
+    assert dict(zip(tag_ids.tolist(), weights.tolist())) == rows
@@ -0,0 +1,74 @@
+"""
+Regression tests for N+1 queries: the number of SQL statements behind the
+carpool endpoints must not grow with the number of groups and requests.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event as sa_event
+
+import main
+from main import CarpoolGroup, CarpoolRequest, Event
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    sa_event.listen(main.async_engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        sa_event.remove(main.async_engine.sync_engine, "before_cursor_execute", record)
+
+
+def user_id(client, headers) -> int:
+    return client.get("/users/me", headers=headers).json()["id"]
+
+
+def seed_carpools(owner_id: int, other_id: int, requester_ids, groups: int) -> int:
+    """A fresh event with `groups` groups owned by owner_id (each requested by every requester)
+    and `groups` groups owned by other_id that owner_id asked to join."""
+    with main.SessionLocal() as db:
+        event = Event(title=f"Carpool event {groups}", description="d", start_at=datetime(2030, 1, 1, 10), end_at=datetime(2030, 1, 1, 12),
+                      venue="V", lat=30.35, lng=76.36)
+        db.add(event)
+        db.flush()
+        for i in range(groups):
+            mine = CarpoolGroup(event_id=event.id, owner_id=owner_id, location=f"Gate {i}", time="10:00", capacity=4)
+            theirs = CarpoolGroup(event_id=event.id, owner_id=other_id, location=f"Lot {i}", time="11:00", capacity=4)
+            db.add_all([mine, theirs])
+            db.flush()
+            for n, requester_id in enumerate(requester_ids):
+                db.add(CarpoolRequest(group_id=mine.id, requester_id=requester_id, status="accepted" if n % 2 else "pending"))
+            db.add(CarpoolRequest(group_id=theirs.id, requester_id=owner_id))
+        db.commit()
+        return event.id
+
+
+@pytest.mark.parametrize("path, max_statements", [
+    ("/events/{event_id}/carpool", 2), # Groups with owners, then accepted members
+    ("/carpool/requests/received", 1),
+    ("/carpool/requests/sent", 1),
+])
+def test_carpool_query_count_is_constant(client, make_user, path, max_statements):
+    owner = make_user("carpool_owner")
+    other = make_user("carpool_other")
+    requesters = [user_id(client, make_user(f"carpool_rider{i}")) for i in range(3)]
+    owner_id, other_id = user_id(client, owner), user_id(client, other)
+
+    counts = {}
+    for groups in (1, 5, 25):
+        event_id = seed_carpools(owner_id, other_id, requesters, groups)
+        url = path.format(event_id=event_id)
+        assert client.get(url, headers=owner).status_code == 200 # Warms the principal cache
+        with count_statements() as statements:
+            response = client.get(url, headers=owner)
+        assert response.status_code == 200
+        counts[groups] = len(statements)
+
+    assert counts[1] == counts[5] == counts[25], counts
+    assert counts[25] <= max_statements, counts
@@ -0,0 +1,85 @@
+import asyncio
+import threading
+import time
+
+from sqlalchemy import delete, update
+
+import main
+
+
+def search(client, headers, query):
+    return [user["username"] for user in client.get("/users/search", params={"query": query}, headers=headers).json()]
+
+
+def deliver(client, user_id):
+    client.portal.call(lambda: main.manager.handle_broker_message({"kind": "user_search_changed", "user_id": user_id}))
+
+
+def write_elsewhere(client, statement):
+    """Changes the users table the way another worker would: without touching this worker's index."""
+    async def run():
+        async with main.AsyncSessionLocal() as db:
+            await db.execute(statement)
+            await db.commit()
+    client.portal.call(run)
+
+
+def test_user_search_changed_updates_one_user(client, make_user):
+    searcher = make_user("searcher")
+    renamed = make_user("quokka")
+    user_id = client.get("/users/me", headers=renamed).json()["id"]
+    assert search(client, searcher, "quokka") == ["quokka"]
+    index = main.user_search_index
+    loaded_at = index.loaded_at
+
+    write_elsewhere(client, update(main.User).where(main.User.id == user_id).values(first_name="Wallaby"))
+    deliver(client, user_id)
+    assert search(client, searcher, "wallaby") == ["quokka"]
+
+    write_elsewhere(client, delete(main.User).where(main.User.id == user_id))
+    deliver(client, user_id)
+    assert search(client, searcher, "quokka") == []
+    assert index.loaded_at == loaded_at  # Applied in place, no rebuild
+
+
+def test_reload_builds_off_the_loop_and_keeps_concurrent_writes(client, make_user, monkeypatch):
+    searcher = make_user("reloadsearcher")
+    renamed = make_user("reloader")
+    user_id = client.get("/users/me", headers=renamed).json()["id"]
+    assert search(client, searcher, "reloader") == ["reloader"]
+    index = main.user_search_index
+
+    build = main.UserSearchIndex._build.__func__
+    build_threads = []
+    building = threading.Event()
+
+    def slow_build(cls, rows):
+        build_threads.append(threading.get_ident())
+        building.set()
+        time.sleep(0.2)
+        return build(cls, rows)
+    monkeypatch.setattr(main.UserSearchIndex, "_build", classmethod(slow_build))
+
+    async def scenario():
+        async def expired_search():
+            async with main.AsyncSessionLocal() as db:
+                await index.ensure_loaded(db)
+        index.loaded_at = -1e9
+        reloads = asyncio.gather(*(expired_search() for _ in range(5)))
+        while not building.is_set():
+            await asyncio.sleep(0.01)
+        # The loop is free while the thread builds: the old index still answers and a rename lands
+        assert [user["username"] for user in index.search("reloader", 10, set())] == ["reloader"]
+        async with main.AsyncSessionLocal() as db:
+            user = await db.get(main.User, user_id)
+            user.first_name = "Kookaburra"
+            await db.commit()
+            await db.refresh(user)
+            index.put(user)
+        await reloads
+        return threading.get_ident()
+
+    loop_thread = client.portal.call(scenario)
+    assert len(build_threads) == 1
+    assert build_threads[0] != loop_thread
+    assert search(client, searcher, "kookaburra") == ["reloader"]